@@ -1,4 +1,7 @@
-from database import SessionLocal
+import hmac
+import os
+from database import SessionLocal, AsyncSessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 from fastapi import Depends, HTTPException, status, Header
@@ -10,6 +13,9 @@ from typing import Optional
 import models
 from utils.security import security_handler
 
+# /internal endpoints are served only when this is set, and only to requests
+# sending it in the X-Internal-Token header
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN", "")
 
 
 def get_db():
@@ -19,16 +25,21 @@ def get_db():
     finally:
         db.close()
 
-async def verify_app_user(
-    api_key: str = Header(..., description="API key for authentication"),
-    db: Session = Depends(get_db)
-):
-    return security_handler.verify_api_key(db, api_key)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
 async def get_current_app_user(
     api_key: str = Header(None, description="API key required for authentication"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     if not api_key:
         raise HTTPException(status_code=401, detail="API key is required")
-    return security_handler.verify_api_key(db, api_key)
\ No newline at end of file
+    return await security_handler.verify_api_key_async(db, api_key)
+
+def require_internal_token(x_internal_token: str = Header(None)):
+    if not INTERNAL_API_TOKEN:
+        # Disabled: look like any unknown route
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_internal_token or not hmac.compare_digest(x_internal_token.encode(), INTERNAL_API_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid internal token")
@@ -3,10 +3,28 @@ from datetime import datetime, timedelta
 import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import db
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 import json
 # from main import firebase_admin
 import os
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.credential_cache import credential_cache
+from utils.event_logger import FirebaseEventLogger
+
+# Logins fall back to the credential cache when Firebase takes longer than this
+FIREBASE_LOOKUP_TIMEOUT_SECONDS = float(os.getenv("FIREBASE_LOOKUP_TIMEOUT_SECONDS", "2"))
+FIREBASE_CREDENTIAL_SYNC = os.getenv("FIREBASE_CREDENTIAL_SYNC", "true").lower() in ("1", "true", "yes")
+
+_lookup_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="firebase-lookup")
+_credential_listener = None
+_credential_listener_lock = threading.Lock()
+
+# events and logs entries are queued and uploaded as multi-path updates;
+# the first upload initializes Firebase, off the request path
+event_logger = FirebaseEventLogger(lambda: get_firebase_controller().ref)
+
 class FirebaseController:
     def __init__(self):
         try:
@@ -25,7 +43,9 @@ class FirebaseController:
                 #     "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_X509_CERT_URL"),
                 #     "universe_domain": os.getenv("FIREBASE_UNIVERSE_DOMAIN")
                 # }
-                cred = credentials.Certificate("firebase.json")
+                # With FIREBASE_DATABASE_EMULATOR_HOST set, firebase_admin talks to a
+                # local Realtime Database emulator and needs no service account
+                cred = None if os.getenv("FIREBASE_DATABASE_EMULATOR_HOST") else credentials.Certificate("firebase.json")
                 firebase_admin.initialize_app(cred, {
                     'databaseURL': os.getenv("FIREBASE_DATABASE_URL")
                 })
@@ -35,11 +55,35 @@ class FirebaseController:
             self.logs_ref = self.ref.child('logs')
             self.success_ref = self.ref.child('success')
             self.error_ref = self.ref.child('error')
+            self.start_credential_sync()
 
         except Exception as e:
             print(f"Firebase initialization error: {str(e)}")
             raise
 
+    def start_credential_sync(self) -> None:
+        """
+        Stream app_users into the local credential cache: one snapshot, then
+        only changes. Started once per process.
+        """
+        global _credential_listener
+        if not FIREBASE_CREDENTIAL_SYNC:
+            return
+        with _credential_listener_lock:
+            if _credential_listener is not None:
+                return
+
+            def on_event(event):
+                try:
+                    credential_cache.apply_event(event.event_type, event.path, event.data)
+                except Exception as e:
+                    print(f"Error applying app_users change: {str(e)}")
+
+            try:
+                _credential_listener = self.ref.child('app_users').listen(on_event)
+            except Exception as e:
+                print(f"Could not start app_users sync: {str(e)}")
+
     def log_event(self, event_type: str, data: Dict[str, Any]) -> None:
         try:
             timestamp = datetime.now().isoformat()
@@ -48,10 +92,9 @@ class FirebaseController:
                 "type": event_type,
                 **data
             }
-            # Debugging: Event data being pushed to Firebase
+            # Written to Firebase in batches by the background event logger
             print(f"Logging event: {event_type} with data: {json.dumps(event_data)}")
-            self.events_ref.push(event_data)
-            print(f"Event logged successfully: {event_type}")
+            event_logger.log('events', event_data)
         except Exception as e:
             print(f"Error logging event: {str(e)}")
 
@@ -64,8 +107,7 @@ class FirebaseController:
             }
             # Debugging: Server activity log data
             print(f"Logging server activity: {log_type} with message: {message}")
-            self.logs_ref.push(log_data)
-            print(f"Server activity logged successfully: {log_type}")
+            event_logger.log('logs', log_data)
         except Exception as e:
             print(f"Error logging server activity: {str(e)}")
 
@@ -106,57 +148,99 @@ class FirebaseController:
         print(f"Logging user creation event: {user_name} ({user_type})")
         self.log_event("user_creation", event_data)
 
+    def _find_app_user(self, user_name: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Indexed lookup of one app user by name. The database rules need
+        "app_users": {".indexOn": ["name"]}, or Firebase rejects the query.
+        """
+        matches = self.ref.child('app_users').order_by_child('name').equal_to(user_name).get()
+        for key, user in (matches or {}).items():
+            return key, user
+        return None
+
     def verify_app_user(self, user_name: str, user_password: str) -> Dict[str, Any]:
         """
-        Verify user credentials
+        Verify user credentials against the synced local cache, falling back
+        to an indexed Firebase lookup. If Firebase is slow or down, a cached
+        entry is used even when the cache is not fully synced.
         """
         print(f"Verifying user credentials for {user_name}...")
+        if credential_cache.synced:
+            cached = credential_cache.verify(user_name, user_password)
+            if cached and cached["status"]:
+                print(f"User found in credential cache: {user_name}")
+                return cached
+
         try:
-            user_ref = self.ref.child('app_users')
-            all_users = user_ref.get()
-            print(f"Fetched users from Firebase: {json.dumps(all_users)}")
-
-            if all_users is not None:
-                for user_id, user in all_users.items():  # Iterate through the dictionary of users
-                    print(f"Checking user {user['name']} against {user_name}")
-                    if user['name'] == user_name and user['password'] == user_password:
-                        print(f"User found: {user_name}")
-                        return {"status": True, "message": "User found", "email": user['email']}
-            print(f"User not found: {user_name}")
-            return {"status": False, "message": "User not found", "email": None}
+            found = _lookup_executor.submit(self._find_app_user, user_name).result(
+                timeout=FIREBASE_LOOKUP_TIMEOUT_SECONDS
+            )
         except Exception as e:
-            print(f"Error verifying user: {str(e)}")
+            print(f"Firebase lookup failed for {user_name}: {str(e) or type(e).__name__}")
+            stale = credential_cache.verify(user_name, user_password, stale=True)
+            if stale is not None:
+                return stale
             return {"status": False, "message": "Verification failed", "email": None}
 
+        if found is not None:
+            key, user = found
+            credential_cache.upsert(key, user)
+            if hmac.compare_digest(str(user.get('password')), user_password):
+                print(f"User found: {user_name}")
+                return {"status": True, "message": "User found", "email": user.get('email')}
+        print(f"User not found: {user_name}")
+        return {"status": False, "message": "User not found", "email": None}
+
     def create_app_user(self, user_name: str, user_password: str, user_email: str   ) -> Dict[str, Any]:
         """
         Create a new app user
         """
         print(f"Creating user: {user_name}")
         try:
-            user_ref = self.ref.child('app_users')
-            all_users = user_ref.get()
-
-            if all_users is not None:
-                print(f"Users fetched from Firebase: {json.dumps(all_users)}")
-                for user_id, user in all_users.items():
-
-                    if user['name'] is not None and user['name'] == user_name:
-                        print(f"User {user_name} already exists!")
-                        return {"status": False, "message": "User already exists"}
+            if self._find_app_user(user_name) is not None:
+                print(f"User {user_name} already exists!")
+                return {"status": False, "message": "User already exists"}
             
             # User does not exist, create new user
-            user_ref.push({
+            user = {
                 "name": user_name,
                 "password": user_password,
                 "email": user_email,
-            })
+            }
+            new_ref = self.ref.child('app_users').push(user)
+            credential_cache.upsert(new_ref.key, user)
             print(f"User {user_name} created successfully")
             return {"status": True, "message": "User created successfully"}
         except Exception as e:
             print(f"Error creating user: {str(e)}")
             return {"status": False, "message": "User creation failed"}
 
-    
-# Create a single instance
-firebase_controller = FirebaseController()
+    def delete_app_user(self, user_name: str) -> bool:
+        """Remove an app user, e.g. one whose local app_users row could not be written"""
+        try:
+            found = self._find_app_user(user_name)
+            if found is None:
+                return False
+            key, _ = found
+            self.ref.child('app_users').child(key).delete()
+            credential_cache.upsert(key, None)
+            print(f"User {user_name} deleted")
+            return True
+        except Exception as e:
+            print(f"Error deleting user {user_name}: {str(e)}")
+            return False
+
+_firebase_controller = None
+_firebase_controller_lock = threading.Lock()
+
+def get_firebase_controller() -> FirebaseController:
+    """
+    Shared controller, created on first use so importing this module needs
+    neither firebase.json nor the network
+    """
+    global _firebase_controller
+    if _firebase_controller is None:
+        with _firebase_controller_lock:
+            if _firebase_controller is None:
+                _firebase_controller = FirebaseController()
+    return _firebase_controller
@@ -1,24 +1,91 @@
+import time
+# Measured from the first import so /internal/metrics shows the whole boot
+_boot_started = time.perf_counter()
 import os
+import threading
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+# Load environment variables before database.py reads its pool settings
+load_dotenv()
+
 from fastapi import FastAPI, Depends, UploadFile, File, Form, Query
 from fastapi.responses import  JSONResponse
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine, sessionmaker
+from database import SessionLocal, engine, sessionmaker, pool_status
 import models
+from migrations import apply_migrations
 from uuid import uuid4
 from fastapi import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 
 from sqlalchemy import func
-from dotenv import load_dotenv
 import json
 from fastapi.responses import FileResponse
-# Load environment variables from .env file
-load_dotenv()
 
 from routes import analytics, app_users_handler, food_router, push_update, qr, users
 from routes import face_capture
-app = FastAPI()
+from utils.api_key_cache import api_key_cache, start_invalidation_listener
+from utils.response_cache import response_cache
+from utils.render_queue import shutdown_render_executor
+from utils.smtp_pool import email_worker
+from utils.email_outbox import outbox_drainer, outbox_status
+from utils.credential_cache import credential_cache
+from utils.maintenance import maintenance_scheduler
+from dependencies import require_internal_token
+from firebase_controller import event_logger, get_firebase_controller
+
+UPLOAD_DIR = "uploads"
+IMAGE_DIR = "images"
+# Run create_all and the SQL migrations on startup; disable on workers when a
+# release step applies them once instead
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"
+# Connect to Firebase in the background at startup instead of on the first login
+FIREBASE_WARM_START = os.getenv("FIREBASE_WARM_START", "true").lower() == "true"
+
+startup_timings = {}
+
+def prepare_schema():
+    # Create tables and migrate under one lock, so workers booting together don't race
+    apply_migrations(engine, models.Base.metadata)
+
+def warm_firebase_controller():
+    try:
+        get_firebase_controller()
+    except Exception as e:
+        print(f"Error initializing Firebase: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    startup_timings["import_ms"] = round((started - _boot_started) * 1000, 1)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    if DB_AUTO_MIGRATE:
+        await run_in_threadpool(prepare_schema)
+        startup_timings["schema_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    # Shares API key invalidations across workers when API_KEY_CACHE_NOTIFY is set
+    start_invalidation_listener(engine, api_key_cache)
+    # Disable with EMAIL_OUTBOX_DRAIN=false on workers that should not send
+    outbox_drainer.start()
+    # Key expiry, file purges and rollup rebuilds; disable with MAINTENANCE_SCHEDULER=false
+    maintenance_scheduler.start()
+    if FIREBASE_WARM_START:
+        threading.Thread(target=warm_firebase_controller, name="firebase-warm-start", daemon=True).start()
+    startup_timings["startup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    startup_timings["boot_ms"] = round((time.perf_counter() - _boot_started) * 1000, 1)
+    print(f"Startup complete: {startup_timings}")
+    yield
+    maintenance_scheduler.stop()
+    # Let queued card renders finish, then stop sending; unsent emails stay in the outbox
+    shutdown_render_executor()
+    outbox_drainer.stop()
+    email_worker.shutdown()
+    # Upload queued Firebase events; anything that fails is spilled to disk
+    event_logger.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -29,16 +96,6 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
-# Create Tables
-models.Base.metadata.create_all(bind=engine)
-UPLOAD_DIR = "uploads"
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
-
-IMAGE_DIR = "images"
-if not os.path.exists(IMAGE_DIR):
-    os.makedirs(IMAGE_DIR)
-
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
@@ -47,12 +104,13 @@ def get_db():
     finally:
         db.close()
 # Mount the static directory
-app.mount("/static", StaticFiles(directory="uploads"), name="static")
+# The directories are created in lifespan, after the mounts are declared
+app.mount("/static", StaticFiles(directory=UPLOAD_DIR, check_dir=False), name="static")
 # app.mount("/static/app_users", StaticFiles(directory="app_users"), name="app_users")
 # app.mount("/static/images", StaticFiles(directory="institutions"), name="institutions")
-app.mount("/images", StaticFiles(directory="images"), name="images")
+app.mount("/images", StaticFiles(directory=IMAGE_DIR, check_dir=False), name="images")
 
-app.mount("/uploads", StaticFiles(directory="uploads"))
+app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR, check_dir=False))
 app.include_router(users.router, prefix="/users", tags=["users"])
 # app.include_router(institutions.router, prefix="/institutions", tags=["institutions"])
 app.include_router(qr.router, prefix="/qr", tags=["qr"])
@@ -69,6 +127,24 @@ async def check():
 async def health_check():
     return {"status": "ok"}
 
+# Plain def: stats() may query the postgres cache backend, so keep it off the event loop
+@app.get("/internal/metrics", dependencies=[Depends(require_internal_token)])
+def internal_metrics():
+    return {
+        "db_pool": pool_status(),
+        "api_key_cache": api_key_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "email": email_worker.stats(),
+        "credential_cache": credential_cache.stats(),
+        "firebase_events": event_logger.stats(),
+        "maintenance": maintenance_scheduler.stats(),
+        "startup": startup_timings
+    }
+
+@app.get("/internal/email-outbox", dependencies=[Depends(require_internal_token)])
+def email_outbox_status(db: Session = Depends(get_db)):
+    return outbox_status(db)
+
 # Face get route
 
 
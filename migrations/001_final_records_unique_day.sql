@@ -0,0 +1,36 @@
+-- Merge duplicate (user_id, entry_date) records into the oldest one, then
+-- enforce one final record per user per day for the check-in upsert.
+WITH logs AS (
+    SELECT fr.user_id, fr.entry_date,
+           jsonb_agg(t.elem ORDER BY fr.record_id, t.ord) AS time_logs
+    FROM final_records fr
+    CROSS JOIN LATERAL jsonb_array_elements(COALESCE(fr.time_logs, '[]'::jsonb)) WITH ORDINALITY AS t(elem, ord)
+    GROUP BY fr.user_id, fr.entry_date
+),
+dupes AS (
+    SELECT user_id, entry_date, min(record_id) AS keep_id,
+           (array_agg(face_image_path ORDER BY record_id) FILTER (WHERE face_image_path IS NOT NULL))[1] AS face_image_path
+    FROM final_records
+    GROUP BY user_id, entry_date
+    HAVING count(*) > 1
+)
+UPDATE final_records f
+SET time_logs = COALESCE(l.time_logs, '[]'::jsonb),
+    face_image_path = COALESCE(f.face_image_path, d.face_image_path)
+FROM dupes d
+LEFT JOIN logs l ON l.user_id = d.user_id AND l.entry_date = d.entry_date
+WHERE f.record_id = d.keep_id;
+
+DELETE FROM final_records f
+USING final_records k
+WHERE f.user_id = k.user_id
+  AND f.entry_date = k.entry_date
+  AND f.record_id > k.record_id;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_final_records_user_day') THEN
+        ALTER TABLE final_records
+            ADD CONSTRAINT uq_final_records_user_day UNIQUE (user_id, entry_date);
+    END IF;
+END $$;
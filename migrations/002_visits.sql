@@ -0,0 +1,43 @@
+-- Normalized visits table: one row per arrival instead of entries in
+-- final_records.time_logs. Backfills every existing time log entry.
+CREATE TABLE IF NOT EXISTS visits (
+    visit_id SERIAL PRIMARY KEY,
+    record_id INTEGER REFERENCES final_records (record_id),
+    user_id INTEGER NOT NULL REFERENCES users (user_id),
+    arrival TIMESTAMP WITH TIME ZONE NOT NULL,
+    departure TIMESTAMP WITH TIME ZONE,
+    duration INTERVAL,
+    entry_type VARCHAR NOT NULL DEFAULT 'normal',
+    bypass_details JSONB,
+    face_image_path VARCHAR,
+    app_user_id VARCHAR REFERENCES app_users (user_id),
+    departure_verified_by VARCHAR
+);
+
+CREATE INDEX IF NOT EXISTS ix_visits_visit_id ON visits (visit_id);
+CREATE INDEX IF NOT EXISTS ix_visits_record_id ON visits (record_id);
+CREATE INDEX IF NOT EXISTS ix_visits_user_id_arrival ON visits (user_id, arrival);
+CREATE INDEX IF NOT EXISTS ix_visits_arrival ON visits (arrival);
+
+-- Time logs without an offset were written in IST
+SET LOCAL TIME ZONE 'Asia/Kolkata';
+
+INSERT INTO visits (
+    record_id, user_id, arrival, departure, duration, entry_type,
+    bypass_details, face_image_path, app_user_id, departure_verified_by
+)
+SELECT fr.record_id,
+       fr.user_id,
+       (t.log->>'arrival')::timestamptz,
+       (t.log->>'departure')::timestamptz,
+       (t.log->>'departure')::timestamptz - (t.log->>'arrival')::timestamptz,
+       COALESCE(t.log->>'entry_type', 'normal'),
+       t.log->'bypass_details',
+       t.log->>'face_image_path',
+       fr.app_user_id,
+       t.log->>'departure_verified_by'
+FROM final_records fr
+CROSS JOIN LATERAL jsonb_array_elements(COALESCE(fr.time_logs, '[]'::jsonb)) WITH ORDINALITY AS t(log, ord)
+WHERE t.log->>'arrival' IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM visits v WHERE v.record_id = fr.record_id)
+ORDER BY fr.record_id, t.ord;
@@ -0,0 +1,36 @@
+-- Hourly/daily/group rollups for /analytics, filled from existing visits.
+-- Regenerate at any time with: python -m tasks.rollups
+CREATE TABLE IF NOT EXISTS analytics_hourly_rollups (
+    day DATE NOT NULL,
+    hour INTEGER NOT NULL,
+    group_name VARCHAR NOT NULL DEFAULT '',
+    entries INTEGER NOT NULL DEFAULT 0,
+    completed_visits INTEGER NOT NULL DEFAULT 0,
+    total_duration_minutes DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, hour, group_name)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_daily_visitors (
+    day DATE NOT NULL,
+    group_name VARCHAR NOT NULL DEFAULT '',
+    user_id INTEGER NOT NULL REFERENCES users (user_id),
+    PRIMARY KEY (day, group_name, user_id)
+);
+
+TRUNCATE analytics_hourly_rollups, analytics_daily_visitors;
+
+INSERT INTO analytics_hourly_rollups (day, hour, group_name, entries, completed_visits, total_duration_minutes)
+SELECT (v.arrival AT TIME ZONE 'Asia/Kolkata')::date,
+       extract(hour FROM v.arrival AT TIME ZONE 'Asia/Kolkata')::integer,
+       COALESCE(u.group_name, ''),
+       count(*),
+       count(*) FILTER (WHERE v.duration > interval '0'),
+       COALESCE(sum(extract(epoch FROM v.duration) / 60) FILTER (WHERE v.duration > interval '0'), 0)
+FROM visits v
+JOIN users u ON u.user_id = v.user_id
+GROUP BY 1, 2, 3;
+
+INSERT INTO analytics_daily_visitors (day, group_name, user_id)
+SELECT DISTINCT (v.arrival AT TIME ZONE 'Asia/Kolkata')::date, COALESCE(u.group_name, ''), v.user_id
+FROM visits v
+JOIN users u ON u.user_id = v.user_id;
@@ -0,0 +1,10 @@
+-- Data version counter for cached dashboard responses, and the shared
+-- cache store used when RESPONSE_CACHE_BACKEND=postgres.
+CREATE SEQUENCE IF NOT EXISTS data_version_seq;
+
+CREATE UNLOGGED TABLE IF NOT EXISTS response_cache (
+    cache_key VARCHAR PRIMARY KEY,
+    version BIGINT NOT NULL,
+    payload JSONB NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL
+);
@@ -0,0 +1,14 @@
+-- Render jobs created by a bulk import point back at it so progress can be
+-- counted per import.
+CREATE TABLE IF NOT EXISTS import_jobs (
+    import_id VARCHAR PRIMARY KEY,
+    source VARCHAR,
+    total_rows INTEGER NOT NULL DEFAULT 0,
+    inserted INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    errors JSONB NOT NULL DEFAULT '[]'::jsonb,
+    created_at TIMESTAMP
+);
+
+ALTER TABLE render_jobs ADD COLUMN IF NOT EXISTS import_id VARCHAR REFERENCES import_jobs (import_id);
+CREATE INDEX IF NOT EXISTS ix_render_jobs_import_id ON render_jobs (import_id);
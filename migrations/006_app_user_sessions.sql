@@ -0,0 +1,23 @@
+-- API keys move from the single app_users.api_key column to one row per
+-- device login. Unexpired keys carry over, stored as their SHA-256.
+CREATE TABLE IF NOT EXISTS app_user_sessions (
+    session_id SERIAL PRIMARY KEY,
+    app_user_id VARCHAR NOT NULL REFERENCES app_users (user_id) ON DELETE CASCADE,
+    key_hash VARCHAR NOT NULL,
+    device_id VARCHAR,
+    created_at TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    last_seen_at TIMESTAMP NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_app_user_sessions_key_hash ON app_user_sessions (key_hash);
+CREATE INDEX IF NOT EXISTS ix_app_user_sessions_expires_at ON app_user_sessions (expires_at);
+CREATE INDEX IF NOT EXISTS ix_app_user_sessions_user_device ON app_user_sessions (app_user_id, device_id);
+
+INSERT INTO app_user_sessions (app_user_id, key_hash, created_at, expires_at, last_seen_at)
+SELECT user_id, encode(sha256(convert_to(api_key, 'UTF8')), 'hex'),
+       timezone('UTC', now()), api_key_expiry, timezone('UTC', now())
+FROM app_users
+WHERE api_key IS NOT NULL AND api_key_expiry > timezone('UTC', now())
+ON CONFLICT (key_hash) DO NOTHING;
+
+UPDATE app_users SET api_key = NULL, api_key_expiry = NULL WHERE api_key IS NOT NULL;
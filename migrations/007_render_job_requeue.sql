@@ -0,0 +1,6 @@
+-- Render jobs only live in the submitting process, so queued rows left by a
+-- crash or redeploy are resubmitted by the maintenance scheduler.
+ALTER TABLE render_jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE render_jobs ADD COLUMN IF NOT EXISTS submitted_at TIMESTAMP;
+UPDATE render_jobs SET submitted_at = coalesce(created_at, timezone('UTC', now())) WHERE submitted_at IS NULL;
+CREATE INDEX IF NOT EXISTS ix_render_jobs_queued ON render_jobs (submitted_at) WHERE status = 'queued';
@@ -0,0 +1,10 @@
+-- Record the visitor's group on each visit, so a departure updates the
+-- rollup bucket its arrival was counted in even after a group change.
+-- Existing visits take the user's current group, which is what the
+-- rollups were built from.
+ALTER TABLE visits ADD COLUMN IF NOT EXISTS group_name VARCHAR NOT NULL DEFAULT '';
+
+UPDATE visits v
+SET group_name = u.group_name
+FROM users u
+WHERE u.user_id = v.user_id AND u.group_name IS NOT NULL AND v.group_name = '';
@@ -0,0 +1,46 @@
+import os
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Arbitrary constant shared by every worker that runs migrations
+MIGRATION_LOCK_KEY = 7262019
+
+def apply_migrations(engine: Engine, metadata=None) -> list:
+    """
+    Apply pending SQL migrations in filename order, creating metadata's
+    missing tables first when given.
+    Workers booting together queue on a session advisory lock, and each reads
+    schema_migrations only once it holds the lock, so a migration runs once.
+    Each migration runs in its own transaction and is recorded in schema_migrations.
+    """
+    applied_now = []
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        conn.commit()
+        try:
+            if metadata is not None:
+                metadata.create_all(bind=conn)
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "name VARCHAR PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+            ))
+            applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+            conn.commit()
+
+            for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+                if not filename.endswith(".sql") or filename in applied:
+                    continue
+                with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+                    sql = f.read()
+                with conn.begin():
+                    conn.exec_driver_sql(sql)
+                    conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": filename})
+                print(f"Applied migration: {filename}")
+                applied_now.append(filename)
+        finally:
+            # A failed migration leaves its transaction aborted; roll it back first
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            conn.commit()
+    return applied_now
@@ -1,11 +1,18 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, UniqueConstraint, Index, Interval, Float
 from sqlalchemy.orm import relationship, backref
 from datetime import datetime
 from database import Base
-from sqlalchemy import func
+from sqlalchemy import func, text
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 import pytz  # Import pytz for timezone handling
 
+def to_naive_utc(value: datetime) -> datetime:
+    """
+    Convert an aware datetime to the naive UTC value stored in DateTime columns.
+    asyncpg refuses aware values for timestamp without time zone.
+    """
+    return value.astimezone(pytz.UTC).replace(tzinfo=None) if value.tzinfo else value
+
 class User(Base):
     __tablename__ = "users"
     
@@ -29,19 +36,41 @@ class AppUsers(Base):
     email = Column(String, unique=False, index=True)
     image_path = Column(String,nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.now(pytz.timezone('Asia/Kolkata')))
+    # No longer written: keys live in app_user_sessions. Session copies of an
+    # app user (see utils.security.session_user) carry the presented key here.
     api_key = Column(String, unique=True, nullable=True)
     api_key_expiry = Column(DateTime, nullable=True)
 
-    
+class AppUserSession(Base):
+    __tablename__ = "app_user_sessions"
+    __table_args__ = (
+        Index("ix_app_user_sessions_user_device", "app_user_id", "device_id"),
+    )
+
+    # One API key per device login; only the SHA-256 of the key is stored.
+    # Timestamps are naive UTC. last_seen_at is refreshed at a coarse interval.
+    session_id = Column(Integer, primary_key=True, index=True)
+    app_user_id = Column(String, ForeignKey("app_users.user_id", ondelete="CASCADE"), nullable=False)
+    key_hash = Column(String, nullable=False, unique=True, index=True)
+    device_id = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    last_seen_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
 class FinalRecords(Base):
     __tablename__ = "final_records"
+    # One record per user per day; check-in upserts against this constraint
+    __table_args__ = (
+        UniqueConstraint("user_id", "entry_date", name="uq_final_records_user_day"),
+    )
 
     record_id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.user_id"), unique=False)
     entry_date = Column(Date, default=datetime.utcnow().date())
     # app_user_id = Column(Integer, ForeignKey("app_users.user_id"), nullable=True)
         
-    # Time tracking using JSONB
+    # Legacy time tracking using JSONB, superseded by the visits table.
+    # Kept so records written before the migration stay readable.
     time_logs = Column(JSONB, default=list)  # Store array of time entries
     # Example structure:
     # [
@@ -64,6 +93,129 @@ class FinalRecords(Base):
     # Relationship
     # user = relationship("User", back_populates="final_records")
 
+class Visit(Base):
+    __tablename__ = "visits"
+    __table_args__ = (
+        Index("ix_visits_user_id_arrival", "user_id", "arrival"),
+        Index("ix_visits_arrival", "arrival"),
+    )
+
+    # One append-only row per arrival, replacing FinalRecords.time_logs entries
+    visit_id = Column(Integer, primary_key=True, index=True)
+    record_id = Column(Integer, ForeignKey("final_records.record_id"), nullable=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    arrival = Column(DateTime(timezone=True), nullable=False)
+    departure = Column(DateTime(timezone=True), nullable=True)
+    duration = Column(Interval, nullable=True)
+    entry_type = Column(String, nullable=False, default="normal")  # or "bypass"
+    bypass_details = Column(JSONB, nullable=True)  # only present if entry_type is "bypass"
+    face_image_path = Column(String, nullable=True)
+    app_user_id = Column(String, ForeignKey("app_users.user_id"), nullable=True)
+    departure_verified_by = Column(String, nullable=True)
+    # The user's group when they arrived ('' for none); analytics and rollups
+    # count the visit under it even if the user changes group later
+    group_name = Column(String, nullable=False, default="", server_default="")
+
+class AnalyticsHourlyRollup(Base):
+    __tablename__ = "analytics_hourly_rollups"
+
+    # Visit totals per IST day, hour and group ('' when the user has no group)
+    day = Column(Date, primary_key=True)
+    hour = Column(Integer, primary_key=True)
+    group_name = Column(String, primary_key=True, default="")
+    entries = Column(Integer, nullable=False, default=0)
+    completed_visits = Column(Integer, nullable=False, default=0)
+    total_duration_minutes = Column(Float, nullable=False, default=0)
+
+class AnalyticsDailyVisitor(Base):
+    __tablename__ = "analytics_daily_visitors"
+
+    # Distinct visitors per IST day and group, used for unique-user counts
+    day = Column(Date, primary_key=True)
+    group_name = Column(String, primary_key=True, default="")
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+
+    # Bulk registration import; per-user rendering is tracked in render_jobs
+    import_id = Column(String, primary_key=True)
+    source = Column(String, nullable=True)
+    total_rows = Column(Integer, nullable=False, default=0)
+    inserted = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    errors = Column(JSONB, nullable=False, default=list)  # [{"row": n, "email": ..., "error": ...}]
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class RenderJob(Base):
+    __tablename__ = "render_jobs"
+    __table_args__ = (
+        Index("ix_render_jobs_queued", "submitted_at", postgresql_where=text("status = 'queued'")),
+    )
+
+    # QR and visitor card rendering queued by registration
+    job_id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False, index=True)
+    import_id = Column(String, ForeignKey("import_jobs.import_id"), nullable=True, index=True)
+    status = Column(String, nullable=False, default="queued")  # queued, done or failed
+    qr_path = Column(String, nullable=True)
+    card_path = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    # Queued jobs not finished within RENDER_JOB_TIMEOUT_SECONDS of
+    # submitted_at are resubmitted, up to RENDER_JOB_MAX_ATTEMPTS times
+    attempts = Column(Integer, nullable=False, default=1, server_default="1")
+    submitted_at = Column(DateTime, default=datetime.utcnow)
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        Index("ix_email_outbox_pending", "next_attempt_at", postgresql_where=text("status = 'pending'")),
+    )
+
+    # Written in the same transaction as the change that triggers the email;
+    # sent by the outbox drainer. next_attempt_at doubles as the claim lease.
+    email_id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # welcome
+    to_email = Column(String, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=True, index=True)
+    render_job_id = Column(String, ForeignKey("render_jobs.job_id"), nullable=True)  # wait for the card
+    payload = Column(JSONB, nullable=False, default=dict)
+    status = Column(String, nullable=False, default="pending")  # pending, sent or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    sender_account = Column(String, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+class EmailAccountUsage(Base):
+    __tablename__ = "email_account_usage"
+
+    # Sends per sender account per IST day, shared by every drainer
+    account = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    sent = Column(Integer, nullable=False, default=0)
+
+class EmailAccountRate(Base):
+    __tablename__ = "email_account_rate"
+
+    # Per sender account token bucket, shared by every drainer
+    account = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class MaintenanceRun(Base):
+    __tablename__ = "maintenance_runs"
+
+    # Last run of each scheduled maintenance job, shared by every worker
+    job = Column(String, primary_key=True)
+    finished_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    duration_ms = Column(Float, nullable=True)
+    result = Column(JSONB, nullable=True)
+    error = Column(String, nullable=True)
+
 class FoodRecords(Base):
     __tablename__ = "food_records"
 
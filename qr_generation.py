@@ -1,35 +1,57 @@
 import qrcode
 import os
 import json
+import hashlib
+from io import BytesIO
+from PIL import Image
 QR_DIR = "qrs"
 os.makedirs(QR_DIR,exist_ok=True)
 
-def generate_qr_code(user_id : int, name : str, email : str):
-    # Create a dictionary with user data
+def qr_payload(user_id : int, name : str, email : str) -> str:
+    """JSON encoded in a user's QR code"""
     user_data = {
         "user_id": user_id,
         "name": name,
         "email": email
     }
-    # Convert to JSON string
-    qr_data = json.dumps(user_data)
-    qr = qrcode.make(qr_data)
-    qr_path = os.path.join(QR_DIR,f"qr_code_{user_id}.png")
-    qr.save(qr_path)
-    # Convert to JSON string
-    qr_data = json.dumps(user_data)
-    qr = qrcode.make(qr_data)
-    qr_path = os.path.join(QR_DIR,f"qr_code_{user_id}.png")
-    qr.save(qr_path)
+    return json.dumps(user_data)
+
+def qr_cache_path(payload : str) -> str:
+    """QR files are content-addressed: same payload, same file"""
+    digest = hashlib.sha256(payload.encode()).hexdigest()
+    return os.path.join(QR_DIR, f"qr_{digest}.png")
+
+def encode_qr(payload : str) -> bytes:
+    buffer = BytesIO()
+    qrcode.make(payload).save(buffer)
+    return buffer.getvalue()
+
+def load_or_create_qr(user_id : int, name : str, email : str):
+    """
+    Return (qr_path, qr_image, png_bytes) for a user. The QR is encoded only when
+    no file exists for this payload; re-issuing an unchanged user reads it back.
+    """
+    payload = qr_payload(user_id, name, email)
+    qr_path = qr_cache_path(payload)
+    try:
+        with open(qr_path, "rb") as f:
+            png = f.read()
+    except FileNotFoundError:
+        png = encode_qr(payload)
+        # Write then rename so concurrent workers never see a partial file
+        tmp_path = f"{qr_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(png)
+        os.replace(tmp_path, qr_path)
+    qr_img = Image.open(BytesIO(png))
+    qr_img.load()
+    return qr_path, qr_img, png
+
+def generate_qr_code(user_id : int, name : str, email : str):
+    qr_path, _, _ = load_or_create_qr(user_id, name, email)
     return qr_path
 
 def generate_qr_codes(users : list[dict]):
     for user in users:
-        user_data = {
-            "user_id": user["user_id"],
-            "name": user["name"],
-            "email": user["email"]
-        }
-        qr_data = json.dumps(user_data)
-        qr_path = generate_qr_code(qr_data)
+        qr_path = generate_qr_code(user["user_id"], user["name"], user["email"])
         print(f"QR code generated for {user['name']} at {qr_path}")
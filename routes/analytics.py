@@ -1,18 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import func, distinct, and_
+from sqlalchemy import func, distinct, and_, case, cast, extract, tuple_, Date, Integer
 from dependencies import get_db
 import models
 from datetime import datetime, timedelta
 from typing import Optional
 from collections import defaultdict
 import pytz
+from utils.response_cache import response_cache
 
 router = APIRouter()
 
+IST = pytz.timezone('Asia/Kolkata')
+
 def get_current_time():
     """Get current time in IST"""
-    return datetime.now(pytz.timezone('Asia/Kolkata'))
+    return datetime.now(IST)
+
+def localize(value: datetime) -> datetime:
+    """Treat naive query datetimes as IST so they compare against timestamptz"""
+    return IST.localize(value) if value.tzinfo is None else value
 
 def validate_date_range(start_date: Optional[datetime], end_date: Optional[datetime]) -> tuple:
     """Validate and convert date range to IST"""
@@ -27,144 +34,340 @@ def validate_date_range(start_date: Optional[datetime], end_date: Optional[datet
 
     return start_date, end_date
 
+def analytics_filters(start_date: datetime, end_date: datetime, group_name: Optional[str], user_id: Optional[int]) -> list:
+    """Filters on visits for the requested range; groups are those at arrival"""
+    base_filters = [
+        models.Visit.arrival.between(localize(start_date), localize(end_date))
+    ]
+
+    if group_name:
+        base_filters.append(models.Visit.group_name == group_name)
+    if user_id:
+        base_filters.append(models.Visit.user_id == user_id)
+    return base_filters
+
+def collect_stats_python(db: Session, base_filters: list) -> dict:
+    """Aggregate visits row by row in Python"""
+    # Initialize statistics containers
+    stats = {
+        'hourly_stats': defaultdict(int),
+        'entry_stats': {
+            'total_entries': 0,
+            'unique_users': set(),
+            'total_duration_minutes': 0,
+            'completed_visits': 0  # visits with both entry and exit
+        },
+        'group_stats': defaultdict(lambda: {
+            'total_entries': 0,
+            'unique_users': set(),
+            'total_duration': 0
+        }),
+        'daily_stats': defaultdict(lambda: {
+            'entries': 0,
+            'unique_users': set(),
+            'total_duration': 0,
+            'groups': defaultdict(set)  # group_name -> set of user_ids
+        })
+    }
+
+    visits = db.query(
+        models.Visit.user_id,
+        models.Visit.arrival,
+        models.Visit.duration,
+        models.Visit.group_name
+    ).filter(*base_filters).all()
+
+    for visit in visits:
+        # Process arrival time
+        arrival_time = visit.arrival.astimezone(IST)
+        date_str = arrival_time.date().isoformat()
+        hour = arrival_time.hour
+
+        # Update basic stats
+        stats['hourly_stats'][hour] += 1
+        stats['entry_stats']['total_entries'] += 1
+        stats['entry_stats']['unique_users'].add(visit.user_id)
+
+        # Update group stats
+        if visit.group_name:
+            stats['group_stats'][visit.group_name]['total_entries'] += 1
+            stats['group_stats'][visit.group_name]['unique_users'].add(visit.user_id)
+
+        # Update daily stats
+        stats['daily_stats'][date_str]['entries'] += 1
+        stats['daily_stats'][date_str]['unique_users'].add(visit.user_id)
+        if visit.group_name:
+            stats['daily_stats'][date_str]['groups'][visit.group_name].add(visit.user_id)
+
+        # Duration is only set once the visit has a departure
+        if visit.duration is not None:
+            duration = visit.duration.total_seconds() / 60
+            if duration > 0:
+                stats['entry_stats']['total_duration_minutes'] += duration
+                stats['entry_stats']['completed_visits'] += 1
+                if visit.group_name:
+                    stats['group_stats'][visit.group_name]['total_duration'] += duration
+                stats['daily_stats'][date_str]['total_duration'] += duration
+
+    # Reduce user sets to counts, the shape collect_stats_sql returns
+    stats['entry_stats']['unique_users'] = len(stats['entry_stats']['unique_users'])
+    for data in stats['group_stats'].values():
+        data['unique_users'] = len(data['unique_users'])
+    for data in stats['daily_stats'].values():
+        data['unique_users'] = len(data['unique_users'])
+        data['groups'] = {group: len(users) for group, users in data['groups'].items()}
+    return stats
+
+def collect_stats_sql(db: Session, base_filters: list) -> dict:
+    """
+    Aggregate visits inside Postgres with one GROUPING SETS query.
+    Returns the same structure as collect_stats_python.
+    """
+    local_arrival = func.timezone('Asia/Kolkata', models.Visit.arrival)
+    completed_minutes = case(
+        (models.Visit.duration > timedelta(0), extract('epoch', models.Visit.duration) / 60),
+        else_=None
+    )
+    visits = db.query(
+        models.Visit.user_id.label('user_id'),
+        models.Visit.group_name.label('group_name'),
+        cast(local_arrival, Date).label('day'),
+        cast(extract('hour', local_arrival), Integer).label('hour'),
+        completed_minutes.label('minutes')
+    ).filter(*base_filters).subquery()
+
+    rows = db.query(
+        func.grouping(visits.c.hour).label('by_hour'),
+        func.grouping(visits.c.group_name).label('by_group'),
+        func.grouping(visits.c.day).label('by_day'),
+        visits.c.hour,
+        visits.c.group_name,
+        visits.c.day,
+        func.count().label('entries'),
+        func.count(distinct(visits.c.user_id)).label('unique_users'),
+        func.coalesce(func.sum(visits.c.minutes), 0).label('total_duration'),
+        func.count(visits.c.minutes).label('completed_visits')
+    ).group_by(
+        func.grouping_sets(
+            tuple_(),
+            tuple_(visits.c.hour),
+            tuple_(visits.c.group_name),
+            tuple_(visits.c.day),
+            tuple_(visits.c.day, visits.c.group_name)
+        )
+    ).order_by(visits.c.day, visits.c.hour, visits.c.group_name).all()
+
+    stats = {
+        'hourly_stats': {},
+        'entry_stats': {
+            'total_entries': 0,
+            'unique_users': 0,
+            'total_duration_minutes': 0,
+            'completed_visits': 0
+        },
+        'group_stats': {},
+        'daily_stats': {}
+    }
+
+    # grouping() is 0 for the columns a row is grouped by
+    for row in rows:
+        if row.by_hour and row.by_group and row.by_day:
+            stats['entry_stats'] = {
+                'total_entries': row.entries,
+                'unique_users': row.unique_users,
+                'total_duration_minutes': float(row.total_duration),
+                'completed_visits': row.completed_visits
+            }
+        elif not row.by_hour:
+            stats['hourly_stats'][row.hour] = row.entries
+        elif not row.by_day:
+            daily = stats['daily_stats'].setdefault(row.day.isoformat(), {
+                'entries': 0,
+                'unique_users': 0,
+                'total_duration': 0,
+                'groups': {}
+            })
+            if row.by_group:
+                daily['entries'] = row.entries
+                daily['unique_users'] = row.unique_users
+                daily['total_duration'] = float(row.total_duration)
+            elif row.group_name:
+                daily['groups'][row.group_name] = row.unique_users
+        elif row.group_name:
+            stats['group_stats'][row.group_name] = {
+                'total_entries': row.entries,
+                'unique_users': row.unique_users,
+                'total_duration': float(row.total_duration)
+            }
+    return stats
+
+def rollups_cover(start_date: datetime, end_date: datetime, user_id: Optional[int]) -> bool:
+    """Rollups are per IST day and group, so they only answer whole-day, all-user queries"""
+    return user_id is None and localize(start_date).utcoffset() == localize(end_date).utcoffset() == get_current_time().utcoffset()
+
+def collect_stats_rollup(db: Session, start_date: datetime, end_date: datetime, group_name: Optional[str]) -> dict:
+    """
+    Read the incrementally maintained rollup tables instead of raw visits.
+    Returns the same structure as collect_stats_python.
+    """
+    rollup = models.AnalyticsHourlyRollup
+    visitor = models.AnalyticsDailyVisitor
+    rollup_filters = [rollup.day.between(start_date.date(), end_date.date())]
+    visitor_filters = [visitor.day.between(start_date.date(), end_date.date())]
+    if group_name:
+        rollup_filters.append(rollup.group_name == group_name)
+        visitor_filters.append(visitor.group_name == group_name)
+
+    stats = {
+        'hourly_stats': defaultdict(int),
+        'entry_stats': {
+            'total_entries': 0,
+            'unique_users': 0,
+            'total_duration_minutes': 0,
+            'completed_visits': 0
+        },
+        'group_stats': defaultdict(lambda: {
+            'total_entries': 0,
+            'unique_users': 0,
+            'total_duration': 0
+        }),
+        'daily_stats': defaultdict(lambda: {
+            'entries': 0,
+            'unique_users': 0,
+            'total_duration': 0,
+            'groups': {}
+        })
+    }
+
+    buckets = db.query(rollup).filter(*rollup_filters).order_by(rollup.day, rollup.hour).all()
+    for bucket in buckets:
+        date_str = bucket.day.isoformat()
+        stats['hourly_stats'][bucket.hour] += bucket.entries
+        stats['entry_stats']['total_entries'] += bucket.entries
+        stats['entry_stats']['total_duration_minutes'] += bucket.total_duration_minutes
+        stats['entry_stats']['completed_visits'] += bucket.completed_visits
+        stats['daily_stats'][date_str]['entries'] += bucket.entries
+        stats['daily_stats'][date_str]['total_duration'] += bucket.total_duration_minutes
+        if bucket.group_name:
+            stats['group_stats'][bucket.group_name]['total_entries'] += bucket.entries
+            stats['group_stats'][bucket.group_name]['total_duration'] += bucket.total_duration_minutes
+
+    # Distinct visitors for every level in one GROUPING SETS pass
+    unique_rows = db.query(
+        func.grouping(visitor.group_name).label('by_group'),
+        func.grouping(visitor.day).label('by_day'),
+        visitor.group_name,
+        visitor.day,
+        func.count(distinct(visitor.user_id)).label('unique_users')
+    ).filter(*visitor_filters).group_by(
+        func.grouping_sets(
+            tuple_(),
+            tuple_(visitor.group_name),
+            tuple_(visitor.day),
+            tuple_(visitor.day, visitor.group_name)
+        )
+    ).order_by(visitor.day, visitor.group_name).all()
+
+    for row in unique_rows:
+        if row.by_group and row.by_day:
+            stats['entry_stats']['unique_users'] = row.unique_users
+        elif not row.by_day:
+            daily = stats['daily_stats'][row.day.isoformat()]
+            if row.by_group:
+                daily['unique_users'] = row.unique_users
+            elif row.group_name:
+                daily['groups'][row.group_name] = row.unique_users
+        elif row.group_name:
+            stats['group_stats'][row.group_name]['unique_users'] = row.unique_users
+    return stats
+
+def build_analytics_response(start_date: datetime, end_date: datetime, stats: dict) -> dict:
+    # Calculate averages and prepare response
+    total_entries = stats['entry_stats']['total_entries']
+    total_duration = stats['entry_stats']['total_duration_minutes']
+    completed_visits = stats['entry_stats']['completed_visits']
+
+    return {
+        "time_range": {
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "timezone": "Asia/Kolkata"
+        },
+        "overall_statistics": {
+            "total_entries": total_entries,
+            "unique_users": stats['entry_stats']['unique_users'],
+            "average_duration_minutes": round(total_duration / completed_visits if completed_visits > 0 else 0, 2),
+            "completion_rate": round((completed_visits / total_entries * 100) if total_entries > 0 else 0, 2)
+        },
+        "traffic_analysis": {
+            "hourly_distribution": dict(stats['hourly_stats']),
+            "peak_hours": sorted(
+                hour for hour, count in stats['hourly_stats'].items()
+                if count >= max(stats['hourly_stats'].values()) * 0.8
+            ),
+            # Ties broken by hour so every engine returns the same order
+            "busiest_periods": sorted(
+                [(hour, count) for hour, count in stats['hourly_stats'].items()],
+                key=lambda x: (-x[1], x[0])
+            )[:3]
+        },
+        "group_analysis": {
+            group_name: {
+                "total_entries": data['total_entries'],
+                "unique_users": data['unique_users'],
+                "average_duration_minutes": round(
+                    data['total_duration'] / data['total_entries'] if data['total_entries'] > 0 else 0, 2
+                )
+            }
+            for group_name, data in stats['group_stats'].items()
+        },
+        "daily_patterns": {
+            date: {
+                "total_entries": data['entries'],
+                "unique_users": data['unique_users'],
+                "average_duration_minutes": round(
+                    data['total_duration'] / data['entries'] if data['entries'] > 0 else 0, 2
+                ),
+                "group_distribution": dict(data['groups'])
+            }
+            for date, data in stats['daily_stats'].items()
+        }
+    }
+
 @router.get("/analytics")
 def get_analytics(
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     group_name: Optional[str] = None,
     user_id: Optional[int] = None,
+    engine: str = Query(
+        "rollup",
+        pattern="^(rollup|sql|python)$",
+        description="Read rollup tables (rollup), aggregate visits in Postgres (sql) or row by row (python)"
+    ),
     db: Session = Depends(get_db)
 ):
     try:
         # Initialize date range
         start_date, end_date = validate_date_range(start_date, end_date)
+        base_filters = analytics_filters(start_date, end_date, group_name, user_id)
 
-        # Build base query filters
-        base_filters = [
-            models.FinalRecords.entry_date.between(start_date.date(), end_date.date())
-        ]
-        
-        if group_name:
-            base_filters.append(models.User.group_name == group_name)
-        if user_id:
-            base_filters.append(models.FinalRecords.user_id == user_id)
-
-        # Initialize statistics containers
-        stats = {
-            'hourly_stats': defaultdict(int),
-            'entry_stats': {
-                'total_entries': 0,
-                'unique_users': set(),
-                'total_duration_minutes': 0,
-                'completed_visits': 0  # visits with both entry and exit
-            },
-            'group_stats': defaultdict(lambda: {
-                'total_entries': 0,
-                'unique_users': set(),
-                'total_duration': 0
-            }),
-            'daily_stats': defaultdict(lambda: {
-                'entries': 0,
-                'unique_users': set(),
-                'total_duration': 0,
-                'groups': defaultdict(set)  # group_name -> set of user_ids
-            })
-        }
+        def compute():
+            if engine == "rollup" and rollups_cover(start_date, end_date, user_id):
+                stats = collect_stats_rollup(db, start_date, end_date, group_name)
+            elif engine == "python":
+                stats = collect_stats_python(db, base_filters)
+            else:
+                stats = collect_stats_sql(db, base_filters)
+            return build_analytics_response(start_date, end_date, stats)
 
-        # Join with User table to get group information
-        records = db.query(models.FinalRecords, models.User).join(
-            models.User,
-            models.FinalRecords.user_id == models.User.user_id
-        ).filter(*base_filters).all()
-
-        for record, user in records:
-            for log in record.time_logs:
-                # Process arrival time
-                arrival_time = datetime.fromisoformat(log['arrival'])
-                date_str = arrival_time.date().isoformat()
-                hour = arrival_time.hour
-
-                # Update basic stats
-                stats['hourly_stats'][hour] += 1
-                stats['entry_stats']['total_entries'] += 1
-                stats['entry_stats']['unique_users'].add(record.user_id)
-
-                # Update group stats
-                if user.group_name:
-                    stats['group_stats'][user.group_name]['total_entries'] += 1
-                    stats['group_stats'][user.group_name]['unique_users'].add(record.user_id)
-
-                # Update daily stats
-                stats['daily_stats'][date_str]['entries'] += 1
-                stats['daily_stats'][date_str]['unique_users'].add(record.user_id)
-                if user.group_name:
-                    stats['daily_stats'][date_str]['groups'][user.group_name].add(record.user_id)
-
-                # Calculate duration if available
-                if log.get('arrival') and log.get('departure'):
-                    arrival = datetime.fromisoformat(log['arrival'])
-                    departure = datetime.fromisoformat(log['departure'])
-                    duration = (departure - arrival).total_seconds() / 60
-                    if duration > 0:
-                        stats['entry_stats']['total_duration_minutes'] += duration
-                        stats['entry_stats']['completed_visits'] += 1
-                        if user.group_name:
-                            stats['group_stats'][user.group_name]['total_duration'] += duration
-                        stats['daily_stats'][date_str]['total_duration'] += duration
-
-        # Calculate averages and prepare response
-        total_entries = stats['entry_stats']['total_entries']
-        total_duration = stats['entry_stats']['total_duration_minutes']
-        completed_visits = stats['entry_stats']['completed_visits']
-
-        return {
-            "time_range": {
-                "start_date": start_date.isoformat(),
-                "end_date": end_date.isoformat(),
-                "timezone": "Asia/Kolkata"
-            },
-            "overall_statistics": {
-                "total_entries": total_entries,
-                "unique_users": len(stats['entry_stats']['unique_users']),
-                "average_duration_minutes": round(total_duration / completed_visits if completed_visits > 0 else 0, 2),
-                "completion_rate": round((completed_visits / total_entries * 100) if total_entries > 0 else 0, 2)
-            },
-            "traffic_analysis": {
-                "hourly_distribution": dict(stats['hourly_stats']),
-                "peak_hours": [
-                    hour for hour, count in stats['hourly_stats'].items()
-                    if count >= max(stats['hourly_stats'].values()) * 0.8
-                ],
-                "busiest_periods": sorted(
-                    [(hour, count) for hour, count in stats['hourly_stats'].items()],
-                    key=lambda x: x[1],
-                    reverse=True
-                )[:3]
-            },
-            "group_analysis": {
-                group_name: {
-                    "total_entries": data['total_entries'],
-                    "unique_users": len(data['unique_users']),
-                    "average_duration_minutes": round(
-                        data['total_duration'] / data['total_entries'] if data['total_entries'] > 0 else 0, 2
-                    )
-                }
-                for group_name, data in stats['group_stats'].items()
-            },
-            "daily_patterns": {
-                date: {
-                    "total_entries": data['entries'],
-                    "unique_users": len(data['unique_users']),
-                    "average_duration_minutes": round(
-                        data['total_duration'] / data['entries'] if data['entries'] > 0 else 0, 2
-                    ),
-                    "group_distribution": {
-                        group: len(users) for group, users in data['groups'].items()
-                    }
-                }
-                for date, data in stats['daily_stats'].items()
-            }
-        }
+        return response_cache.get_or_compute(db, "analytics", {
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "group_name": group_name,
+            "user_id": user_id,
+            "engine": engine
+        }, compute)
 
     except Exception as e:
         print(f"Analytics error: {str(e)}")
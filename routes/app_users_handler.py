@@ -1,12 +1,20 @@
 import os
+from datetime import datetime
+import pytz
+from typing import Optional
 from fastapi import APIRouter, File, Form, UploadFile, Depends, Header
 import models
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from utils.file_handlers import delete_file
+from utils.image_ingest import ingest_upload
+from uuid import uuid4
 from fastapi import HTTPException
 
-from dependencies import get_db, get_current_app_user
-from firebase_controller import FirebaseController
+from dependencies import get_async_db, get_current_app_user
 from models import AppUsers
+from utils.credential_backend import credential_backend, hash_password
 from utils.security import SecurityHandler
 
 router = APIRouter()
@@ -15,36 +23,27 @@ router = APIRouter()
 async def verify_app_user_endpoint(
     user_name: str = Form(...), 
     user_password: str = Form(...),
-    db: Session = Depends(get_db)
+    device_id: Optional[str] = Header(None, alias="X-Device-Id"),
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        firebase_controller = FirebaseController()
-        result = firebase_controller.verify_app_user(user_name, user_password)
-        
-        if result.get('status'):
-            # Get or create app user
-            app_user = db.query(AppUsers).filter(
-                AppUsers.user_id == user_name
-            ).first()
-            
-            if app_user:
-                # Clear any existing API key first
-                if app_user.api_key:
-                    SecurityHandler().logout_user(db, app_user)
-                
-                # Generate new API key
-                api_key_data = SecurityHandler().login_user(db, app_user)
-                
-                return {
-                    "status": True,
-                    "message": "Login successful",
-                    "api_key": api_key_data["api_key"],
-                    "expires_at": api_key_data["expires_at"],
-                    "user": {
-                        "id": app_user.user_id,
-                        "email": app_user.email
-                    }
+        app_user = await credential_backend.authenticate(db, user_name, user_password)
+
+        if app_user:
+            # Adds a session for this device, replacing only its previous one;
+            # committed together with a refreshed password hash
+            api_key_data = await SecurityHandler().login_user_async(db, app_user, device_id)
+
+            return {
+                "status": True,
+                "message": "Login successful",
+                "api_key": api_key_data["api_key"],
+                "expires_at": api_key_data["expires_at"],
+                "user": {
+                    "id": app_user.user_id,
+                    "email": app_user.email
                 }
+            }
         
         return {"status": False, "message": "Invalid credentials"}
     except Exception as e:
@@ -53,10 +52,10 @@ async def verify_app_user_endpoint(
 @router.post("/logout")
 async def logout_endpoint(
     current_app_user: AppUsers = Depends(get_current_app_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        SecurityHandler().logout_user(db, current_app_user)
+        await SecurityHandler().logout_user_async(db, current_app_user)
         return {
             "status": True,
             "message": "Logged out successfully"
@@ -72,35 +71,44 @@ async def create_app_user_endpoint(
     user_password: str = Form(...), 
     user_email: str = Form(...),
     profile_picture: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    stored, registered = None, False
+
+    async def undo():
+        """Remove what was created outside the transaction"""
+        if stored:
+            delete_file(stored["image_path"])
+            delete_file(stored["thumbnail_path"])
+        if registered:
+            await credential_backend.unregister(user_name)
+
     try:
-        print(admin_name, admin_password, user_name, user_password, user_email)
+        print(f"Create app user request from {admin_name} for {user_name} ({user_email})")
         if admin_name == os.getenv("ADMIN_NAME") and admin_password == os.getenv("ADMIN_PASSWORD"):
-            firebase_controller = FirebaseController()
-            isCreated = firebase_controller.create_app_user(
-                user_name, user_password, user_email
-            )
             print("credentials verified")
-            app_user = db.query(models.AppUsers).filter(models.AppUsers.user_id == user_name).first()
+            app_user = (await db.execute(
+                select(models.AppUsers).where(models.AppUsers.user_id == user_name)
+            )).scalars().first()
             if app_user:
                 raise HTTPException(status_code=400, detail="User already exists")
+            # Rejects oversized or undecodable pictures before the user is registered
+            stored = await ingest_upload(profile_picture, "app_users", f"{user_name}_{uuid4().hex}")
+            profile_picture_path = stored["image_path"]
+            isCreated = await credential_backend.register(user_name, user_password, user_email)
             if isCreated and isCreated.get('status'):
-                profile_picture_path = f"app_users/{user_name}_{profile_picture.filename}"
-                os.makedirs(os.path.dirname(profile_picture_path), exist_ok=True)
-                with open(profile_picture_path, "wb") as f:
-                    f.write(await profile_picture.read())
-                print("")
+                registered = True
                 app_user = models.AppUsers(
                     user_id=user_name,
-                    password=user_password,
+                    password=await run_in_threadpool(hash_password, user_password),
                     email=user_email,
-                    image_path=profile_picture_path
+                    image_path=profile_picture_path,
+                    created_at=models.to_naive_utc(datetime.now(pytz.timezone('Asia/Kolkata')))
                 )
                 print(app_user)
                 db.add(app_user)
-                db.commit()
-                db.refresh(app_user)
+                await db.commit()
+                stored, registered = None, False
                 print("User created")
                 
                 
@@ -114,27 +122,33 @@ async def create_app_user_endpoint(
                     }
                 }
             print("Failed")
+            await undo()
             return {"status": False, "message": "User creation failed"}
         
         return {"status": False, "message": "Invalid admin credentials"}
+    except HTTPException:
+        await db.rollback()
+        await undo()
+        raise
     except Exception as e:
         print(e)
-        db.rollback()
+        await db.rollback()
+        await undo()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/verify_user")
-def verify_user(user_name: str = Form(...), user_password: str = Form(...),api_key: str = Header(...), db: Session = Depends(get_db)):
-    firebase_controller = FirebaseController()
-    result = firebase_controller.verify_app_user(user_name, user_password)
-    if result.get('status'):
-        app_user = db.query(models.AppUsers).filter(models.AppUsers.user_id == user_name).first()
-        if app_user:
-            app_user = SecurityHandler().verify_api_key(db, api_key)
+async def verify_user(user_name: str = Form(...), user_password: str = Form(...),api_key: str = Header(...), db: AsyncSession = Depends(get_async_db)):
+    app_user = await credential_backend.authenticate(db, user_name, user_password)
+    if app_user:
+        if db.dirty:
+            # Persist a password hash refreshed during authentication
+            await db.commit()
+        app_user = await SecurityHandler().verify_api_key_async(db, api_key)
         return { "status" : True, "message" : "User verified", "user" : app_user }
     else:
         return { "status" : False, "message" : "Invalid user credentials" }
 
 @router.post("/check/admin")
-def check_admin(admin_name: str = Form(...), admin_password: str = Form(...)):
+async def check_admin(admin_name: str = Form(...), admin_password: str = Form(...)):
     is_admin = admin_name == "admin" and admin_password == "future_scope"
     return { "status" : is_admin, "message" : "Admin verified" if is_admin else "Invalid admin credentials" }
\ No newline at end of file
@@ -2,9 +2,10 @@ from datetime import datetime
 import fastapi
 from fastapi import Depends, HTTPException, UploadFile, File, Form
 import models
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import FoodRecords, User, FinalRecords
-from dependencies import get_db, get_current_app_user
+from dependencies import get_async_db, get_current_app_user
 import os
 import uuid
 import pytz
@@ -16,7 +17,7 @@ async def food(
     user_id: str = Form(...),
     food_type: str = Form(...),
     current_app_user: models.AppUsers  = Depends(get_current_app_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         # Validate food type
@@ -24,7 +25,7 @@ async def food(
             raise HTTPException(status_code=400, detail="Invalid food type")
         
         # Get the user
-        user = db.query(User).filter(User.user_id == user_id).first()
+        user = (await db.execute(select(User).where(User.user_id == int(user_id)))).scalars().first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
@@ -32,10 +33,10 @@ async def food(
         current_date = current_time.date()
 
         # Check for existing record for today
-        existing_record = db.query(FoodRecords).filter(
-            FoodRecords.user_id == user_id,
+        existing_record = (await db.execute(select(FoodRecords).where(
+            FoodRecords.user_id == int(user_id),
             FoodRecords.entry_date == current_date
-        ).first()
+        ))).scalars().first()
 
         # Create new food log entry
         new_log = {
@@ -54,18 +55,23 @@ async def food(
             records.append(new_log)
             print(records)
             # Append new food log to existing record
-            db.query(FoodRecords).filter(FoodRecords.user_id == user_id, FoodRecords.entry_date == current_date).update({FoodRecords.time_logs: records})
-            db.commit()
+            await db.execute(
+                update(FoodRecords)
+                .where(FoodRecords.user_id == int(user_id), FoodRecords.entry_date == current_date)
+                .values(time_logs=records)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
         else:
             # Create new record with initial food log
             new_record = FoodRecords(
-                user_id=user_id,
+                user_id=user.user_id,
                 entry_date=current_date,
                 time_logs=[new_log],
-                created_at=current_time
+                created_at=models.to_naive_utc(current_time)
             )
             db.add(new_record)
-            db.commit()
+            await db.commit()
 
         return {
             "status": "success",
@@ -82,23 +88,23 @@ async def food(
     except HTTPException as he:
         raise he
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error adding food record: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error adding food record: {str(e)}")
 
 @router.get("/food/{user_id}")
 async def get_food_records(
     user_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         # Get today's record
         current_date = datetime.now(pytz.timezone('Asia/Kolkata')).date()
         
-        food_record = db.query(FoodRecords).filter(
-            FoodRecords.user_id == user_id,
+        food_record = (await db.execute(select(FoodRecords).where(
+            FoodRecords.user_id == int(user_id),
             FoodRecords.entry_date == current_date
-        ).first()
+        ))).scalars().first()
 
         if not food_record:
             return {
@@ -5,7 +5,6 @@ from sqlalchemy.orm import Session
 from fastapi import HTTPException
 
 from dependencies import get_db, get_current_app_user
-from firebase_controller import FirebaseController
 from models import AppUsers
 from utils.security import SecurityHandler
 
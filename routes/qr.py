@@ -4,8 +4,12 @@ from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from dependencies import get_db, get_current_app_user
 import models
-from firebase_controller import firebase_controller
-from sqlalchemy import func
+from firebase_controller import get_firebase_controller
+from sqlalchemy import func, select, literal, literal_column, true, DateTime
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from utils.response_cache import bump_data_version
+from utils.analytics_rollups import arrival_rollup_statements, record_departure_rollup, user_group
 from datetime import datetime
 from fastapi import Form
 from utils.security import SecurityHandler
@@ -35,87 +39,77 @@ def scan_qr(
     db: Session = Depends(get_db)
 ):
     try:
-        # Validate user
-        user = db.query(models.User).filter(models.User.user_id == user_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-
         current_time = datetime.now(pytz.timezone('Asia/Kolkata'))
         current_date = current_time.date()
-        is_any_entry_exist = db.query(models.FinalRecords).filter(
-            models.FinalRecords.user_id == user_id,
-            # models.FinalRecords.entry_date == current_date
-        ).first()
-
-        # Create new time log entry
-        new_entry = {
-            "arrival": current_time.isoformat(),
-            "qr_verified": True,
-            "qr_verification_time": current_time.isoformat()
-        }
 
-        # Check for existing entry for current date
-        existing_record = db.query(models.FinalRecords).filter(
-            models.FinalRecords.user_id == user_id,
-            models.FinalRecords.entry_date == current_date
-        ).first()
-
-        if existing_record:
-            # Initialize time_logs if None
-            current_logs = existing_record.time_logs or []
-            
-            # Create new time_logs array with the new entry
-            updated_logs = current_logs + [new_entry]
-            
-            try:
-                # Explicitly update the time_logs column
-                db.query(models.FinalRecords).filter(
-                    models.FinalRecords.user_id == user_id,
-                    models.FinalRecords.entry_date == current_date
-                ).update(
-                    {"time_logs": updated_logs},
-                    synchronize_session=False
-                )
-                
-                db.commit()
-                print(f"Added new time log to existing record for user {user_id} on {current_date}")
-            except Exception as e:
-                db.rollback()
-                print(f"Error updating existing record: {str(e)}")
-                raise HTTPException(status_code=500, detail="Failed to update time logs")
-        else:
-            # Create new record for the day
-            new_record = models.FinalRecords(
-                user_id=user_id,
-                entry_date=current_date,
-                app_user_id=current_app_user.user_id,
-                time_logs=[new_entry]
+        # Ensure today's record exists and append the arrival to visits in
+        # one statement. RETURNING sub-selects see the snapshot from before
+        # the upsert, so any_entry tells whether the user had a record before.
+        records = models.FinalRecords
+        any_entry = select(records.record_id).where(records.user_id == user_id).exists()
+        day = insert(records).values(
+            user_id=user_id,
+            entry_date=current_date,
+            app_user_id=current_app_user.user_id,
+            time_logs=[]
+        )
+        day = day.on_conflict_do_update(
+            constraint="uq_final_records_user_day",
+            set_={"app_user_id": records.app_user_id}
+        ).returning(
+            records.record_id,
+            records.face_image_path,
+            literal_column("xmax = 0").label("inserted"),
+            any_entry.label("is_any_entry_exist")
+        ).cte("day_record")
+
+        visit = insert(models.Visit).from_select(
+            ["record_id", "user_id", "arrival", "entry_type", "app_user_id", "group_name"],
+            select(
+                day.c.record_id,
+                literal(user_id),
+                literal(current_time, DateTime(timezone=True)),
+                literal("normal"),
+                literal(current_app_user.user_id),
+                user_group(user_id)
             )
-            
-            try:
-                db.add(new_record)
-                db.commit()
-                print(f"Created new record for user {user_id} on {current_date}")
-            except Exception as e:
-                db.rollback()
-                print(f"Error creating new record: {str(e)}")
-                raise HTTPException(status_code=500, detail="Failed to create new record")
-
-        # Check if face image exists
-        is_image_exist = False
+        ).returning(models.Visit.visit_id).cte("new_visit")
+
+        # Analytics rollups are maintained by the same statement
+        hourly_rollup, daily_visitor = arrival_rollup_statements(user_id, current_time)
+
+        stmt = select(
+            day.c.record_id,
+            day.c.face_image_path,
+            day.c.inserted,
+            day.c.is_any_entry_exist,
+            visit.c.visit_id
+        ).select_from(day.join(visit, true())).add_cte(
+            hourly_rollup.cte("hourly_rollup"),
+            daily_visitor.cte("daily_visitor")
+        )
+
         try:
-            is_image_exist = existing_record.face_image_path is not None
-        except Exception as e:
-            print(f"Error checking face image: {str(e)}")
+            record = db.execute(stmt).one()
+            db.commit()
+            bump_data_version(db)
+        except IntegrityError as e:
+            db.rollback()
+            if "foreign key" in str(e.orig).lower():
+                raise HTTPException(status_code=404, detail="User not found")
+            print(f"Error recording check-in: {str(e)}")
+            raise HTTPException(status_code=500, detail="Failed to record check-in")
+
+        print(f"Recorded visit {record.visit_id} on {'new' if record.inserted else 'existing'} record for user {user_id} on {current_date}")
 
         return {
             "status": "success",
             "message": "Check-in successful",
             "user_id": user_id,
             "arrival_time": current_time.isoformat(),
-            "is_image_captured": is_image_exist,
-            "entry_type": "new_record" if not existing_record else "updated_record",
-            "is_any_entry_exist": True if is_any_entry_exist else False
+            "is_image_captured": record.face_image_path is not None,
+            "entry_type": "new_record" if record.inserted else "updated_record",
+            "is_any_entry_exist": bool(record.is_any_entry_exist)
         }
 
     except Exception as e:
@@ -141,52 +135,39 @@ def departure(
         
     except Exception as e:
         db.rollback()
-        firebase_controller.log_server_activity("ERROR", f"Error processing departure for user_id: {user_id} - {str(e)}")
+        get_firebase_controller().log_server_activity("ERROR", f"Error processing departure for user_id: {user_id} - {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
 def process_single_departure(user_id: int, app_user_id: int, db: Session):
-    # Get today's record for the user
+    # Get the latest visit on today's record for the user
     current_date = datetime.now(pytz.timezone('Asia/Kolkata')).date()
-    user_record = db.query(models.FinalRecords).filter(
+    latest_visit = db.query(models.Visit).join(
+        models.FinalRecords,
+        models.FinalRecords.record_id == models.Visit.record_id
+    ).filter(
         models.FinalRecords.user_id == user_id,
         models.FinalRecords.entry_date == current_date
-    ).first()
-    
-    if not user_record or not user_record.time_logs:
+    ).order_by(models.Visit.arrival.desc()).with_for_update(of=models.Visit).first()
+
+    if not latest_visit:
         raise HTTPException(status_code=404, detail="No active entry found for today")
-    
-    # Get the latest entry
-    latest_entry = user_record.time_logs[-1]
-    
+
     # Check if already departed
-    if latest_entry.get('departure') is not None:
+    if latest_visit.departure is not None:
         raise HTTPException(status_code=400, detail="Latest entry already has departure time")
-    
+
     # Calculate duration
-    arrival_time = datetime.fromisoformat(latest_entry['arrival'])
     departure_time = datetime.now(pytz.timezone('Asia/Kolkata'))
-    duration = departure_time - arrival_time
-    
-    # Update the latest entry
-    latest_entry.update({
-        'departure': departure_time.isoformat(),
-        'duration': str(duration),
-        'departure_verified_by': app_user_id,
-        'departure_verification_time': departure_time.isoformat()
-    })
-    
-    # Update the entire time_logs array
-    user_record.time_logs[-1] = latest_entry
-    
-    # Update the record in database
-    db.query(models.FinalRecords).filter(
-        models.FinalRecords.user_id == user_id,
-        models.FinalRecords.entry_date == current_date
-    ).update({
-        "time_logs": user_record.time_logs
-    })
-    
+    duration = departure_time - latest_visit.arrival
+
+    # Close the visit row; earlier visits are never rewritten
+    latest_visit.departure = departure_time
+    latest_visit.duration = duration
+    latest_visit.departure_verified_by = app_user_id
+    record_departure_rollup(db, latest_visit.group_name, latest_visit.arrival, duration)
+
     db.commit()
+    bump_data_version(db)
     # firebase_controller.log_server_activity("INFO", f"Departure recorded for user_id: {user_id}")
     
     return {
@@ -194,5 +175,5 @@ def process_single_departure(user_id: int, app_user_id: int, db: Session):
         "user_id": user_id,
         "departure_time": departure_time.isoformat(),
         "duration": str(duration),
-        "entry_type": latest_entry.get('entry_type', 'normal')
+        "entry_type": latest_visit.entry_type or 'normal'
     }
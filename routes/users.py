@@ -4,26 +4,37 @@ from fastapi import APIRouter, Depends, HTTPException, File, Form, UploadFile, Q
 from sqlalchemy.orm import Session
 from dependencies import get_db, get_current_app_user
 import models
-from utils.file_handlers import save_upload_file, delete_file
-from qr_generation import generate_qr_code
+from utils.file_handlers import UPLOAD_DIR, delete_file
+from utils.image_ingest import ingest_image
 import base64
 import os
-from typing import Optional
+from typing import List, Optional
 import traceback
-from fastapi.responses import JSONResponse, FileResponse
-from firebase_controller import firebase_controller
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from uuid import uuid4
-from template_generator import create_visitor_card
 from utils.security import SecurityHandler
 from fastapi import BackgroundTasks
 from pathlib import Path
 import mimetypes  # Add this import
-from utils.email_handler import send_welcome_email_background
+from utils.email_outbox import queue_welcome_email
+from utils.render_queue import new_render_job_id, submit_render_job, cached_card, render_card
+from utils import bulk_import, card_export
+import zipfile
+import re
 import pytz  # Import the pytz library
-from sqlalchemy import func
+from sqlalchemy import func, and_, not_, true, literal, select, tuple_, DateTime
+from database import SessionLocal
+import json
+from collections import defaultdict
+from utils.response_cache import response_cache, bump_data_version
 
 router = APIRouter()
 
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+MAX_EXPORT_CARDS = 5000
+CARD_RENDER_TIMEOUT = 60
+
 
 @router.post("/check/email/{email}")
 def check_email(email: str, db: Session = Depends(get_db)):
@@ -42,6 +53,7 @@ def create_user(
     count: str = Form(None),
     db: Session = Depends(get_db)
 ):
+    stored = None
     try:
         request_data = {
             "name": name,
@@ -66,8 +78,9 @@ def create_user(
         if existing_user:
             raise HTTPException(status_code=400, detail="User already exists with this email")
 
-        # Save image
-        image_path = save_upload_file(image)
+        # Save the image, rotated, downscaled and re-encoded
+        stored = ingest_image(image.file, UPLOAD_DIR, f"_{uuid4().hex}")
+        image_path = stored["image_path"]
         print(f"Saved image at: {image_path}")
 
         # Create user
@@ -85,35 +98,34 @@ def create_user(
         db.flush()
         
         print(f"Generated user with ID: {new_user.user_id}")
-        
-        # Generate QR Code
-        qr_path = generate_qr_code(new_user.user_id, new_user.name, new_user.email)
-        new_user.qr_code = qr_path
-        print(f"Generated QR code at: {qr_path}")
-        
+
+        # QR and visitor card are rendered by the process pool; the welcome
+        # email is queued in the outbox and sent once the render finishes
+        render_job = models.RenderJob(job_id=new_render_job_id(), user_id=new_user.user_id)
+        db.add(render_job)
+        # Without a relationship the unit of work may insert the outbox row
+        # first, which breaks its foreign key to render_jobs
+        db.flush()
+        queue_welcome_email(db, new_user.user_id, email, name, render_job.job_id)
+
         db.commit()
+        # The user row now owns the image
+        stored = None
+        bump_data_version(db)
         db.refresh(new_user)
-        
-        # Generate visitor card
-        card_path = create_visitor_card({
-            "name": new_user.name,
-            "profile_image_path": str(Path(new_user.image_path)),
-            "qr_code_path": new_user.qr_code,
-            "user_id": str(new_user.user_id
-                           
-                           ), 'email' : str(new_user.email)
-        })
-
-        print(f"Successfully created user: {new_user.user_id}")
-
-        # Send welcome email in background
-        send_welcome_email_background(
-            background_tasks=background_tasks,
-            user_email=new_user.email,
-            user_name=new_user.name,
-            qr_code_path=new_user.qr_code,
-            visitor_card_path=card_path
-        )
+
+        try:
+            submit_render_job(
+                render_job.job_id,
+                new_user.user_id,
+                new_user.name,
+                new_user.email,
+                new_user.image_path
+            )
+        except Exception as e:
+            # The user and job are committed; requeue_stale_render_jobs resubmits the job
+            print(f"Error submitting render job {render_job.job_id}: {str(e)}")
+        print(f"Successfully created user: {new_user.user_id}, render job {render_job.job_id}")
 
         return {
             "user_id": new_user.user_id,
@@ -121,106 +133,396 @@ def create_user(
             "email": new_user.email,
             "qr_code": new_user.qr_code,
             "image_path": new_user.image_path,
-            "visitor_card_path": card_path,
-            "card_path": card_path,
-            "email_status": "sending_in_background"
+            "visitor_card_path": None,
+            "card_path": None,
+            "render_job_id": render_job.job_id,
+            "render_status": render_job.status,
+            "email_status": "queued"
         }
 
+    except HTTPException:
+        db.rollback()
+        _discard_image(stored)
+        raise
     except Exception as e:
         db.rollback()
+        _discard_image(stored)
         print(f"Error creating user: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Error creating user: {str(e)}")
 
+def _discard_image(stored: Optional[dict]) -> None:
+    """Delete an ingested image and its thumbnail that no committed row refers to"""
+    if stored:
+        delete_file(stored["image_path"])
+        delete_file(stored["thumbnail_path"])
+
+def _entry_status_query(db: Session, current_date):
+    """
+    Users joined to their latest final record in a single set-based query.
+
+    Per-user flags for today and the global entry statistics are computed with
+    window functions over final_records, so they come out of the same pass.
+    Rows are ordered the way the gate dashboard lists them: today's entries
+    pending face capture first, then completed ones, then the rest by
+    creation date.
+    """
+    records = models.FinalRecords
+    is_today = records.entry_date == current_date
+
+    ranked = db.query(
+        records.user_id.label("user_id"),
+        records.record_id.label("record_id"),
+        records.entry_date.label("entry_date"),
+        records.face_image_path.label("face_image_path"),
+        func.row_number().over(
+            partition_by=records.user_id,
+            order_by=(records.entry_date.desc(), records.record_id.desc())
+        ).label("latest_rank"),
+        func.bool_or(is_today).over(partition_by=records.user_id).label("has_entry_today"),
+        func.bool_or(
+            and_(is_today, records.face_image_path.isnot(None))
+        ).over(partition_by=records.user_id).label("face_captured"),
+        func.count().over().label("total_entries"),
+        func.count().filter(is_today).over().label("today_entries"),
+        func.count().filter(
+            and_(is_today, records.face_image_path.is_(None))
+        ).over().label("active_entries"),
+    ).cte("ranked_records")
+
+    # One-row totals read back from the same CTE so every page carries them
+    totals = db.query(
+        func.coalesce(func.max(ranked.c.total_entries), 0).label("total_entries"),
+        func.coalesce(func.max(ranked.c.today_entries), 0).label("today_entries"),
+        func.coalesce(func.max(ranked.c.active_entries), 0).label("active_entries"),
+    ).subquery("entry_totals")
+    total_users = select(func.count(models.User.user_id)).scalar_subquery()
+
+    has_entry_today = func.coalesce(ranked.c.has_entry_today, False)
+    face_captured = func.coalesce(ranked.c.face_captured, False)
+    sort_keys = _sort_keys(has_entry_today, face_captured)
+
+    query = db.query(
+        models.User,
+        ranked.c.record_id,
+        ranked.c.entry_date,
+        ranked.c.face_image_path,
+        has_entry_today.label("has_entry_today"),
+        face_captured.label("face_captured"),
+        total_users.label("total_users"),
+        totals.c.total_entries,
+        totals.c.today_entries,
+        totals.c.active_entries,
+    ).outerjoin(
+        ranked,
+        and_(ranked.c.user_id == models.User.user_id, ranked.c.latest_rank == 1)
+    ).join(totals, true())
+
+    return query.order_by(*sort_keys), sort_keys
+
+# Users without created_at sort first, as they did with the old "0" sort key
+_NO_CREATED_AT = literal("-infinity").cast(DateTime)
+
+def _sort_keys(has_entry_today, face_captured):
+    """Ascending sort columns shared by ORDER BY and the keyset cursor"""
+    return (
+        not_(has_entry_today),
+        face_captured,
+        func.coalesce(models.User.created_at, _NO_CREATED_AT),
+        models.User.user_id,
+    )
+
+def _encode_cursor(row) -> str:
+    created_at = row.User.created_at.isoformat() if row.User.created_at else None
+    payload = [not row.has_entry_today, bool(row.face_captured), created_at, row.User.user_id]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        pending, face_captured, created_at, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(created_at) if created_at else None
+        return [bool(pending), bool(face_captured), created_at, int(user_id)]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+def _paginate(query, sort_keys, limit: Optional[int], after: Optional[str]):
+    if after:
+        cursor = _decode_cursor(after)
+        if cursor[2] is None:
+            cursor[2] = _NO_CREATED_AT
+        query = query.filter(tuple_(*sort_keys) > tuple_(*cursor))
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def _user_row_to_dict(row) -> dict:
+    user = row.User
+    return {
+        "user_id": user.user_id,
+        "name": user.name,
+        "email": user.email,
+        "image_path": user.image_path,
+        "group_name": user.group_name,
+        "count" : user.count,
+        "id" : user.id,
+        "id_type" : user.id_type,
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+        "entry_status": {
+            "has_entry_today": bool(row.has_entry_today),
+            "face_captured": bool(row.face_captured),
+            "latest_entry": {
+                "entry_date": row.entry_date.isoformat(),
+                "face_image_path": row.face_image_path,
+                "record_id": row.record_id
+            } if row.record_id is not None else None
+        }
+    }
+
+def _entry_totals(db: Session, current_date):
+    """The totals _entry_status_query puts on every row, for pages without rows"""
+    records = models.FinalRecords
+    is_today = records.entry_date == current_date
+    return db.query(
+        select(func.count(models.User.user_id)).scalar_subquery().label("total_users"),
+        func.count(records.record_id).label("total_entries"),
+        func.count(records.record_id).filter(is_today).label("today_entries"),
+        func.count(records.record_id).filter(
+            and_(is_today, records.face_image_path.is_(None))
+        ).label("active_entries"),
+    ).one()
+
+def _row_statistics(row) -> dict:
+    return {
+        "statistics": {
+            "total_users": row.total_users,
+            "total_entries": row.total_entries,  # Total entries across all time
+        },
+        "today_statistics": {
+            "total_entries": row.today_entries,  # Total entries today
+            "active_entries": row.active_entries,  # Users with face image pending
+        }
+    }
+
+def _stream_users(limit: Optional[int], after: Optional[str], current_time: datetime):
+    """Yield the user listing as NDJSON lines while rows are read from the cursor"""
+    db = SessionLocal()
+    try:
+        query, sort_keys = _entry_status_query(db, current_time.date())
+        query = _paginate(query, sort_keys, limit, after)
+        # Executed 2.0-style: legacy Query uniquifies User rows, which yield_per refuses
+        rows = db.execute(query.statement, execution_options={"yield_per": STREAM_BATCH_SIZE})
+
+        last_row, count = None, 0
+        for row in rows:
+            if last_row is None:
+                yield json.dumps({"type": "statistics", **_row_statistics(row), "timestamp": current_time.isoformat()}) + "\n"
+            yield json.dumps({"type": "user", "data": _user_row_to_dict(row)}) + "\n"
+            last_row = row
+            count += 1
+
+        if last_row is None:
+            totals = _entry_totals(db, current_time.date())
+            yield json.dumps({"type": "statistics", **_row_statistics(totals), "timestamp": current_time.isoformat()}) + "\n"
+        if limit:
+            # A short page is the last one
+            next_cursor = _encode_cursor(last_row) if count == limit else None
+            yield json.dumps({"type": "page", "next_cursor": next_cursor}) + "\n"
+    except Exception as e:
+        print(f"Error streaming users: {str(e)}")
+        yield json.dumps({"type": "error", "detail": f"Error fetching users: {str(e)}"}) + "\n"
+    finally:
+        db.close()
+
+def _render_job_to_dict(job: models.RenderJob) -> dict:
+    return {
+        "job_id": job.job_id,
+        "user_id": job.user_id,
+        "status": job.status,
+        "qr_code": job.qr_path,
+        "card_path": job.card_path,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+@router.get("/render-jobs/{job_id}")
+def get_render_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.query(models.RenderJob).filter(models.RenderJob.job_id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Render job not found")
+    return _render_job_to_dict(job)
+
+@router.get("/render-jobs/{job_id}/card")
+def download_render_job_card(job_id: str, db: Session = Depends(get_db)):
+    job = db.query(models.RenderJob).filter(models.RenderJob.job_id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Render job not found")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Render job is {job.status}")
+    if job.card_path and os.path.exists(job.card_path):
+        return FileResponse(
+            path=job.card_path,
+            filename=os.path.basename(job.card_path),
+            media_type='image/png'
+        )
+    # The job's card was superseded by a newer variant; serve the current one
+    return _visitor_card_response(db, job.user_id)
+
+def _visitor_card_response(db: Session, user_id: int) -> FileResponse:
+    """The user's current card, rendered on the pool on first request"""
+    user = db.query(models.User).filter(models.User.user_id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    card_path = cached_card(user.user_id, user.name, user.email, user.image_path)
+    if not card_path:
+        try:
+            card_path = render_card(user.user_id, user.name, user.email, user.image_path).result(timeout=CARD_RENDER_TIMEOUT)["card_path"]
+        except Exception as e:
+            print(f"Error rendering visitor card for user {user_id}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error rendering visitor card: {str(e)}")
+    return FileResponse(
+        path=card_path,
+        filename=card_export.card_filename(user),
+        media_type='image/png'
+    )
+
+@router.get("/{user_id}/card")
+def download_user_card(user_id: int, db: Session = Depends(get_db)):
+    return _visitor_card_response(db, user_id)
+
+@router.post("/import")
+def import_users(
+    rows: UploadFile = File(..., description="CSV with a header row, or JSONL"),
+    photos: UploadFile = File(..., description="Zip of the photos named in the rows' photo column"),
+    send_emails: bool = Form(True),
+    db: Session = Depends(get_db)
+):
+    """
+    Bulk registration. Columns: name, email, id_type, id, group_name, count, photo.
+    Rejected rows are reported with their row number; cards render in the
+    background, see GET /users/import/{import_id} for progress.
+    """
+    if not rows.filename.lower().endswith((".csv", ".jsonl", ".ndjson")):
+        raise HTTPException(status_code=400, detail="Rows must be a .csv or .jsonl file")
+    try:
+        return bulk_import.import_users(db, rows.filename, rows.file.read(), photos.file, send_emails=send_emails)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Photos must be a zip file")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Rows file must be UTF-8 encoded")
+    except Exception as e:
+        print(f"Error importing users: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error importing users: {str(e)}")
+
+@router.get("/import/{import_id}")
+def get_import_progress(import_id: str, db: Session = Depends(get_db)):
+    progress = bulk_import.import_progress(db, import_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return progress
+
+@router.get("/cards/export")
+def export_visitor_cards(
+    group_name: Optional[str] = Query(None, description="Export every user in this group"),
+    user_ids: Optional[List[int]] = Query(None, description="Export these users; repeat the parameter for each id"),
+    format: str = Query("zip", pattern="^(zip|pdf)$"),
+    columns: int = Query(2, ge=1, le=4, description="Cards per row on PDF sheets"),
+    rows: int = Query(2, ge=1, le=4, description="Card rows on PDF sheets"),
+    db: Session = Depends(get_db)
+):
+    """
+    Stream visitor cards as a ZIP, or as a printable PDF with several cards per page.
+    Cards missing from the card cache are rendered on the fly and streamed as they finish.
+    """
+    if not group_name and not user_ids:
+        raise HTTPException(status_code=400, detail="Provide group_name or user_ids")
+
+    query = db.query(models.User.user_id, models.User.name, models.User.email, models.User.image_path)
+    if group_name:
+        query = query.filter(models.User.group_name == group_name)
+    if user_ids:
+        query = query.filter(models.User.user_id.in_(user_ids))
+    users = query.order_by(models.User.user_id).limit(MAX_EXPORT_CARDS + 1).all()
+
+    if not users:
+        raise HTTPException(status_code=404, detail="No users found")
+    if len(users) > MAX_EXPORT_CARDS:
+        raise HTTPException(status_code=400, detail=f"Export is limited to {MAX_EXPORT_CARDS} cards")
+
+    ready, pending = [], {}
+    for user in users:
+        card_path = cached_card(user.user_id, user.name, user.email, user.image_path)
+        if card_path:
+            ready.append((user, card_path))
+        else:
+            pending[render_card(user.user_id, user.name, user.email, user.image_path)] = user
+    if pending:
+        print(f"Rendering {len(pending)} missing visitor cards for export")
+
+    cards = card_export.iter_cards(ready, pending)
+    export_name = re.sub(r"[^A-Za-z0-9_-]+", "_", group_name) if group_name else "users"
+    if format == "pdf":
+        return StreamingResponse(
+            card_export.stream_pdf(cards, columns, rows),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="visitor_cards_{export_name}.pdf"'}
+        )
+    return StreamingResponse(
+        card_export.stream_zip(cards),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="visitor_cards_{export_name}.zip"'}
+    )
+
 @router.get("/all")
 def get_all_users(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size for keyset pagination"),
+    after: Optional[str] = Query(None, description="Cursor returned as next_cursor by the previous page"),
+    stream: bool = Query(False, description="Stream users as NDJSON instead of a single JSON document"),
     db: Session = Depends(get_db)
 ):
+    current_time = datetime.now(pytz.timezone('Asia/Kolkata'))
+    if after:
+        _decode_cursor(after)
+    if stream:
+        return StreamingResponse(
+            _stream_users(limit, after, current_time),
+            media_type="application/x-ndjson"
+        )
+
     try:
-        current_time = datetime.now(pytz.timezone('Asia/Kolkata'))
         current_date = current_time.date()
-        
-        response = {
-            "all_users": [],
-            "statistics": {
-                "total_users": 0,
-                "total_entries": 0,  # Total entries across all time
-            },
-            "today_statistics": {
-                "total_entries": 0,  # Total entries today
-                "active_entries": 0,  # Users with face image pending
-            }
-        }
 
-        # Get all users
-        users = db.query(models.User).all()
-        response["statistics"]["total_users"] = len(users)
-
-        # Get total entries (all time)
-        total_entries = db.query(models.FinalRecords).count()
-        response["statistics"]["total_entries"] = total_entries
-
-        # Get today's entries
-        today_entries = db.query(models.FinalRecords).filter(
-            func.date(models.FinalRecords.entry_date) == current_date
-        ).count()
-        response["today_statistics"]["total_entries"] = today_entries
-
-        # Get active entries (entries without face image)
-        active_entries = db.query(models.FinalRecords).filter(
-            func.date(models.FinalRecords.entry_date) == current_date,
-            models.FinalRecords.face_image_path == None
-        ).count()
-        response["today_statistics"]["active_entries"] = active_entries
-
-        # Process user data
-        for user in users:
-            # Check if user has entry today
-            today_entry = db.query(models.FinalRecords).filter(
-                models.FinalRecords.user_id == user.user_id,
-                func.date(models.FinalRecords.entry_date) == current_date
-            ).first()
-
-            # Get latest entry for the user
-            latest_entry = db.query(models.FinalRecords).filter(
-                models.FinalRecords.user_id == user.user_id
-            ).order_by(models.FinalRecords.entry_date.desc()).first()
-
-            user_data = {
-                "user_id": user.user_id,
-                "name": user.name,
-                "email": user.email,
-                "image_path": user.image_path,
-                "group_name": user.group_name,
-                "count" : user.count,
-                "id" : user.id,
-                "id_type" : user.id_type,
-                "created_at": user.created_at.isoformat() if user.created_at else None,
-                "entry_status": {
-                    "has_entry_today": bool(today_entry),
-                    "face_captured": bool(today_entry and today_entry.face_image_path if today_entry else False),
-                    "latest_entry": {
-                        "entry_date": latest_entry.entry_date.isoformat() if latest_entry else None,
-                        "face_image_path": latest_entry.face_image_path if latest_entry else None,
-                        "record_id": latest_entry.record_id if latest_entry else None
-                    } if latest_entry else None
+        def compute():
+            query, sort_keys = _entry_status_query(db, current_date)
+            rows = _paginate(query, sort_keys, limit, after).all()
+
+            page = {
+                "data": {
+                    "all_users": [_user_row_to_dict(row) for row in rows],
+                    **_row_statistics(rows[0] if rows else _entry_totals(db, current_date))
                 }
             }
-            response["all_users"].append(user_data)
+            if limit:
+                page["pagination"] = {
+                    "limit": limit,
+                    "next_cursor": _encode_cursor(rows[-1]) if len(rows) == limit else None
+                }
+            return page
 
-        # Sort users: those with today's entry but no face image first, 
-        # then those with complete entries today, then the rest
-        response["all_users"].sort(key=lambda x: (
-            not x["entry_status"]["has_entry_today"],  # Today's entries first
-            x["entry_status"]["face_captured"],  # Pending face capture first
-            x["created_at"] if x["created_at"] else "0"  # Then by creation date
-        ))
+        page = response_cache.get_or_compute(db, "users_all", {
+            "date": current_date.isoformat(),
+            "limit": limit,
+            "after": after
+        }, compute)
 
-        return {
+        result = {
             "status": "success",
             "message": "Users fetched successfully",
-            "data": response,
+            "data": page["data"],
             "timestamp": current_time.isoformat()
         }
+        if "pagination" in page:
+            result["pagination"] = page["pagination"]
+        return result
 
     except Exception as e:
         print(f"Error fetching users: {str(e)}")
@@ -229,107 +531,109 @@ def get_all_users(
             detail=f"Error fetching users: {str(e)}"
         )
 
+def _user_detail(db: Session, user_id: int) -> dict:
+    user = db.query(models.User).filter(
+        models.User.user_id == user_id
+    ).first()
+
+    if user:
+        # Get all records for the user
+        records = db.query(models.FinalRecords).filter(
+            models.FinalRecords.user_id == user_id
+        ).order_by(models.FinalRecords.entry_date.desc()).all()
+
+        # Visits for all records in one query, already typed as timestamptz
+        visits_by_record = defaultdict(list)
+        visits = db.query(models.Visit).filter(
+            models.Visit.user_id == user_id
+        ).order_by(models.Visit.arrival).all()
+        for visit in visits:
+            visits_by_record[visit.record_id].append(visit)
+
+        # Process records into a more organized structure
+        ist = pytz.timezone('Asia/Kolkata')
+        processed_records = []
+        for record in records:
+            entry_data = {
+                "record_id": record.record_id,
+                "entry_date": record.entry_date.isoformat(),
+                "face_image_path": record.face_image_path,
+                "app_user_id": record.app_user_id,
+                "entries": []
+            }
+
+            for visit in visits_by_record.get(record.record_id, []):
+                entry = {
+                    "arrival": visit.arrival.astimezone(ist).isoformat(),
+                    "departure": visit.departure.astimezone(ist).isoformat() if visit.departure else None,
+                    "duration": str(visit.duration) if visit.duration is not None else None,
+                    "face_image_path": visit.face_image_path
+                }
+
+                # Add bypass details if present
+                if visit.bypass_details:
+                    entry["bypass_details"] = visit.bypass_details
+
+                entry_data["entries"].append(entry)
+
+            processed_records.append(entry_data)
+
+        # Get the count of users associated with the instructor's institution
+       
+        response_data = {
+            "user": {
+                "user_id": user.user_id,
+                "name": user.name,
+                "email": user.email,
+                "id_type": user.id_type,
+                "id" : user.id,
+                "count" : user.count,
+                "group_name" : user.group_name,
+                "image_path": f"{user.image_path}",
+                "qr_code_path": f"{user.qr_code}",
+                "created_at": user.created_at.isoformat() if user.created_at else None,
+            },
+            "entry_records": processed_records,
+            "summary": {
+                "total_days": len(processed_records),
+                "total_entries": sum(len(record["entries"]) for record in processed_records),
+              
+               
+            },
+            "image_base64": None,
+            "qr_base64": None
+        }
+
+        # Add base64 encoded images
+        try:
+            if user.qr_code and os.path.exists(user.qr_code):
+                with open(user.qr_code, "rb") as qr_file:
+                    qr_data = base64.b64encode(qr_file.read()).decode()
+                    response_data["qr_base64"] = f"data:image/png;base64,{qr_data}"
+        except Exception as qr_error:
+            print(f"Error processing QR code: {str(qr_error)}")
+
+        try:
+            if user.image_path and os.path.exists(user.image_path):
+                with open(user.image_path, "rb") as img_file:
+                    img_data = base64.b64encode(img_file.read()).decode()
+                    response_data["image_base64"] = f"data:image/jpeg;base64,{img_data}"
+        except Exception as img_error:
+            print(f"Error processing image: {str(img_error)}")
+
+        return response_data
+    else:
+        raise HTTPException(status_code=404, detail="User not found")
+
 @router.get("/{user_id}")
 def get_user(
     user_id: int,
     db: Session = Depends(get_db)
 ):
     try:
-        user = db.query(models.User).filter(
-            models.User.user_id == user_id
-        ).first()
-
-        if user:
-            # Get all records for the user
-            records = db.query(models.FinalRecords).filter(
-                models.FinalRecords.user_id == user_id
-            ).order_by(models.FinalRecords.entry_date.desc()).all()
-
-            # Process records into a more organized structure
-            processed_records = []
-            for record in records:
-                entry_data = {
-                    "record_id": record.record_id,
-                    "entry_date": record.entry_date.isoformat(),
-                    "face_image_path": record.face_image_path,
-                    "app_user_id": record.app_user_id,
-                    "entries": []
-                }
-
-                if record.time_logs:
-                    for log in record.time_logs:
-                        # Convert UTC times to IST
-                        arrival_time = datetime.fromisoformat(log.get("arrival")) if log.get("arrival") else None
-                        departure_time = datetime.fromisoformat(log.get("departure")) if log.get("departure") else None
-
-                        if arrival_time:
-                            arrival_time = arrival_time.replace(tzinfo=pytz.UTC).astimezone(pytz.timezone('Asia/Kolkata'))
-                        if departure_time:
-                            departure_time = departure_time.replace(tzinfo=pytz.UTC).astimezone(pytz.timezone('Asia/Kolkata'))
-
-                        entry = {
-                            "arrival": arrival_time.isoformat() if arrival_time else None,
-                            "departure": departure_time.isoformat() if departure_time else None,
-                            "duration": log.get("duration"),
-                            "face_image_path": log.get("face_image_path")
-                        }
-
-                        # Add bypass details if present
-                        if log.get("bypass_details"):
-                            entry["bypass_details"] = log["bypass_details"]
-
-
-
-                        entry_data["entries"].append(entry)
-
-                processed_records.append(entry_data)
-
-            # Get the count of users associated with the instructor's institution
-           
-            response_data = {
-                "user": {
-                    "user_id": user.user_id,
-                    "name": user.name,
-                    "email": user.email,
-                    "id_type": user.id_type,
-                    "id" : user.id,
-                    "count" : user.count,
-                    "group_name" : user.group_name,
-                    "image_path": f"{user.image_path}",
-                    "qr_code_path": f"{user.qr_code}",
-                    "created_at": user.created_at.isoformat() if user.created_at else None,
-                },
-                "entry_records": processed_records,
-                "summary": {
-                    "total_days": len(processed_records),
-                    "total_entries": sum(len(record["entries"]) for record in processed_records),
-                  
-                   
-                },
-                "image_base64": None,
-                "qr_base64": None
-            }
-
-            # Add base64 encoded images
-            try:
-                if user.qr_code and os.path.exists(user.qr_code):
-                    with open(user.qr_code, "rb") as qr_file:
-                        qr_data = base64.b64encode(qr_file.read()).decode()
-                        response_data["qr_base64"] = f"data:image/png;base64,{qr_data}"
-            except Exception as qr_error:
-                print(f"Error processing QR code: {str(qr_error)}")
-
-            try:
-                if user.image_path and os.path.exists(user.image_path):
-                    with open(user.image_path, "rb") as img_file:
-                        img_data = base64.b64encode(img_file.read()).decode()
-                        response_data["image_base64"] = f"data:image/jpeg;base64,{img_data}"
-            except Exception as img_error:
-                print(f"Error processing image: {str(img_error)}")
-
-            return response_data
-        else:
-            raise HTTPException(status_code=404, detail="User not found")
+        return response_cache.get_or_compute(
+            db, "user_detail", {"user_id": user_id}, lambda: _user_detail(db, user_id)
+        )
 
     except Exception as e:
         print(f"Error in get_user: {str(e)}")
@@ -0,0 +1,46 @@
+import argparse
+import os
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-register users from a CSV/JSONL file and a zip of photos")
+    parser.add_argument("rows", help="CSV with a header row, or JSONL")
+    parser.add_argument("photos", help="Zip of the photos named in the rows' photo column")
+    parser.add_argument("--no-email", action="store_true", help="Do not send welcome emails")
+    parser.add_argument("--poll-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from database import SessionLocal
+    from utils.bulk_import import import_users, import_progress
+    from utils.render_queue import shutdown_render_executor
+
+    db = SessionLocal()
+    try:
+        with open(args.rows, "rb") as rows_file, open(args.photos, "rb") as photos_file:
+            summary = import_users(
+                db, os.path.basename(args.rows), rows_file.read(), photos_file, send_emails=not args.no_email
+            )
+        for error in summary["errors"]:
+            print(f"Row {error['row']} ({error['email']}): {error['error']}")
+        print(f"Import {summary['import_id']}: {summary['inserted']} of {summary['total_rows']} rows inserted")
+
+        # Render callbacks commit from other threads; start each poll fresh
+        while True:
+            db.rollback()
+            progress = import_progress(db, summary["import_id"])
+            render = progress["render"]
+            print(f"Rendered {render['done']}/{summary['inserted']}, failed {render['failed']}")
+            if not render["queued"]:
+                break
+            time.sleep(args.poll_seconds)
+        for failure in progress["render_errors"]:
+            print(f"Render failed for user {failure['user_id']}: {failure['error']}")
+    finally:
+        db.close()
+        # Welcome emails are in the outbox; the API's outbox drainer sends them
+        shutdown_render_executor()
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,114 @@
+import os
+import time
 from datetime import datetime
+from sqlalchemy import select, delete
 from sqlalchemy.orm import Session
-from models import AppUsers
+from models import AppUserSession, User
+from utils.api_key_cache import api_key_cache
 
-def cleanup_expired_api_keys(db: Session):
-    """Cleanup expired API keys periodically"""
+# Rows deleted per transaction, so pruning never holds long locks
+SESSION_CLEANUP_BATCH_SIZE = int(os.getenv("SESSION_CLEANUP_BATCH_SIZE", "1000"))
+TEMP_IMAGE_DIR = "temp_images"
+TEMP_FILE_MAX_AGE_SECONDS = float(os.getenv("TEMP_FILE_MAX_AGE_SECONDS", "3600"))
+# Superseded cards and QR codes younger than this are kept, so files being
+# rendered or just replaced are never touched
+STALE_ASSET_GRACE_SECONDS = float(os.getenv("STALE_ASSET_GRACE_SECONDS", "3600"))
+# Files removed per run at most; the rest go on the next run
+FILE_PURGE_LIMIT = int(os.getenv("FILE_PURGE_LIMIT", "5000"))
+
+def cleanup_expired_api_keys(db: Session, batch_size: int = SESSION_CLEANUP_BATCH_SIZE) -> int:
+    """Delete expired app user sessions in batches; returns how many were removed"""
+    removed = 0
     try:
-        db.query(AppUsers).filter(
-            AppUsers.api_key_expiry < datetime.utcnow()
-        ).update({
-            AppUsers.api_key: None,
-            AppUsers.api_key_expiry: None
-        })
-        db.commit()
+        while True:
+            expired = select(AppUserSession.session_id).where(
+                AppUserSession.expires_at < datetime.utcnow()
+            ).order_by(AppUserSession.expires_at).limit(batch_size).with_for_update(skip_locked=True)
+            deleted = db.execute(
+                delete(AppUserSession).where(AppUserSession.session_id.in_(expired))
+            ).rowcount
+            db.commit()
+            removed += deleted
+            if deleted < batch_size:
+                break
+        # Cached entries carry the key expiry, so no cross-worker invalidation is needed
+        api_key_cache.evict_expired()
     except Exception as e:
         db.rollback()
-        print(f"Error cleaning up API keys: {str(e)}") 
\ No newline at end of file
+        print(f"Error cleaning up API keys: {str(e)}")
+    return removed
+
+def _purge_files(paths, max_age_seconds: float, limit: int) -> int:
+    """Delete files older than max_age_seconds, at most limit of them"""
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for path in paths:
+        if removed >= limit:
+            break
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            print(f"Error removing {path}: {str(e)}")
+    return removed
+
+def _files(directory: str, keep=frozenset()):
+    """Files directly inside directory, skipping the absolute paths in keep"""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.abspath(entry.path) not in keep:
+                    yield entry.path
+    except FileNotFoundError:
+        return
+
+def purge_temp_files(db: Session, limit: int = FILE_PURGE_LIMIT) -> dict:
+    """Delete scanned images left behind in temp_images"""
+    return {"temp_images": _purge_files(_files(TEMP_IMAGE_DIR), TEMP_FILE_MAX_AGE_SECONDS, limit)}
+
+def purge_stale_assets(db: Session, limit: int = FILE_PURGE_LIMIT) -> dict:
+    """
+    Delete visitor cards and QR codes no user's current details map to:
+    superseded variants, cards of deleted users, timestamped cards from
+    before the card cache, and abandoned .tmp files
+    """
+    from qr_generation import QR_DIR, qr_cache_path, qr_payload
+    from template_generator import CARD_DIR, card_cache_path
+    from utils.render_queue import card_user_data
+
+    current_cards, current_qrs, user_dirs = set(), set(), set()
+    users = db.query(User.user_id, User.name, User.email, User.image_path, User.qr_code).yield_per(1000)
+    for user in users:
+        user_dirs.add(str(user.user_id))
+        current_qrs.add(os.path.abspath(qr_cache_path(qr_payload(user.user_id, user.name, user.email))))
+        if user.qr_code:
+            current_qrs.add(os.path.abspath(user.qr_code))
+        if user.image_path:
+            current_cards.add(os.path.abspath(card_cache_path(
+                card_user_data(user.user_id, user.name, user.email, user.image_path)
+            )))
+
+    removed = {"cards": 0, "qr_codes": 0, "card_dirs": 0}
+    # Top-level files are the legacy timestamped cards
+    removed["cards"] += _purge_files(_files(CARD_DIR), STALE_ASSET_GRACE_SECONDS, limit)
+    try:
+        card_dirs = [entry.path for entry in os.scandir(CARD_DIR) if entry.is_dir()]
+    except FileNotFoundError:
+        card_dirs = []
+    for card_dir in card_dirs:
+        if removed["cards"] >= limit:
+            break
+        keep = current_cards if os.path.basename(card_dir) in user_dirs else frozenset()
+        removed["cards"] += _purge_files(_files(card_dir, keep), STALE_ASSET_GRACE_SECONDS, limit - removed["cards"])
+        if not keep:
+            try:
+                # Only succeeds once the directory is empty
+                os.rmdir(card_dir)
+                removed["card_dirs"] += 1
+            except OSError:
+                pass
+    removed["qr_codes"] = _purge_files(_files(QR_DIR, current_qrs), STALE_ASSET_GRACE_SECONDS, limit)
+    return removed
@@ -0,0 +1,38 @@
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replace plaintext app_users passwords with salted hashes (logins rehash lazily otherwise)"
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from database import SessionLocal
+    import models
+    from utils.credential_backend import PASSWORD_HASH_ALGORITHM, hash_password
+
+    db = SessionLocal()
+    hashed = 0
+    try:
+        while True:
+            # Row locks keep a concurrent login from writing a hash that is then overwritten
+            users = db.query(models.AppUsers).filter(
+                ~models.AppUsers.password.startswith(f"{PASSWORD_HASH_ALGORITHM}$")
+            ).limit(args.batch_size).with_for_update(skip_locked=True).all()
+            if not users:
+                break
+            for app_user in users:
+                app_user.password = hash_password(app_user.password)
+            db.commit()
+            hashed += len(users)
+            print(f"Hashed {hashed} passwords")
+    finally:
+        db.close()
+    print(f"Done: {hashed} passwords hashed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+from datetime import datetime, time, timedelta
+from sqlalchemy import select, delete, exists, func, case, cast, extract, text, tuple_, Date, Integer
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import models
+from utils.analytics_rollups import IST
+from utils.response_cache import bump_data_version
+
+def _rollup_days(db: Session, day) -> list:
+    """Every IST day that has visits or rollup rows"""
+    days = select(day.label("day")).select_from(models.Visit).union(
+        select(models.AnalyticsHourlyRollup.day),
+        select(models.AnalyticsDailyVisitor.day)
+    ).subquery()
+    return list(db.execute(select(days.c.day).order_by(days.c.day)).scalars())
+
+def rebuild_analytics_rollups(db: Session) -> dict:
+    """
+    Regenerate the analytics rollup tables from visits, one day per
+    transaction. Each day's rows are upserted and rows no visit maps to any
+    more are deleted, so readers never see empty tables.
+    """
+    try:
+        visits = models.Visit
+        hourly_table = models.AnalyticsHourlyRollup.__table__
+        visitors_table = models.AnalyticsDailyVisitor.__table__
+        local_arrival = func.timezone('Asia/Kolkata', visits.arrival)
+        day = cast(local_arrival, Date)
+        hour = cast(extract('hour', local_arrival), Integer)
+        completed = visits.duration > timedelta(0)
+
+        hourly_rows, visitor_rows = 0, 0
+        days = _rollup_days(db, day)
+        for rollup_day in days:
+            # Check-ins update the rollups in the same transaction as their
+            # visit; this waits for those in flight and holds new ones back
+            # for the day, so none is counted twice or lost
+            db.execute(text(
+                "LOCK TABLE analytics_hourly_rollups, analytics_daily_visitors IN SHARE ROW EXCLUSIVE MODE"
+            ))
+            # Bounds on arrival itself so ix_visits_arrival is used
+            start = IST.localize(datetime.combine(rollup_day, time.min))
+            end = IST.localize(datetime.combine(rollup_day + timedelta(days=1), time.min))
+            in_day = [visits.arrival >= start, visits.arrival < end]
+
+            hourly = insert(hourly_table).from_select(
+                ["day", "hour", "group_name", "entries", "completed_visits", "total_duration_minutes"],
+                select(
+                    day,
+                    hour,
+                    visits.group_name,
+                    func.count(),
+                    func.count().filter(completed),
+                    func.coalesce(func.sum(case((completed, extract('epoch', visits.duration) / 60))), 0)
+                ).where(*in_day).group_by(day, hour, visits.group_name)
+            )
+            hourly = hourly.on_conflict_do_update(
+                index_elements=["day", "hour", "group_name"],
+                set_={
+                    "entries": hourly.excluded.entries,
+                    "completed_visits": hourly.excluded.completed_visits,
+                    "total_duration_minutes": hourly.excluded.total_duration_minutes
+                }
+            ).returning(hourly_table.c.hour, hourly_table.c.group_name)
+            current = db.execute(hourly).all()
+            stale = delete(hourly_table).where(hourly_table.c.day == rollup_day)
+            if current:
+                stale = stale.where(
+                    tuple_(hourly_table.c.hour, hourly_table.c.group_name).not_in(current)
+                )
+            db.execute(stale)
+
+            visitors = db.execute(insert(visitors_table).from_select(
+                ["day", "group_name", "user_id"],
+                select(day, visits.group_name, visits.user_id).where(*in_day).distinct()
+            ).on_conflict_do_nothing())
+            db.execute(delete(visitors_table).where(
+                visitors_table.c.day == rollup_day,
+                ~exists().where(
+                    *in_day,
+                    visits.user_id == visitors_table.c.user_id,
+                    visits.group_name == visitors_table.c.group_name
+                )
+            ))
+            db.commit()
+            hourly_rows += len(current)
+            visitor_rows += visitors.rowcount
+    except Exception as e:
+        db.rollback()
+        print(f"Error rebuilding analytics rollups: {str(e)}")
+        raise
+    # Cached analytics responses were built from the old rollups
+    bump_data_version(db)
+    return {"days": len(days), "hourly_rows": hourly_rows, "new_visitor_rows": visitor_rows}
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt analytics rollups: {rebuild_analytics_rollups(db)}")
+    finally:
+        db.close()
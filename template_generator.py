@@ -1,6 +1,9 @@
 from datetime import datetime
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 import os
+import hashlib
+import json
+import threading
 import qrcode
 
 def resize_image(image, box_size):
@@ -25,74 +28,172 @@ def resize_image(image, box_size):
     
     return image.crop((left, top, right, bottom))
 
-def create_visitor_card(user_data):
+CARD_SIZE = (1414, 2000)  # Portrait-oriented card
+TEMPLATE_PATH = "template/template2.png"
+FONT_PATH = "fonts/arial.ttf"
+CARD_DIR = "generated_cards"
+# Bump when the drawing code changes so cached cards are re-rendered
+CARD_LAYOUT_VERSION = "1"
+
+# Layout positions
+PROFILE_SIZE = (300, 300)
+QR_SIZE = (650, 650)
+PROFILE_POS = (320, 910)  # Left side
+TEXT_X = 650  # Right side for text fields
+QR_POS = ((CARD_SIZE[0] - QR_SIZE[0]) // 2, 1350)  # Centered horizontally
+NAME_POS = (TEXT_X, 970)
+ID_POS = (TEXT_X, 1040)
+INSTITUTION_POS = (TEXT_X, 1110)
+
+# Lookup table for the QR mask: 255 where a channel is near-white
+_NEAR_WHITE = [255 if value > 240 else 0 for value in range(256)]
+
+def qr_mask_image(qr_img):
     """
-    Generate a visitor card for a user
-    user_data should contain: name, profile_image_path, qr_code_path, user_id, institution_name
+    Black-on-transparent QR: near-white pixels become transparent white and
+    everything else solid black. Same result as testing each pixel in Python,
+    computed with per-channel lookup tables.
     """
-    try:
-        card_size = (1414, 2000)  # Portrait-oriented card
-        template = Image.open("template/template2.png").resize(card_size)
-        
+    r, g, b, _ = qr_img.convert("RGBA").split()
+    white = ImageChops.multiply(
+        ImageChops.multiply(r.point(_NEAR_WHITE), g.point(_NEAR_WHITE)),
+        b.point(_NEAR_WHITE)
+    )
+    return Image.merge("RGBA", (white, white, white, ImageChops.invert(white)))
+
+class CardRenderer:
+    """
+    Renders visitor cards with the template and fonts loaded once per process.
+    The card canvas is reused between renders, so one renderer must not be
+    used by two threads at once.
+    """
+
+    def __init__(self, template_path: str = TEMPLATE_PATH, font_path: str = FONT_PATH):
+        self.template = Image.open(template_path).resize(CARD_SIZE).convert("RGBA")
+        self.font_large = ImageFont.truetype(font_path, 55)
+        self.font_medium = ImageFont.truetype(font_path, 40)
+        self._card = self.template.copy()
+        self._draw = ImageDraw.Draw(self._card)
+
+    def render(self, user_data, qr_img=None):
+        """
+        Draw a card onto the shared canvas and return it. The returned image is
+        overwritten by the next render. qr_img, when given, is used instead of
+        reading user_data["qr_code_path"].
+        """
         # Load user profile image
         try:
             profile_img = Image.open(user_data["profile_image_path"])
         except:
             # Fallback to placeholder if profile image loading fails
-            profile_img = Image.new('RGB', (300, 300), 'gray')
-        profile_img = resize_image(profile_img, (300, 300))
-        
+            profile_img = Image.new('RGB', PROFILE_SIZE, 'gray')
+        profile_img = resize_image(profile_img, PROFILE_SIZE)
+
         # Load and process QR code
         try:
-            qr_img = Image.open(user_data["qr_code_path"]).convert("RGBA")
-            
-            # Create a mask for the QR code
-            data = qr_img.getdata()
-            new_data = []
-            for item in data:
-                # If pixel is white or near-white, make it transparent
-                if item[0] > 240 and item[1] > 240 and item[2] > 240:
-                    new_data.append((255, 255, 255, 0))  # Transparent
-                else:
-                    new_data.append((0, 0, 0, 255))  # Solid black
-            
-            qr_img.putdata(new_data)
-            qr_img = resize_image(qr_img, (650, 650))
-            
+            if qr_img is None:
+                qr_img = Image.open(user_data["qr_code_path"])
+            qr_img = resize_image(qr_mask_image(qr_img), QR_SIZE)
         except Exception as e:
             print(f"Error processing QR code: {str(e)}")
             raise
-        
-        # Create a copy of template and convert to RGBA
-        card = template.copy().convert("RGBA")
-        
-        # Layout positions
-        profile_pos = (320, 910)  # Left side
-        text_x = 650  # Right side for text fields
-        qr_pos = ((card_size[0] - 650) // 2, 1350)  # Centered horizontally
-        
-        name_pos = (text_x, 970)
-        id_pos = (text_x, 1040)
-        institution_pos = (text_x, 1110)
-        
+
+        card = self._card
+        card.paste(self.template, (0, 0))
+
         # Paste images
-        card.paste(profile_img, profile_pos)
-        card.paste(qr_img, qr_pos, qr_img)  # Use QR image as its own mask
-        
+        card.paste(profile_img, PROFILE_POS)
+        card.paste(qr_img, QR_POS, qr_img)  # Use QR image as its own mask
+
         # Add text
-        draw = ImageDraw.Draw(card)
-        font_large = ImageFont.truetype("fonts/arial.ttf", 55)
-        font_medium = ImageFont.truetype("fonts/arial.ttf", 40)
-        
-        draw.text(name_pos, f"Name: {user_data['name']}", fill="black", font=font_large, anchor="lm")
-        draw.text(id_pos, f"ID: {user_data['user_id']}", fill="black", font=font_medium, anchor="lm")
-        draw.text(institution_pos, f"Email: {user_data['email']}", fill="black", font=font_medium, anchor="lm")
-        
-        # Save the card
-        os.makedirs("generated_cards", exist_ok=True)
-        output_path = f"generated_cards/{user_data['name'].replace(' ', '_')}_visitor_card_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.png"
-        card.save(output_path, "PNG", quality=95)
-        
+        self._draw.text(NAME_POS, f"Name: {user_data['name']}", fill="black", font=self.font_large, anchor="lm")
+        self._draw.text(ID_POS, f"ID: {user_data['user_id']}", fill="black", font=self.font_medium, anchor="lm")
+        self._draw.text(INSTITUTION_POS, f"Email: {user_data['email']}", fill="black", font=self.font_medium, anchor="lm")
+        return card
+
+_card_renderer = None
+_card_renderer_lock = threading.Lock()
+_template_version = None
+
+def get_card_renderer() -> CardRenderer:
+    """Process-wide renderer, created on first use"""
+    global _card_renderer
+    if _card_renderer is None:
+        _card_renderer = CardRenderer()
+    return _card_renderer
+
+def template_version() -> str:
+    """Digest of the layout, template and font; part of every card cache key"""
+    global _template_version
+    if _template_version is None:
+        digest = hashlib.sha256(CARD_LAYOUT_VERSION.encode())
+        for path in (TEMPLATE_PATH, FONT_PATH):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        _template_version = digest.hexdigest()[:16]
+    return _template_version
+
+def card_cache_path(user_data) -> str:
+    """
+    Deterministic card location for user_data. The file name hashes everything
+    printed on the card, so a changed name, email, photo or template misses.
+    """
+    key = hashlib.sha256(json.dumps([
+        template_version(),
+        str(user_data["user_id"]),
+        user_data["name"],
+        user_data["email"],
+        user_data["profile_image_path"]
+    ]).encode()).hexdigest()[:32]
+    return os.path.join(CARD_DIR, str(user_data["user_id"]), f"card_{key}.png")
+
+def cached_visitor_card(user_data):
+    """Path of the current card if it has been rendered, else None"""
+    output_path = card_cache_path(user_data)
+    return output_path if os.path.exists(output_path) else None
+
+def invalidate_user_cards(user_id, keep_path=None) -> int:
+    """Delete a user's finished card variants, except keep_path"""
+    user_dir = os.path.join(CARD_DIR, str(user_id))
+    removed = 0
+    try:
+        entries = os.listdir(user_dir)
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        # A .tmp is another worker's render in progress; it renames it when done
+        if entry.endswith(".tmp"):
+            continue
+        path = os.path.join(user_dir, entry)
+        if keep_path and os.path.abspath(path) == os.path.abspath(keep_path):
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def create_visitor_card(user_data, qr_img=None):
+    """
+    Return the visitor card for a user, rendering it only if it is not cached.
+    user_data should contain: name, profile_image_path, qr_code_path, user_id, email
+    """
+    try:
+        output_path = card_cache_path(user_data)
+        if os.path.exists(output_path):
+            return output_path
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        # Write then rename so a concurrent reader never sees a partial card
+        tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with _card_renderer_lock:
+            card = get_card_renderer().render(user_data, qr_img)
+            card.save(tmp_path, "PNG", quality=95)
+        os.replace(tmp_path, output_path)
+
+        # Variants for old names, emails, photos or templates are stale now
+        invalidate_user_cards(user_data["user_id"], keep_path=output_path)
         return output_path
         
     except Exception as e:
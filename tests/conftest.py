@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the app's top-level modules (models, database, routes, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db():
+    """Session inside a transaction that is rolled back; commits become savepoints"""
+    if not os.getenv("DATABASE_URL"):
+        pytest.skip("DATABASE_URL is not set")
+    from sqlalchemy.orm import Session
+
+    import models
+    from database import engine
+    from migrations import apply_migrations
+
+    apply_migrations(engine, models.Base.metadata)
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = Session(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
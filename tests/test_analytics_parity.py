@@ -0,0 +1,117 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+if not os.getenv("DATABASE_URL"):
+    pytest.skip("DATABASE_URL is not set", allow_module_level=True)
+
+from sqlalchemy.orm import Session
+
+import models
+from routes.analytics import (
+    IST, analytics_filters, build_analytics_response, collect_stats_python,
+    collect_stats_rollup, collect_stats_sql, rollups_cover
+)
+from tasks.rollups import rebuild_analytics_rollups
+from utils.analytics_rollups import record_departure_rollup
+
+# A range no real data falls in
+START = datetime(2001, 3, 1)
+END = datetime(2001, 3, 3)
+
+
+def seed(db: Session) -> list:
+    users = [
+        models.User(name="Asha", email="parity-asha@example.com", group_name="alpha"),
+        models.User(name="Ben", email="parity-ben@example.com", group_name="alpha"),
+        models.User(name="Chen", email="parity-chen@example.com", group_name="beta"),
+        models.User(name="Dev", email="parity-dev@example.com", group_name=None),
+    ]
+    db.add_all(users)
+    db.flush()
+
+    # (user, IST day, hour, minute, minutes stayed or None while still inside)
+    visits = [
+        (0, 1, 9, 5, 30), (0, 1, 9, 50, None), (1, 1, 9, 10, 45),
+        (2, 1, 10, 0, 15), (3, 1, 10, 30, 60), (1, 1, 14, 0, None),
+        (0, 2, 9, 0, 20), (2, 2, 11, 15, 90), (2, 2, 11, 45, 5),
+        (3, 2, 14, 20, None), (1, 2, 23, 30, 10), (0, 3, 0, 15, 12),
+    ]
+    records = {}
+    for index, day, hour, minute, minutes in visits:
+        user = users[index]
+        arrival = IST.localize(datetime(2001, 3, day, hour, minute))
+        record = records.get((user.user_id, day))
+        if record is None:
+            record = records[(user.user_id, day)] = models.FinalRecords(
+                user_id=user.user_id, entry_date=arrival.date(), time_logs=[]
+            )
+            db.add(record)
+            db.flush()
+        duration = timedelta(minutes=minutes) if minutes is not None else None
+        db.add(models.Visit(
+            record_id=record.record_id,
+            user_id=user.user_id,
+            arrival=arrival,
+            departure=arrival + duration if duration else None,
+            duration=duration,
+            group_name=user.group_name or ""
+        ))
+    db.flush()
+    rebuild_analytics_rollups(db)
+    return users
+
+
+@pytest.mark.parametrize("group_name", [None, "alpha", "beta"])
+def test_engines_agree(db, group_name):
+    seed(db)
+    assert rollups_cover(START, END.replace(hour=23, minute=59), None)
+    start, end = START, END.replace(hour=23, minute=59, second=59, microsecond=999999)
+    filters = analytics_filters(start, end, group_name, None)
+
+    python = build_analytics_response(start, end, collect_stats_python(db, filters))
+    sql = build_analytics_response(start, end, collect_stats_sql(db, filters))
+    rollup = build_analytics_response(start, end, collect_stats_rollup(db, start, end, group_name))
+
+    assert python["overall_statistics"]["total_entries"] > 0
+    assert sql == python
+    assert rollup == python
+
+
+def test_rebuild_repairs_drifted_rollups(db):
+    seed(db)
+    start, end = START, END.replace(hour=23, minute=59, second=59, microsecond=999999)
+    expected = build_analytics_response(start, end, collect_stats_python(db, analytics_filters(start, end, None, None)))
+
+    # An overcounted bucket and a bucket no visit maps to any more
+    db.query(models.AnalyticsHourlyRollup).filter(
+        models.AnalyticsHourlyRollup.day == START.date()
+    ).update({"entries": models.AnalyticsHourlyRollup.entries + 5}, synchronize_session=False)
+    db.add(models.AnalyticsHourlyRollup(
+        day=START.date(), hour=3, group_name="gone", entries=2, completed_visits=0, total_duration_minutes=0
+    ))
+    db.flush()
+    assert build_analytics_response(start, end, collect_stats_rollup(db, start, end, None)) != expected
+
+    rebuild_analytics_rollups(db)
+    assert build_analytics_response(start, end, collect_stats_rollup(db, start, end, None)) == expected
+
+
+def test_departure_counts_under_arrival_group(db):
+    users = seed(db)
+    visit = db.query(models.Visit).filter(
+        models.Visit.user_id == users[0].user_id, models.Visit.departure.is_(None)
+    ).order_by(models.Visit.arrival).first()
+    users[0].group_name = "beta"
+    visit.duration = timedelta(minutes=40)
+    visit.departure = visit.arrival + visit.duration
+    record_departure_rollup(db, visit.group_name, visit.arrival, visit.duration)
+    db.flush()
+
+    start, end = START, END.replace(hour=23, minute=59, second=59, microsecond=999999)
+    for group_name in ("alpha", "beta"):
+        python = build_analytics_response(
+            start, end, collect_stats_python(db, analytics_filters(start, end, group_name, None))
+        )
+        assert build_analytics_response(start, end, collect_stats_rollup(db, start, end, group_name)) == python
@@ -0,0 +1,74 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from routes import app_users_handler
+from utils import image_ingest
+
+
+class Upload:
+    def __init__(self, data: bytes):
+        self.filename = "me.png"
+        self.file = io.BytesIO(data)
+
+    async def seek(self, offset: int) -> None:
+        self.file.seek(offset)
+
+
+class Result:
+    def scalars(self):
+        return self
+
+    def first(self):
+        return None
+
+
+class FailingCommitSession:
+    async def execute(self, statement):
+        return Result()
+
+    def add(self, instance):
+        pass
+
+    async def commit(self):
+        raise RuntimeError("connection reset")
+
+    async def rollback(self):
+        pass
+
+
+class RecordingBackend:
+    def __init__(self):
+        self.registered, self.unregistered = [], []
+
+    async def register(self, user_name, password, email):
+        self.registered.append(user_name)
+        return {"status": True}
+
+    async def unregister(self, user_name):
+        self.unregistered.append(user_name)
+
+
+def test_failed_commit_undoes_registration_and_picture(monkeypatch, tmp_path):
+    backend = RecordingBackend()
+    monkeypatch.setenv("ADMIN_NAME", "admin")
+    monkeypatch.setenv("ADMIN_PASSWORD", "secret")
+    monkeypatch.setattr(app_users_handler, "credential_backend", backend)
+    monkeypatch.setattr(app_users_handler, "hash_password", lambda password: "hashed")
+    monkeypatch.setattr(app_users_handler, "ingest_upload", lambda file, dest_dir, base_name: image_ingest.ingest_upload(
+        file, str(tmp_path), base_name
+    ))
+    picture = io.BytesIO()
+    Image.new("RGB", (32, 32), "plum").save(picture, "PNG")
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(app_users_handler.create_app_user_endpoint(
+            admin_name="admin", admin_password="secret", user_name="gate-7", user_password="pw",
+            user_email="gate7@example.com", profile_picture=Upload(picture.getvalue()), db=FailingCommitSession()
+        ))
+    assert raised.value.status_code == 500
+    assert backend.registered == backend.unregistered == ["gate-7"]
+    assert list(tmp_path.iterdir()) == []
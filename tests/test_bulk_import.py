@@ -0,0 +1,60 @@
+import io
+import zipfile
+
+import pytest
+from PIL import Image
+
+from utils import bulk_import
+
+
+def png(color: str) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 30), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def photo_zip() -> io.BytesIO:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as photos:
+        photos.writestr("good.png", png("navy"))
+        photos.writestr("broken.jpg", b"not an image at all")
+        photos.writestr("huge.png", b"\0" * 20000)
+    buffer.seek(0)
+    return buffer
+
+
+ROWS = (
+    "name,email,id_type,photo\n"
+    "Good,import-good@example.com,passport,good.png\n"
+    "Broken,import-broken@example.com,passport,broken.jpg\n"
+    "Huge,import-huge@example.com,passport,huge.png\n"
+).encode()
+
+
+@pytest.fixture
+def upload_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(bulk_import, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(bulk_import, "UPLOAD_MAX_BYTES", 10000)
+    monkeypatch.setattr(bulk_import, "submit_render_job", lambda *args: None)
+    return tmp_path
+
+
+def test_bad_photos_are_row_errors(db, upload_dir):
+    result = bulk_import.import_users(db, "rows.csv", ROWS, photo_zip(), send_emails=False)
+
+    assert result["inserted"] == 1
+    assert [error["row"] for error in result["errors"]] == [2, 3]
+    assert "not a valid image" in result["errors"][0]["error"]
+    assert "upload limit" in result["errors"][1]["error"]
+    stored = sorted(path.name for path in upload_dir.iterdir())
+    assert len(stored) == 2 and stored[1].endswith("_thumb.jpg")
+
+
+def test_rollback_removes_ingested_photos(db, upload_dir, monkeypatch):
+    def fail():
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(bulk_import, "new_render_job_id", fail)
+    with pytest.raises(RuntimeError):
+        bulk_import.import_users(db, "rows.csv", ROWS, photo_zip(), send_emails=False)
+    assert list(upload_dir.iterdir()) == []
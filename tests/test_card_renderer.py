@@ -0,0 +1,81 @@
+import os
+
+import template_generator
+
+
+def test_invalidate_keeps_in_progress_renders(tmp_path, monkeypatch):
+    monkeypatch.setattr(template_generator, "CARD_DIR", str(tmp_path))
+    user_dir = tmp_path / "7"
+    user_dir.mkdir()
+    for name in ("card_old.png", "card_new.png", "card_other.png.123.456.tmp"):
+        (user_dir / name).write_bytes(b"x")
+
+    removed = template_generator.invalidate_user_cards(7, keep_path=str(user_dir / "card_new.png"))
+
+    assert removed == 1
+    assert sorted(os.listdir(user_dir)) == ["card_new.png", "card_other.png.123.456.tmp"]
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_render(user_data):
+    """The per-pixel renderer CardRenderer replaced, minus saving to disk"""
+    from PIL import Image, ImageDraw, ImageFont
+    from template_generator import resize_image
+
+    template = Image.open("template/template2.png").resize((1414, 2000))
+    try:
+        profile_img = Image.open(user_data["profile_image_path"])
+    except:
+        profile_img = Image.new('RGB', (300, 300), 'gray')
+    profile_img = resize_image(profile_img, (300, 300))
+
+    qr_img = Image.open(user_data["qr_code_path"]).convert("RGBA")
+    new_data = []
+    for item in qr_img.getdata():
+        if item[0] > 240 and item[1] > 240 and item[2] > 240:
+            new_data.append((255, 255, 255, 0))
+        else:
+            new_data.append((0, 0, 0, 255))
+    qr_img.putdata(new_data)
+    qr_img = resize_image(qr_img, (650, 650))
+
+    card = template.copy().convert("RGBA")
+    card.paste(profile_img, (320, 910))
+    card.paste(qr_img, ((1414 - 650) // 2, 1350), qr_img)
+    draw = ImageDraw.Draw(card)
+    font_large = ImageFont.truetype("fonts/arial.ttf", 55)
+    font_medium = ImageFont.truetype("fonts/arial.ttf", 40)
+    draw.text((650, 970), f"Name: {user_data['name']}", fill="black", font=font_large, anchor="lm")
+    draw.text((650, 1040), f"ID: {user_data['user_id']}", fill="black", font=font_medium, anchor="lm")
+    draw.text((650, 1110), f"Email: {user_data['email']}", fill="black", font=font_medium, anchor="lm")
+    return card
+
+
+def test_renderer_matches_per_pixel_renderer(tmp_path, monkeypatch):
+    from PIL import Image, ImageChops
+
+    monkeypatch.chdir(REPO_ROOT)
+    renderer = template_generator.CardRenderer()
+    users = []
+    for user_id, name in ((11, "Ada Lovelace"), (12, "Grace Hopper")):
+        qr_path = str(tmp_path / f"qr_{user_id}.png")
+        template_generator.generate_qr_code(f"https://example.com/{user_id}", qr_path)
+        # Resampling leaves grey and tinted edge pixels around the threshold
+        Image.open(qr_path).convert("RGB").resize((333, 333), Image.LANCZOS).save(qr_path)
+        photo_path = str(tmp_path / f"photo_{user_id}.png")
+        Image.new("RGB", (480, 360), (40 * user_id % 256, 120, 200)).save(photo_path)
+        users.append({
+            "name": name,
+            "user_id": user_id,
+            "email": f"user{user_id}@example.com",
+            "qr_code_path": qr_path,
+            "profile_image_path": photo_path,
+        })
+    users.append(dict(users[0], profile_image_path=str(tmp_path / "missing.png")))
+
+    # Same renderer each time, so a stale canvas would show up as a difference
+    for user_data in users:
+        card = renderer.render(user_data)
+        assert ImageChops.difference(card, legacy_render(user_data)).getbbox() is None
@@ -0,0 +1,54 @@
+import io
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from routes import users
+
+
+class Upload:
+    def __init__(self, filename: str, data: bytes):
+        self.filename = filename
+        self.file = io.BytesIO(data)
+
+
+def photo() -> Upload:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), "teal").save(buffer, "PNG")
+    return Upload("photo.png", buffer.getvalue())
+
+
+def create(db, email):
+    return users.create_user(
+        None, name="Noor", email=email, image=photo(), id_type="passport", id="X1",
+        group_name=None, count=None, db=db
+    )
+
+
+@pytest.mark.parametrize("error, status", [
+    (RuntimeError("outbox unavailable"), 400),
+    (HTTPException(status_code=409, detail="conflict"), 409),
+])
+def test_failed_create_removes_ingested_image(db, monkeypatch, tmp_path, error, status):
+    def fail(*args):
+        raise error
+
+    monkeypatch.setattr(users, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(users, "queue_welcome_email", fail)
+    with pytest.raises(HTTPException) as raised:
+        create(db, "create-fail@example.com")
+    assert raised.value.status_code == status
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_create_user_survives_render_submit_failure(db, monkeypatch, tmp_path):
+    def broken(*args):
+        raise RuntimeError("A process in the process pool was terminated abruptly")
+
+    monkeypatch.setattr(users, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(users, "submit_render_job", broken)
+    monkeypatch.setattr(users, "bump_data_version", lambda db: None)
+    created = create(db, "create-submit@example.com")
+    assert created["render_status"] == "queued"
+    assert created["user_id"] is not None
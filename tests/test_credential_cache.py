@@ -0,0 +1,98 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from utils.credential_cache import CredentialCache, credential_digest
+
+firebase_controller = pytest.importorskip("firebase_controller")
+
+
+class StandInRef:
+    """The parts of a Realtime Database reference the controller uses for app_users"""
+
+    def __init__(self, users: dict):
+        self.users = users
+        self.listener = None
+        self.lookup_delay = None
+
+    def child(self, path):
+        return self
+
+    def listen(self, callback):
+        self.listener = callback
+        callback(SimpleNamespace(event_type="put", path="/", data=dict(self.users)))
+        return SimpleNamespace(close=lambda: None)
+
+    def emit(self, event_type, path, data):
+        self.listener(SimpleNamespace(event_type=event_type, path=path, data=data))
+
+    def order_by_child(self, field):
+        return self
+
+    def equal_to(self, name):
+        self._name = name
+        return self
+
+    def get(self):
+        if self.lookup_delay is not None:
+            self.lookup_delay.wait(5)
+        return {key: user for key, user in self.users.items() if user["name"] == self._name}
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    cache = CredentialCache()
+    monkeypatch.setattr(firebase_controller, "credential_cache", cache)
+    monkeypatch.setattr(firebase_controller, "_credential_listener", None)
+    monkeypatch.setattr(firebase_controller, "FIREBASE_LOOKUP_TIMEOUT_SECONDS", 0.2)
+    controller = firebase_controller.FirebaseController.__new__(firebase_controller.FirebaseController)
+    controller.ref = StandInRef({"k1": {"name": "gate-1", "password": "one", "email": "g1@example.com"}})
+    controller.start_credential_sync()
+    return controller, cache
+
+
+def test_cache_keeps_keyed_digests(controller):
+    _, cache = controller
+    assert cache.get("gate-1")["password_hash"] == credential_digest("one")
+    assert "one" not in str(cache.get("gate-1"))
+
+
+def test_stream_events_update_and_delete(controller):
+    controller, cache = controller
+    ref = controller.ref
+    assert controller.verify_app_user("gate-1", "one")["status"]
+
+    ref.emit("put", "/k1/password", "uno")
+    assert cache.verify("gate-1", "uno")["status"]
+    ref.emit("patch", "/k1", {"email": "new@example.com"})
+    assert cache.get("gate-1")["email"] == "new@example.com"
+    ref.emit("put", "/k2", {"name": "gate-2", "password": "two", "email": None})
+    assert cache.verify("gate-2", "two")["status"]
+
+    ref.emit("put", "/k1", None)
+    assert cache.get("gate-1") is None
+    ref.emit("patch", "/", {"k2": None})
+    assert cache.get("gate-2") is None
+
+
+def test_cache_miss_falls_back_to_direct_lookup(controller):
+    controller, cache = controller
+    # Added in Firebase without an event reaching this process
+    controller.ref.users["k3"] = {"name": "gate-3", "password": "three", "email": None}
+    assert cache.get("gate-3") is None
+    assert controller.verify_app_user("gate-3", "three")["status"]
+    assert cache.get("gate-3") is not None
+
+
+def test_slow_lookup_falls_back_to_cached_entry(controller):
+    controller, cache = controller
+    controller.ref.lookup_delay = threading.Event()
+    try:
+        # A wrong password misses the cache and goes to Firebase, which hangs
+        assert controller.verify_app_user("gate-1", "wrong")["status"] is False
+        assert cache.stats()["stale_hits"] == 1
+        # An uncached user cannot be answered at all
+        assert controller.verify_app_user("nobody", "x")["message"] == "Verification failed"
+    finally:
+        controller.ref.lookup_delay.set()
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from utils.email_outbox import EMAIL_ACCOUNT_BURST, EMAIL_ACCOUNT_DAILY_QUOTA, IST, OutboxDrainer, take_rate_token
+from utils.smtp_pool import SmtpAccount
+
+
+def test_rate_token_bucket(db):
+    account = "rate-test@example.com"
+    # A burst of 2 at one token per second
+    assert take_rate_token(db, account, rate_per_minute=60, burst=2) == 0
+    assert take_rate_token(db, account, rate_per_minute=60, burst=2) == 0
+    wait_seconds = take_rate_token(db, account, rate_per_minute=60, burst=2)
+    assert 0 < wait_seconds <= 1
+
+
+
+def test_spent_quota_returns_the_token(db):
+    account = "quota-test@example.com"
+    db.execute(text(
+        "INSERT INTO email_account_usage (account, day, sent) VALUES (:account, :day, :quota)"
+    ), {"account": account, "day": datetime.now(IST).date(), "quota": EMAIL_ACCOUNT_DAILY_QUOTA})
+    drainer = OutboxDrainer(None, accounts=[SmtpAccount(account, None, "localhost", 25)])
+
+    assert drainer._acquire_account(db) is None
+
+    tokens = db.execute(text(
+        "SELECT tokens FROM email_account_rate WHERE account = :account"
+    ), {"account": account}).scalar()
+    assert tokens == EMAIL_ACCOUNT_BURST
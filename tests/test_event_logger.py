@@ -0,0 +1,59 @@
+import json
+import threading
+import time
+
+from utils.event_logger import FirebaseEventLogger
+
+
+class HangingRef:
+    """A Firebase ref whose update() blocks until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def update(self, values):
+        self.release.wait(5)
+        raise ConnectionError("Firebase unreachable")
+
+
+class FailingRef:
+    def update(self, values):
+        raise ConnectionError("Firebase unreachable")
+
+
+def spilled_paths(spill_path) -> list:
+    with open(spill_path) as spill:
+        return [json.loads(line)["path"] for line in spill]
+
+
+def test_stop_is_bounded_and_spills_the_queue(tmp_path):
+    ref = HangingRef()
+    spill_path = tmp_path / "events.jsonl"
+    logger = FirebaseEventLogger(lambda: ref, queue_size=5, batch_size=1, flush_seconds=0.01, spill_path=str(spill_path))
+    for index in range(5):
+        logger.log("events", {"index": index})
+    time.sleep(0.1)  # the writer is now stuck on the first entry
+
+    started = time.monotonic()
+    logger.stop(timeout=0.2)
+    assert time.monotonic() - started < 2
+    # Everything the writer had not taken is on disk
+    assert len(spilled_paths(spill_path)) == 4
+    ref.release.set()
+
+
+def test_spill_file_is_capped(tmp_path):
+    spill_path = tmp_path / "events.jsonl"
+    logger = FirebaseEventLogger(
+        FailingRef, queue_size=100, batch_size=100, flush_seconds=0.01,
+        spill_path=str(spill_path), spill_max_bytes=1000
+    )
+    for index in range(50):
+        logger.log("events", {"index": index})
+    logger.stop()
+
+    stats = logger.stats()
+    assert spill_path.stat().st_size <= 1000
+    assert stats["spilled"] == len(spilled_paths(spill_path))
+    assert stats["spilled"] + stats["dropped"] == 50
+    assert stats["dropped"] > 0
@@ -0,0 +1,20 @@
+import pytest
+from fastapi import HTTPException
+
+import dependencies
+
+
+@pytest.mark.parametrize("configured, sent, status", [
+    ("", "anything", 404),
+    ("s3cret", None, 401),
+    ("s3cret", "wrong", 401),
+    ("s3cret", "s3cret", None),
+])
+def test_require_internal_token(monkeypatch, configured, sent, status):
+    monkeypatch.setattr(dependencies, "INTERNAL_API_TOKEN", configured)
+    if status is None:
+        dependencies.require_internal_token(sent)
+    else:
+        with pytest.raises(HTTPException) as raised:
+            dependencies.require_internal_token(sent)
+        assert raised.value.status_code == status
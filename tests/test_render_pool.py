@@ -0,0 +1,39 @@
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from utils import render_queue
+
+
+def test_broken_pool_is_replaced(monkeypatch):
+    monkeypatch.setattr(render_queue, "RENDER_WORKERS", 1)
+    render_queue.shutdown_render_executor()
+    try:
+        broken = render_queue.get_render_executor()
+        # A worker dying mid-task breaks the whole pool
+        with pytest.raises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result(timeout=30)
+
+        executor = render_queue.get_render_executor()
+        assert executor is not broken
+        assert executor.submit(pow, 2, 10).result(timeout=30) == 1024
+    finally:
+        render_queue.shutdown_render_executor()
+
+
+def test_jobs_are_finished_off_the_pool_thread(monkeypatch):
+    finished = []
+    monkeypatch.setattr(render_queue, "_finish_render_job", lambda job_id, user_id, future: finished.append(
+        (job_id, threading.current_thread().name)
+    ))
+    try:
+        # The photo does not exist, so the render fails; the job is finished either way
+        future = render_queue.submit_render_job("job-1", 1, "Ada", "ada@example.com", "/nonexistent/photo.jpg")
+        future.exception(timeout=60)
+    finally:
+        render_queue.shutdown_render_executor()
+    assert len(finished) == 1
+    job_id, thread_name = finished[0]
+    assert job_id == "job-1" and thread_name.startswith("render-job-finisher")
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+
+import models
+from utils import render_queue
+
+
+def test_stale_jobs_are_requeued_or_failed(db, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(render_queue, "submit_render_job", lambda *args: submitted.append(args))
+    monkeypatch.setattr(render_queue, "RENDER_JOB_MAX_ATTEMPTS", 3)
+
+    user = models.User(name="Ira", email="requeue-ira@example.com", image_path="uploads/ira.jpg")
+    db.add(user)
+    db.flush()
+    old = datetime.utcnow() - timedelta(hours=1)
+    db.add_all([
+        models.RenderJob(job_id="requeue-lost", user_id=user.user_id, submitted_at=old),
+        models.RenderJob(job_id="requeue-spent", user_id=user.user_id, submitted_at=old, attempts=3),
+        models.RenderJob(job_id="requeue-fresh", user_id=user.user_id),
+        models.RenderJob(job_id="requeue-done", user_id=user.user_id, submitted_at=old, status="done"),
+    ])
+    db.commit()
+
+    result = render_queue.requeue_stale_render_jobs(db, timeout_seconds=600)
+
+    assert result == {"requeued": 1, "failed": 1}
+    assert submitted == [("requeue-lost", user.user_id, "Ira", "requeue-ira@example.com", "uploads/ira.jpg")]
+    jobs = {job.job_id: job for job in db.query(models.RenderJob).filter(models.RenderJob.user_id == user.user_id)}
+    assert jobs["requeue-lost"].status == "queued" and jobs["requeue-lost"].attempts == 2
+    assert jobs["requeue-spent"].status == "failed" and jobs["requeue-spent"].finished_at is not None
+    assert jobs["requeue-fresh"].attempts == 1
+    assert jobs["requeue-done"].status == "done"
@@ -0,0 +1,12 @@
+from sqlalchemy import text
+
+from utils import response_cache
+
+
+def test_first_bump_changes_data_version(db, monkeypatch):
+    # A fresh sequence, as migration 004 leaves it on a new database
+    db.execute(text("CREATE TEMPORARY SEQUENCE test_data_version_seq"))
+    monkeypatch.setattr(response_cache, "DATA_VERSION_SEQUENCE", "test_data_version_seq")
+    before = response_cache.current_data_version(db)
+    response_cache.bump_data_version(db)
+    assert response_cache.current_data_version(db) != before
@@ -0,0 +1,125 @@
+import socketserver
+import threading
+from email.mime.text import MIMEText
+
+import pytest
+
+from utils import smtp_pool
+from utils.smtp_pool import EmailWorker, SmtpAccount
+
+
+class StubSmtpServer(socketserver.ThreadingTCPServer):
+    """
+    Just enough SMTP for smtplib. fail_next can be set to "421" to refuse the
+    next message with 421 and hang up, or "drop" to hang up without a reply.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubSmtpHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        self.fail_next = None
+
+    def take_failure(self):
+        with self.lock:
+            failure, self.fail_next = self.fail_next, None
+            return failure
+
+
+class StubSmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 stub ready")
+        while line := self.rfile.readline():
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 stub")
+            elif command.startswith("MAIL"):
+                failure = server.take_failure()
+                if failure == "drop":
+                    return
+                if failure == "421":
+                    self.reply("421 closing connection")
+                    return
+                self.reply("250 ok")
+            elif command.startswith(("RCPT", "RSET", "NOOP")):
+                self.reply("250 ok")
+            elif command == "DATA":
+                self.reply("354 go ahead")
+                body = []
+                while (data := self.rfile.readline()) not in (b".\r\n", b""):
+                    body.append(data)
+                with server.lock:
+                    server.messages.append(b"".join(body))
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+@pytest.fixture
+def smtp_server():
+    server = StubSmtpServer()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def worker(smtp_server):
+    account = SmtpAccount("sender@example.com", None, "127.0.0.1", smtp_server.server_address[1], security="none")
+    worker = EmailWorker(workers=1, accounts=[account])
+    try:
+        yield worker
+    finally:
+        worker.shutdown()
+
+
+def send(worker, count: int) -> None:
+    for index in range(count):
+        msg = MIMEText(f"Message {index}")
+        msg["To"] = "guest@example.com"
+        msg["Subject"] = f"Test {index}"
+        assert worker.submit(msg).result(timeout=10) is True
+
+
+def test_connection_is_reused(smtp_server, worker):
+    send(worker, 5)
+    assert len(smtp_server.messages) == 5
+    assert smtp_server.connections == 1
+    assert worker.stats()["connections_opened"] == 1
+
+
+def test_connection_is_recycled_after_message_limit(smtp_server, worker, monkeypatch):
+    monkeypatch.setattr(smtp_pool, "SMTP_MAX_MESSAGES_PER_CONNECTION", 2)
+    send(worker, 5)
+    assert len(smtp_server.messages) == 5
+    assert smtp_server.connections == 3
+    assert worker.stats()["reconnects"] == 0
+
+
+@pytest.mark.parametrize("failure", ["421", "drop"])
+def test_reconnects_and_retries_once(smtp_server, worker, failure):
+    send(worker, 1)
+    smtp_server.fail_next = failure
+    send(worker, 1)
+    assert len(smtp_server.messages) == 2
+    assert smtp_server.connections == 2
+    stats = worker.stats()
+    assert stats["reconnects"] == 1
+    assert stats["failed"] == 0
@@ -0,0 +1,41 @@
+import json
+from datetime import datetime
+
+import pytz
+
+import models
+from routes import users
+
+
+def stream(limit, after=None):
+    lines = [json.loads(line) for line in users._stream_users(limit, after, datetime.now(pytz.timezone('Asia/Kolkata')))]
+    assert not [line for line in lines if line["type"] == "error"]
+    return lines
+
+
+def test_stream_pages(db, monkeypatch):
+    monkeypatch.setattr(users, "SessionLocal", lambda: db)
+    today = datetime.now(pytz.timezone('Asia/Kolkata')).date()
+    for index in range(3):
+        user = models.User(name=f"Stream {index}", email=f"stream-{index}@example.com")
+        db.add(user)
+        db.flush()
+        db.add(models.FinalRecords(user_id=user.user_id, entry_date=today, time_logs=[]))
+    db.commit()
+    total = db.query(models.User).count()
+
+    # A short page is the last one
+    lines = stream(total + 1)
+    assert len([line for line in lines if line["type"] == "user"]) == total
+    assert lines[-1] == {"type": "page", "next_cursor": None}
+
+    # A full page may be followed by an empty one, which still carries the totals
+    lines = stream(total)
+    statistics, cursor = lines[0], lines[-1]["next_cursor"]
+    assert cursor is not None
+    lines = stream(total, cursor)
+    assert [line["type"] for line in lines] == ["statistics", "page"]
+    assert lines[0]["statistics"] == statistics["statistics"]
+    assert lines[0]["today_statistics"] == statistics["today_statistics"]
+    assert lines[0]["today_statistics"]["total_entries"] >= 3
+    assert lines[-1]["next_cursor"] is None
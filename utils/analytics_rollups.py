@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import models
+import pytz
+
+IST = pytz.timezone('Asia/Kolkata')
+
+
+def rollup_bucket(arrival: datetime) -> tuple:
+    """IST (day, hour) bucket of an arrival"""
+    local_arrival = arrival.astimezone(IST)
+    return local_arrival.date(), local_arrival.hour
+
+
+def user_group(user_id: int):
+    """The user's group as stored in rollups and on visits: '' when there is none"""
+    # Outer coalesce too, so an unknown user fails on the visits foreign key
+    return func.coalesce(select(func.coalesce(models.User.group_name, "")).where(
+        models.User.user_id == user_id
+    ).scalar_subquery(), "")
+
+
+def arrival_rollup_statements(user_id: int, arrival: datetime) -> tuple:
+    """
+    Statements that count one arrival in the hourly rollup and record the
+    visitor for the day. Built to run as CTEs of the check-in statement.
+    """
+    day, hour = rollup_bucket(arrival)
+    hourly = insert(models.AnalyticsHourlyRollup).from_select(
+        ["day", "hour", "group_name", "entries", "completed_visits", "total_duration_minutes"],
+        select(
+            literal(day), literal(hour), func.coalesce(models.User.group_name, ""),
+            literal(1), literal(0), literal(0.0)
+        ).where(models.User.user_id == user_id)
+    )
+    hourly = hourly.on_conflict_do_update(
+        index_elements=["day", "hour", "group_name"],
+        set_={"entries": models.AnalyticsHourlyRollup.entries + 1}
+    )
+    visitor = insert(models.AnalyticsDailyVisitor).from_select(
+        ["day", "group_name", "user_id"],
+        select(
+            literal(day), func.coalesce(models.User.group_name, ""), models.User.user_id
+        ).where(models.User.user_id == user_id)
+    ).on_conflict_do_nothing()
+    return hourly, visitor
+
+
+def record_departure_rollup(db: Session, group_name: str, arrival: datetime, duration: timedelta) -> None:
+    """
+    Add a completed visit to its arrival bucket, in the caller's transaction.
+    group_name is the visit's, so a group change since arrival is ignored.
+    """
+    minutes = duration.total_seconds() / 60
+    if minutes <= 0:
+        return
+    day, hour = rollup_bucket(arrival)
+    rollup = models.AnalyticsHourlyRollup
+    db.execute(
+        update(rollup)
+        .where(rollup.day == day, rollup.hour == hour, rollup.group_name == group_name)
+        .values(
+            completed_visits=rollup.completed_visits + 1,
+            total_duration_minutes=rollup.total_duration_minutes + minutes
+        )
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+NOTIFY_CHANNEL = "api_key_invalidated"
+
+# Columns copied out of AppUsers so cached entries never hold a live ORM object
+APP_USER_FIELDS = ("user_id", "email", "image_path", "created_at", "api_key", "api_key_expiry")
+
+
+def hash_api_key(api_key: str) -> str:
+    """Cache key for an API key, so raw keys never leave the process"""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+class ApiKeyCache:
+    """
+    Bounded LRU cache of validated API keys with a TTL.
+    Each entry keeps a snapshot of the app user and the key expiry.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 60, notify: bool = False):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.notify = notify
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, api_key: str) -> Optional[models.AppUsers]:
+        """Return a transient AppUsers for a cached, unexpired key, else None"""
+        key = hash_api_key(api_key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            cached_until, snapshot = entry
+            expiry = snapshot["api_key_expiry"]
+            if cached_until < now or not expiry or expiry < datetime.utcnow():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return models.AppUsers(**snapshot)
+
+    def put(self, api_key: str, app_user: models.AppUsers) -> None:
+        key = hash_api_key(api_key)
+        snapshot = {field: getattr(app_user, field) for field in APP_USER_FIELDS}
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    async def invalidate_async(self, api_key: Optional[str], db: Optional[AsyncSession] = None) -> None:
+        """
+        Drop a key locally. When notify is enabled and a session is given, other
+        workers are told through NOTIFY once the session's transaction commits.
+        """
+        if not api_key:
+            return
+        await self.invalidate_hash_async(hash_api_key(api_key), db)
+
+    async def invalidate_hash_async(self, key: str, db: Optional[AsyncSession] = None) -> None:
+        """invalidate_async() for a key known only by its hash, e.g. a stored session"""
+        self.discard(key)
+        if self.notify and db is not None:
+            await db.execute(text("SELECT pg_notify(:channel, :key)"), {"channel": NOTIFY_CHANNEL, "key": key})
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def evict_expired(self) -> int:
+        """Remove entries whose key expiry or cache TTL has passed"""
+        now = time.monotonic()
+        utc_now = datetime.utcnow()
+        with self._lock:
+            stale = [
+                key for key, (cached_until, snapshot) in self._entries.items()
+                if cached_until < now or not snapshot["api_key_expiry"] or snapshot["api_key_expiry"] < utc_now
+            ]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {"size": size, "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+def start_invalidation_listener(engine, cache: "ApiKeyCache", poll_seconds: float = 5.0) -> Optional[threading.Thread]:
+    """
+    LISTEN for invalidations published by other workers and drop them locally.
+    Runs on a dedicated connection in a daemon thread; no-op unless notify is on.
+    """
+    if not cache.notify:
+        return None
+
+    def listen():
+        while True:
+            try:
+                connection = engine.raw_connection()
+                try:
+                    dbapi_connection = connection.driver_connection
+                    dbapi_connection.autocommit = True
+                    with dbapi_connection.cursor() as cursor:
+                        cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    # Anything cached before LISTEN may have missed a notification
+                    cache.clear()
+                    while True:
+                        if select.select([dbapi_connection], [], [], poll_seconds) == ([], [], []):
+                            continue
+                        dbapi_connection.poll()
+                        while dbapi_connection.notifies:
+                            cache.discard(dbapi_connection.notifies.pop(0).payload)
+                finally:
+                    connection.invalidate()
+            except Exception as e:
+                print(f"API key invalidation listener error: {str(e)}")
+                time.sleep(poll_seconds)
+
+    thread = threading.Thread(target=listen, name="api-key-cache-listener", daemon=True)
+    thread.start()
+    return thread
+
+
+api_key_cache = ApiKeyCache(
+    max_size=int(os.getenv("API_KEY_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.getenv("API_KEY_CACHE_TTL_SECONDS", "60")),
+    notify=os.getenv("API_KEY_CACHE_NOTIFY", "false").lower() in ("1", "true", "yes"),
+)
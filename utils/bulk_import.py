@@ -0,0 +1,267 @@
+import csv
+import io
+import json
+import os
+import zipfile
+from typing import BinaryIO, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+import models
+from utils.file_handlers import UPLOAD_DIR, delete_file
+from utils.image_ingest import UPLOAD_MAX_BYTES, ingest_image
+from utils.render_queue import new_render_job_id, submit_render_job
+from utils.response_cache import bump_data_version
+
+IMAGE_EXTENSIONS = ("jpg", "jpeg", "png", "webp")
+REQUIRED_FIELDS = ("name", "email", "id_type", "photo")
+INSERT_BATCH_SIZE = 500
+
+
+def parse_rows(filename: str, content: bytes) -> list:
+    """Rows from a CSV (with a header line) or JSONL file, as dicts"""
+    text = content.decode("utf-8-sig")
+    if filename.lower().endswith((".jsonl", ".ndjson")):
+        rows = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as e:
+                rows.append({"_error": f"Invalid JSON on line {line_number}: {str(e)}"})
+        return rows
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def _clean(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _photo_index(photos: zipfile.ZipFile) -> dict:
+    """Zip members by base name, so rows can name photos without their folder"""
+    index = {}
+    for info in photos.infolist():
+        if not info.is_dir():
+            index[os.path.basename(info.filename)] = info
+    return index
+
+
+def validate_rows(rows: list, photo_index: dict) -> tuple:
+    """
+    Split rows into importable ones and per-row errors.
+    Row numbers are 1-based positions in the input file.
+    """
+    valid, errors, seen_emails = [], [], set()
+    for row_number, raw in enumerate(rows, start=1):
+        if "_error" in raw:
+            errors.append({"row": row_number, "email": None, "error": raw["_error"]})
+            continue
+        row = {key: _clean(raw.get(key)) for key in ("name", "email", "id_type", "id", "group_name", "count", "photo")}
+        missing = [field for field in REQUIRED_FIELDS if not row[field]]
+        if missing:
+            error = f"Missing {', '.join(missing)}"
+        elif row["photo"].rsplit(".", 1)[-1].lower() not in IMAGE_EXTENSIONS:
+            error = "Photo must be a jpg, jpeg, png, or webp file"
+        elif os.path.basename(row["photo"]) not in photo_index:
+            error = f"Photo {row['photo']} not found in zip"
+        elif row["email"] in seen_emails:
+            error = "Duplicate email in import file"
+        else:
+            error = None
+        if error:
+            errors.append({"row": row_number, "email": row["email"], "error": error})
+            continue
+        seen_emails.add(row["email"])
+        row["row"] = row_number
+        row["count"] = row["count"] or "1"
+        valid.append(row)
+    return valid, errors
+
+
+def existing_emails(db: Session, emails: list) -> set:
+    """Emails already registered, in one query"""
+    if not emails:
+        return set()
+    return set(db.execute(select(models.User.email).where(models.User.email.in_(emails))).scalars())
+
+
+def _save_photo(photos: zipfile.ZipFile, info: zipfile.ZipInfo) -> dict:
+    """Ingest a zip member like an uploaded photo; raises HTTPException for bad or oversized images"""
+    # Checked before decompressing; ingest_image enforces it again while copying
+    if info.file_size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image exceeds the {UPLOAD_MAX_BYTES} byte upload limit")
+    with photos.open(info) as source:
+        return ingest_image(source, UPLOAD_DIR, f"_{uuid4().hex}")
+
+
+def _delete_photo(row: dict) -> None:
+    delete_file(row["image_path"])
+    delete_file(row["thumbnail_path"])
+
+
+def import_users(
+    db: Session,
+    rows_filename: str,
+    rows_content: bytes,
+    photos_file: BinaryIO,
+    send_emails: bool = True
+) -> dict:
+    """
+    Register users from a CSV/JSONL file and a zip of their photos.
+
+    Rows are validated, deduplicated against users.email in one query and
+    inserted in batches together with their render jobs. Cards are then
+    rendered by the render process pool; poll import_progress for status.
+    """
+    rows = parse_rows(rows_filename, rows_content)
+    import_job = models.ImportJob(import_id=uuid4().hex, source=rows_filename, total_rows=len(rows))
+
+    with zipfile.ZipFile(photos_file) as photos:
+        photo_index = _photo_index(photos)
+        valid, errors = validate_rows(rows, photo_index)
+
+        registered = existing_emails(db, [row["email"] for row in valid])
+        to_insert = []
+        for row in valid:
+            if row["email"] in registered:
+                errors.append({"row": row["row"], "email": row["email"], "error": "User already exists with this email"})
+            else:
+                to_insert.append(row)
+
+        saved = []
+        try:
+            for row in to_insert:
+                try:
+                    stored = _save_photo(photos, photo_index[os.path.basename(row["photo"])])
+                except HTTPException as e:
+                    errors.append({"row": row["row"], "email": row["email"], "error": e.detail})
+                    continue
+                row["image_path"] = stored["image_path"]
+                row["thumbnail_path"] = stored["thumbnail_path"]
+                saved.append(row)
+            to_insert = saved
+
+            db.add(import_job)
+            db.flush()
+
+            # Batched multi-row INSERT .. RETURNING; an email registered by a
+            # concurrent request since the dedupe query is skipped, not fatal
+            user_ids = {}
+            statement = insert(models.User).on_conflict_do_nothing(index_elements=["email"]).returning(
+                models.User.user_id, models.User.email
+            )
+            for start in range(0, len(to_insert), INSERT_BATCH_SIZE):
+                batch = to_insert[start:start + INSERT_BATCH_SIZE]
+                result = db.execute(statement, [
+                    {
+                        "name": row["name"],
+                        "email": row["email"],
+                        "image_path": row["image_path"],
+                        "id_type": row["id_type"],
+                        "id": row["id"],
+                        "group_name": row["group_name"],
+                        "count": row["count"]
+                    }
+                    for row in batch
+                ])
+                user_ids.update({email: user_id for user_id, email in result})
+
+            created = []
+            for row in to_insert:
+                if row["email"] in user_ids:
+                    row["user_id"] = user_ids[row["email"]]
+                    row["job_id"] = new_render_job_id()
+                    created.append(row)
+                else:
+                    _delete_photo(row)
+                    errors.append({"row": row["row"], "email": row["email"], "error": "User already exists with this email"})
+
+            for start in range(0, len(created), INSERT_BATCH_SIZE):
+                batch = created[start:start + INSERT_BATCH_SIZE]
+                db.execute(insert(models.RenderJob), [
+                    {"job_id": row["job_id"], "user_id": row["user_id"], "import_id": import_job.import_id}
+                    for row in batch
+                ])
+                if send_emails:
+                    # Welcome emails go through the outbox once each card is rendered
+                    db.execute(insert(models.EmailOutbox), [
+                        {
+                            "kind": "welcome",
+                            "to_email": row["email"],
+                            "user_id": row["user_id"],
+                            "render_job_id": row["job_id"],
+                            "payload": {"user_name": row["name"]}
+                        }
+                        for row in batch
+                    ])
+
+            errors.sort(key=lambda error: error["row"])
+            import_job.inserted = len(created)
+            import_job.skipped = len(rows) - len(created)
+            import_job.errors = errors
+            db.commit()
+        except Exception:
+            db.rollback()
+            for row in saved:
+                _delete_photo(row)
+            raise
+
+    bump_data_version(db)
+    for row in created:
+        try:
+            submit_render_job(row["job_id"], row["user_id"], row["name"], row["email"], row["image_path"])
+        except Exception as e:
+            # Committed jobs are resubmitted by requeue_stale_render_jobs
+            print(f"Error submitting render job {row['job_id']}: {str(e)}")
+    print(f"Import {import_job.import_id}: {len(created)} users created, {len(errors)} rows rejected")
+
+    return {
+        "import_id": import_job.import_id,
+        "total_rows": len(rows),
+        "inserted": len(created),
+        "skipped": len(rows) - len(created),
+        "errors": errors,
+        "users": [{"row": row["row"], "user_id": row["user_id"], "email": row["email"], "render_job_id": row["job_id"]} for row in created]
+    }
+
+
+def import_progress(db: Session, import_id: str) -> Optional[dict]:
+    """Row counts and render status of an import, or None if it does not exist"""
+    import_job = db.query(models.ImportJob).filter(models.ImportJob.import_id == import_id).first()
+    if import_job is None:
+        return None
+    status_counts = dict(db.execute(
+        select(models.RenderJob.status, func.count())
+        .where(models.RenderJob.import_id == import_id)
+        .group_by(models.RenderJob.status)
+    ).all())
+    render_failures = db.execute(
+        select(models.RenderJob.user_id, models.RenderJob.error)
+        .where(models.RenderJob.import_id == import_id, models.RenderJob.status == "failed")
+        .order_by(models.RenderJob.user_id)
+    ).all()
+    queued = status_counts.get("queued", 0)
+    return {
+        "import_id": import_job.import_id,
+        "source": import_job.source,
+        "status": "rendering" if queued else "done",
+        "total_rows": import_job.total_rows,
+        "inserted": import_job.inserted,
+        "skipped": import_job.skipped,
+        "render": {
+            "queued": queued,
+            "done": status_counts.get("done", 0),
+            "failed": status_counts.get("failed", 0)
+        },
+        "errors": import_job.errors,
+        "render_errors": [{"user_id": user_id, "error": error} for user_id, error in render_failures],
+        "created_at": import_job.created_at.isoformat() if import_job.created_at else None
+    }
@@ -0,0 +1,174 @@
+import os
+import re
+import zipfile
+from concurrent.futures import as_completed
+from io import BytesIO
+from typing import Iterable, Iterator, Optional
+
+from PIL import Image
+
+# Printable sheets: A4 portrait at 150 dpi
+SHEET_DPI = 150
+SHEET_SIZE = (1240, 1754)
+SHEET_MARGIN = 40
+A4_POINTS = (595.28, 841.89)
+SHEET_JPEG_QUALITY = 90
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class _ChunkWriter:
+    """Write-only sink that hands out whatever was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_cards(ready: Iterable[tuple], pending: dict) -> Iterator[tuple]:
+    """
+    Yield (user, card_path, error) for cards already on disk, then for
+    pending renders in the order they finish. pending maps future -> user.
+    """
+    for user, card_path in ready:
+        yield user, card_path, None
+    for future in as_completed(pending):
+        user = pending[future]
+        try:
+            yield user, future.result()["card_path"], None
+        except Exception as e:
+            yield user, None, str(e)
+
+
+def card_filename(user) -> str:
+    name = re.sub(r"[^A-Za-z0-9_-]+", "_", user.name or "").strip("_")
+    return f"{user.user_id}_{name or 'visitor'}_card.png"
+
+
+def stream_zip(cards: Iterable[tuple]) -> Iterator[bytes]:
+    """ZIP archive of the cards, produced entry by entry; failures go in errors.txt"""
+    sink = _ChunkWriter()
+    errors = []
+    # An unseekable sink makes zipfile write data descriptors instead of seeking back
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for user, card_path, error in cards:
+            if error is None and not os.path.exists(card_path):
+                error = f"Visitor card file not found: {card_path}"
+            if error:
+                errors.append(f"{user.user_id}\t{user.email}\t{error}")
+                continue
+            with open(card_path, "rb") as source, archive.open(card_filename(user), mode="w") as entry:
+                while chunk := source.read(READ_CHUNK_SIZE):
+                    entry.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+        if errors:
+            archive.writestr("errors.txt", "\n".join(errors) + "\n")
+    yield sink.drain()
+
+
+def compose_sheets(cards: Iterable[tuple], columns: int, rows: int) -> Iterator[Image.Image]:
+    """Lay cards out columns x rows per sheet, keeping the card aspect ratio"""
+    cell_width = (SHEET_SIZE[0] - SHEET_MARGIN * (columns + 1)) // columns
+    cell_height = (SHEET_SIZE[1] - SHEET_MARGIN * (rows + 1)) // rows
+    per_sheet = columns * rows
+    sheet, placed = None, 0
+    for user, card_path, error in cards:
+        if error or not os.path.exists(card_path):
+            print(f"Skipping visitor card for user {user.user_id}: {error or 'file not found'}")
+            continue
+        if sheet is None:
+            sheet = Image.new("RGB", SHEET_SIZE, "white")
+        with Image.open(card_path) as card:
+            card.thumbnail((cell_width, cell_height), Image.LANCZOS)
+            column, row = placed % columns, placed // columns
+            x = SHEET_MARGIN + column * (cell_width + SHEET_MARGIN) + (cell_width - card.width) // 2
+            y = SHEET_MARGIN + row * (cell_height + SHEET_MARGIN) + (cell_height - card.height) // 2
+            sheet.paste(card, (x, y), card if card.mode == "RGBA" else None)
+        placed += 1
+        if placed == per_sheet:
+            yield sheet
+            sheet, placed = None, 0
+    if sheet is not None:
+        yield sheet
+
+
+class _PdfWriter:
+    """
+    Minimal PDF writer with one full-page JPEG per page. Pages are emitted as
+    they arrive; the page tree, xref and trailer are written at the end.
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 3
+
+    def _emit(self, data: bytes) -> bytes:
+        self.position += len(data)
+        return data
+
+    def _object(self, object_id: int, body: bytes, stream: Optional[bytes] = None) -> bytes:
+        self.offsets[object_id] = self.position
+        data = f"{object_id} 0 obj\n".encode() + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        return self._emit(data + b"\nendobj\n")
+
+    def header(self) -> bytes:
+        return self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def page(self, image: Image.Image) -> bytes:
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=SHEET_JPEG_QUALITY, dpi=(SHEET_DPI, SHEET_DPI))
+        jpeg = buffer.getvalue()
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        self.page_ids.append(page_id)
+        width, height = A4_POINTS
+        content = f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode()
+        return b"".join([
+            self._object(image_id, (
+                f"<< /Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} "
+                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg)} >>"
+            ).encode(), jpeg),
+            self._object(content_id, f"<< /Length {len(content)} >>".encode(), content),
+            self._object(page_id, (
+                f"<< /Type /Page /Parent {self.PAGES_ID} 0 R /MediaBox [0 0 {width} {height}] "
+                f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+            ).encode())
+        ])
+
+    def trailer(self) -> bytes:
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        data = self._object(self.PAGES_ID, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode())
+        data += self._object(self.CATALOG_ID, f"<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>".encode())
+        xref_offset = self.position
+        lines = [f"xref\n0 {self.next_id}\n", "0000000000 65535 f \n"]
+        for object_id in range(1, self.next_id):
+            lines.append(f"{self.offsets[object_id]:010d} 00000 n \n")
+        lines.append(f"trailer\n<< /Size {self.next_id} /Root {self.CATALOG_ID} 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        return data + self._emit("".join(lines).encode())
+
+
+def stream_pdf(cards: Iterable[tuple], columns: int = 2, rows: int = 2) -> Iterator[bytes]:
+    """Printable PDF with columns x rows cards per A4 page, one page at a time"""
+    writer = _PdfWriter()
+    yield writer.header()
+    for sheet in compose_sheets(cards, columns, rows):
+        yield writer.page(sheet)
+    yield writer.trailer()
@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+import models
+
+# PBKDF2-SHA256 rounds for app user passwords. Raising it rehashes each
+# password at its next successful login
+APP_USER_PASSWORD_ITERATIONS = int(os.getenv("APP_USER_PASSWORD_ITERATIONS", "200000"))
+PASSWORD_HASH_ALGORITHM = "pbkdf2_sha256"
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def hash_password(password: str, iterations: int = APP_USER_PASSWORD_ITERATIONS) -> str:
+    """Salted hash stored in app_users.password: pbkdf2_sha256$<iterations>$<salt>$<digest>"""
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{PASSWORD_HASH_ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}"
+
+
+def is_password_hash(stored: Optional[str]) -> bool:
+    return bool(stored) and stored.startswith(f"{PASSWORD_HASH_ALGORITHM}$")
+
+
+def verify_password(password: str, stored: Optional[str]) -> bool:
+    """
+    Check a password against a stored hash. Rows written before hashing was
+    introduced still hold the plaintext and are compared as such.
+    """
+    if not stored:
+        return False
+    if not is_password_hash(stored):
+        return hmac.compare_digest(stored.encode(), password.encode())
+    try:
+        _, iterations, salt, digest = stored.split("$")
+        candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), _unb64(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(candidate, _unb64(digest))
+
+
+def needs_rehash(stored: Optional[str]) -> bool:
+    """True for plaintext rows and hashes made with a different cost"""
+    if not is_password_hash(stored):
+        return True
+    try:
+        return int(stored.split("$")[1]) != APP_USER_PASSWORD_ITERATIONS
+    except (IndexError, ValueError):
+        return True
+
+
+async def _get_app_user(db: AsyncSession, user_name: str) -> Optional[models.AppUsers]:
+    return (await db.execute(
+        select(models.AppUsers).where(models.AppUsers.user_id == user_name)
+    )).scalars().first()
+
+
+class FirebaseCredentialBackend:
+    """Passwords are checked against the Firebase app_users tree"""
+
+    name = "firebase"
+
+    async def authenticate(self, db: AsyncSession, user_name: str, password: str) -> Optional[models.AppUsers]:
+        from firebase_controller import get_firebase_controller
+        result = await run_in_threadpool(
+            lambda: get_firebase_controller().verify_app_user(user_name, password)
+        )
+        if not result.get("status"):
+            return None
+        app_user = await _get_app_user(db, user_name)
+        if app_user is not None and needs_rehash(app_user.password):
+            # Keep the local hash current so the postgres backend can take over;
+            # written with the caller's next commit
+            app_user.password = await run_in_threadpool(hash_password, password)
+        return app_user
+
+    async def register(self, user_name: str, password: str, email: str) -> dict:
+        from firebase_controller import get_firebase_controller
+        return await run_in_threadpool(
+            lambda: get_firebase_controller().create_app_user(user_name, password, email)
+        ) or {"status": False, "message": "User creation failed"}
+
+    async def unregister(self, user_name: str) -> None:
+        """Undo register() when the app_users row could not be committed"""
+        from firebase_controller import get_firebase_controller
+        await run_in_threadpool(lambda: get_firebase_controller().delete_app_user(user_name))
+
+
+class PostgresCredentialBackend:
+    """Passwords are checked in-process against the salted hashes in app_users"""
+
+    name = "postgres"
+
+    def __init__(self):
+        self._dummy_hash = None
+
+    async def authenticate(self, db: AsyncSession, user_name: str, password: str) -> Optional[models.AppUsers]:
+        app_user = await _get_app_user(db, user_name)
+        if app_user is None:
+            # Spend the same hashing time so unknown names are not distinguishable
+            if self._dummy_hash is None:
+                self._dummy_hash = hash_password(secrets.token_urlsafe(16))
+            await run_in_threadpool(verify_password, password, self._dummy_hash)
+            return None
+        if not await run_in_threadpool(verify_password, password, app_user.password):
+            return None
+        if needs_rehash(app_user.password):
+            # Written with the caller's next commit, e.g. the login that issues the API key
+            app_user.password = await run_in_threadpool(hash_password, password)
+        return app_user
+
+    async def register(self, user_name: str, password: str, email: str) -> dict:
+        # The app_users row written by the caller is the only record
+        return {"status": True, "message": "User created successfully"}
+
+    async def unregister(self, user_name: str) -> None:
+        # Nothing outside the caller's transaction to undo
+        return None
+
+
+def create_credential_backend():
+    if os.getenv("APP_USER_AUTH_BACKEND", "firebase") == "postgres":
+        return PostgresCredentialBackend()
+    return FirebaseCredentialBackend()
+
+
+credential_backend = create_credential_backend()
@@ -0,0 +1,142 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Key for the cached password digests. The cache lives in one process, so a
+# random per-process key works; set it only to compare digests across processes
+CREDENTIAL_CACHE_SECRET = os.getenv("CREDENTIAL_CACHE_SECRET", "").encode() or secrets.token_bytes(32)
+
+
+def credential_digest(password: str) -> str:
+    """
+    Cached credentials keep a keyed digest, never the password itself, so a
+    leaked snapshot cannot be checked against plain SHA-256 dictionaries
+    """
+    return hmac.new(CREDENTIAL_CACHE_SECRET, password.encode(), hashlib.sha256).hexdigest()
+
+
+class CredentialCache:
+    """
+    Local copy of the Firebase app_users tree, indexed by user name.
+
+    Fed by the Realtime Database stream (put/patch events relative to
+    app_users), so after the first snapshot only changes are transferred.
+    """
+
+    def __init__(self):
+        self._by_key = {}
+        self._key_by_name = {}
+        self._lock = threading.Lock()
+        self.synced = False
+        self.last_event_at = None
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    @staticmethod
+    def _snapshot(user: Dict[str, Any]) -> Dict[str, Any]:
+        password = user.get("password")
+        return {
+            "name": user.get("name"),
+            "email": user.get("email"),
+            "password_hash": credential_digest(str(password)) if password is not None else user.get("_password_hash")
+        }
+
+    def _set(self, key: str, user: Optional[Dict[str, Any]]) -> None:
+        old = self._by_key.pop(key, None)
+        if old and self._key_by_name.get(old["name"]) == key:
+            del self._key_by_name[old["name"]]
+        if isinstance(user, dict):
+            snapshot = self._snapshot(user)
+            self._by_key[key] = snapshot
+            if snapshot["name"] is not None:
+                self._key_by_name[snapshot["name"]] = key
+
+    def load(self, users: Optional[Dict[str, Any]]) -> None:
+        """Replace the cache with a full app_users snapshot"""
+        with self._lock:
+            self._by_key.clear()
+            self._key_by_name.clear()
+            for key, user in (users or {}).items():
+                self._set(key, user)
+            self.synced = True
+            self.last_event_at = time.time()
+
+    def upsert(self, key: str, user: Dict[str, Any]) -> None:
+        with self._lock:
+            self._set(key, user)
+
+    def apply_event(self, event_type: str, path: str, data: Any) -> None:
+        """Apply a stream event; path is relative to app_users"""
+        parts = [part for part in path.split("/") if part]
+        if not parts and event_type == "put":
+            self.load(data)
+            return
+        with self._lock:
+            self.last_event_at = time.time()
+            if not parts:
+                # patch at the root: {key: user or None, ...}
+                for key, user in (data or {}).items():
+                    self._set(key, user)
+                return
+            key = parts[0]
+            if len(parts) == 1:
+                if event_type == "put":
+                    self._set(key, data)
+                else:
+                    current = self._raw(key)
+                    current.update(data or {})
+                    self._set(key, current)
+                return
+            # put on a single field, e.g. /<key>/password
+            current = self._raw(key)
+            current[parts[1]] = data
+            self._set(key, current)
+
+    def _raw(self, key: str) -> Dict[str, Any]:
+        """Cached fields as a user dict; the password is unknown, only its digest"""
+        snapshot = self._by_key.get(key)
+        if snapshot is None:
+            return {}
+        return {"name": snapshot["name"], "email": snapshot["email"], "_password_hash": snapshot["password_hash"]}
+
+    def get(self, user_name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            key = self._key_by_name.get(user_name)
+            return dict(self._by_key[key]) if key is not None else None
+
+    def verify(self, user_name: str, password: str, stale: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Check a password against the cache. Returns the verification result, or
+        None when the cache cannot answer (user not cached).
+        """
+        user = self.get(user_name)
+        with self._lock:
+            if user is None:
+                self.misses += 1
+                return None
+            if stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+        if user["password_hash"] and hmac.compare_digest(user["password_hash"], credential_digest(password)):
+            return {"status": True, "message": "User found", "email": user["email"]}
+        return {"status": False, "message": "User not found", "email": None}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "synced": self.synced,
+                "size": len(self._by_key),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "last_event_at": self.last_event_at
+            }
+
+
+credential_cache = CredentialCache()
@@ -4,9 +4,10 @@ from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 from email.mime.application import MIMEApplication
 import os
-from typing import List
+from typing import List, Optional
 from fastapi import HTTPException, BackgroundTasks
 from pathlib import Path
+from utils.smtp_pool import email_worker
 
 class EmailConfig:
     # Gmail SMTP Configuration
@@ -54,10 +55,8 @@ class InstitutionEmailSender:
             """
             msg.attach(MIMEText(html_content, "html"))
             
-            server = smtplib.SMTP_SSL(EmailConfig.SMTP_SERVER, EmailConfig.SMTP_PORT)
-            server.login(self.email, self.password)
-            server.send_message(msg)
-            server.quit()
+            if not email_worker.send(msg):
+                return False
             print(f"✅ Email sent successfully to {to_email}")
             return True
         
@@ -108,10 +107,8 @@ class sendConfirmationEmailInstitution:
             """
             msg.attach(MIMEText(html_content, "html"))
             
-            server = smtplib.SMTP_SSL(EmailConfig.SMTP_SERVER, EmailConfig.SMTP_PORT)
-            server.login(self.email, self.password)
-            server.send_message(msg)
-            server.quit()
+            if not email_worker.send(msg):
+                return False
             print(f"✅ Email sent successfully to {to_email}")  
             return True
         
@@ -143,101 +140,94 @@ class InvitationEmailHandler:
         to_email: str,
         user_name: str,
         qr_code_path: str,
-        visitor_card_path: str
+        visitor_card_path: str,
+        qr_code_png: Optional[bytes] = None
     ) -> bool:
-        """Send welcome email with visitor card details and attachments"""
+        """
+        Send welcome email with visitor card details and attachments.
+        qr_code_png, when given, is attached as-is instead of reading qr_code_path.
+        """
         try:
-            from_email = os.getenv('SMTP_EMAIL')
-            email_password = os.getenv('SMTP_PASSWORD')
-            
-            # Fix: Convert MAIL_COUNT to int before comparison
-            mail_count = int(os.getenv('MAIL_COUNT', '0'))  # Default to 0 if not set
-            
-            if mail_count > 500 and mail_count <= 1000:
-                from_email = os.getenv('SMTP_EMAIL2')
-                email_password = os.getenv('SMTP_PASSWORD2')
-            elif mail_count > 1000 and mail_count <= 1500:
-                from_email = os.getenv('SMTP_EMAIL3')
-                email_password = os.getenv('SMTP_PASSWORD3')
+            msg = self.build_welcome_email(to_email, user_name, qr_code_path, visitor_card_path, qr_code_png)
 
-            msg = MIMEMultipart()
-            msg["From"] = from_email
-            msg["To"] = to_email
-            msg["Subject"] = " Your Visitor Card is Ready"
-
-            # HTML Content
-            html_content = f"""
-            <html>
-                <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-                    <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px;">
-                        <h1 style="text-align: center; color: #1a1a1a;">Welcome to Rajbhawan</h1>
-                        <div style="margin: 20px 0; line-height: 1.6;">
-                            <p>Dear {user_name},</p>
-                            <p>Welcome to Rajbhawan! Your registration has been completed successfully.</p>
-                            <p>Your visitor card and QR code are attached to this email.</p>
-                            <p>Important Information:</p>
-                            <ul>
-                                <li>Keep your QR code handy for quick check-in</li>
-                                <li>Your visitor card is your identity within the premises</li>
-                                <li>Follow all safety guidelines and protocols</li>
-                            </ul>
-                            <p>Please find your visitor card and QR code attached to this email.</p>
-                        </div>
-                        <div style="text-align: center; color: #6c757d; font-size: 12px; margin-top: 20px; border-top: 1px solid #dee2e6; padding-top: 20px;">
-                            <p>This is an automated message. Please do not reply to this email.</p>
-                            <p>Registration Team</p>
-                        </div>
-                    </div>
-                </body>
-            </html>
-            """
-
-            msg.attach(MIMEText(html_content, "html"))
-
-            # Attach Visitor Card
-            if os.path.exists(visitor_card_path):
-                with open(visitor_card_path, 'rb') as f:
-                    visitor_card = MIMEImage(f.read())
-                    visitor_card.add_header(
-                        'Content-Disposition',
-                        'attachment',
-                        filename=f'visitor_card_{user_name}.png'
-                    )
-                    msg.attach(visitor_card)
-
-            # Attach QR Code
-            if os.path.exists(qr_code_path):
-                with open(qr_code_path, 'rb') as f:
-                    qr_code = MIMEImage(f.read())
-                    qr_code.add_header(
-                        'Content-Disposition',
-                        'attachment',
-                        filename=f'qr_code_{user_name}.png'
-                    )
-                    msg.attach(qr_code)
-
-            try:
-                # Connect to Gmail SMTP Server and Send Email
-                server = smtplib.SMTP_SSL(EmailConfig.SMTP_SERVER, EmailConfig.SMTP_PORT)
-                server.login(from_email, email_password)
-                server.send_message(msg)
-                server.quit()
+            # Sent over the email worker's pooled connection
+            if email_worker.send(msg):
                 print(f"✅ Welcome email with attachments sent successfully to {to_email}!")
-                
-                # Update mail count safely
-                new_count = str(mail_count + 1)
-                os.environ['MAIL_COUNT'] = new_count
-
                 return True
-                
-            except Exception as e:
-                print(f"❌ SMTP Error: {str(e)}")
-                return False
+            return False
 
         except Exception as e:
             print(f"❌ Failed to send welcome email: {str(e)}")
             return False
 
+    @staticmethod
+    def build_welcome_email(
+        to_email: str,
+        user_name: str,
+        qr_code_path: str,
+        visitor_card_path: str,
+        qr_code_png: Optional[bytes] = None
+    ) -> MIMEMultipart:
+        """Welcome message with attachments; From is set by the sending account"""
+        msg = MIMEMultipart()
+        msg["To"] = to_email
+        msg["Subject"] = " Your Visitor Card is Ready"
+
+        # HTML Content
+        html_content = f"""
+        <html>
+            <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+                <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px;">
+                    <h1 style="text-align: center; color: #1a1a1a;">Welcome to Rajbhawan</h1>
+                    <div style="margin: 20px 0; line-height: 1.6;">
+                        <p>Dear {user_name},</p>
+                        <p>Welcome to Rajbhawan! Your registration has been completed successfully.</p>
+                        <p>Your visitor card and QR code are attached to this email.</p>
+                        <p>Important Information:</p>
+                        <ul>
+                            <li>Keep your QR code handy for quick check-in</li>
+                            <li>Your visitor card is your identity within the premises</li>
+                            <li>Follow all safety guidelines and protocols</li>
+                        </ul>
+                        <p>Please find your visitor card and QR code attached to this email.</p>
+                    </div>
+                    <div style="text-align: center; color: #6c757d; font-size: 12px; margin-top: 20px; border-top: 1px solid #dee2e6; padding-top: 20px;">
+                        <p>This is an automated message. Please do not reply to this email.</p>
+                        <p>Registration Team</p>
+                    </div>
+                </div>
+            </body>
+        </html>
+        """
+
+        msg.attach(MIMEText(html_content, "html"))
+
+        # Attach Visitor Card
+        if os.path.exists(visitor_card_path):
+            with open(visitor_card_path, 'rb') as f:
+                visitor_card = MIMEImage(f.read())
+                visitor_card.add_header(
+                    'Content-Disposition',
+                    'attachment',
+                    filename=f'visitor_card_{user_name}.png'
+                )
+                msg.attach(visitor_card)
+
+        # Attach QR Code
+        if qr_code_png is None and os.path.exists(qr_code_path):
+            with open(qr_code_path, 'rb') as f:
+                qr_code_png = f.read()
+        if qr_code_png is not None:
+            qr_code = MIMEImage(qr_code_png)
+            qr_code.add_header(
+                'Content-Disposition',
+                'attachment',
+                filename=f'qr_code_{user_name}.png'
+            )
+            msg.attach(qr_code)
+
+        return msg
+
 def send_welcome_email_background(
     background_tasks: BackgroundTasks,
     user_email: str,
@@ -0,0 +1,357 @@
+import os
+import random
+import threading
+from concurrent.futures import wait
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pytz
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import models
+from utils.smtp_pool import SmtpAccount, email_worker, sender_accounts
+
+EMAIL_OUTBOX_DRAIN = os.getenv("EMAIL_OUTBOX_DRAIN", "true").lower() in ("1", "true", "yes")
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "20"))
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "5"))
+# A claimed row becomes claimable again if its drainer dies before this passes
+EMAIL_OUTBOX_LEASE_SECONDS = int(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "300"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_BACKOFF_BASE_SECONDS = float(os.getenv("EMAIL_BACKOFF_BASE_SECONDS", "30"))
+EMAIL_BACKOFF_MAX_SECONDS = float(os.getenv("EMAIL_BACKOFF_MAX_SECONDS", "3600"))
+EMAIL_ACCOUNT_RATE_PER_MINUTE = float(os.getenv("EMAIL_ACCOUNT_RATE_PER_MINUTE", "20"))
+EMAIL_ACCOUNT_BURST = float(os.getenv("EMAIL_ACCOUNT_BURST", "5"))
+EMAIL_ACCOUNT_DAILY_QUOTA = int(os.getenv("EMAIL_ACCOUNT_DAILY_QUOTA", "500"))
+
+IST = pytz.timezone('Asia/Kolkata')
+
+
+def queue_welcome_email(db: Session, user_id: int, to_email: str, user_name: str, render_job_id: Optional[str]) -> models.EmailOutbox:
+    """Add a welcome email to the outbox; it is sent once the caller commits and the card is rendered"""
+    email = models.EmailOutbox(
+        kind="welcome",
+        to_email=to_email,
+        user_id=user_id,
+        render_job_id=render_job_id,
+        payload={"user_name": user_name}
+    )
+    db.add(email)
+    return email
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with jitter, capped at EMAIL_BACKOFF_MAX_SECONDS"""
+    delay = min(EMAIL_BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0), EMAIL_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class PermanentEmailError(Exception):
+    """The email can never be sent; retrying is pointless"""
+
+
+def take_rate_token(db: Session, account: str, rate_per_minute: float = EMAIL_ACCOUNT_RATE_PER_MINUTE,
+                    burst: float = EMAIL_ACCOUNT_BURST) -> float:
+    """
+    Take a send token from an account's bucket; returns 0 when one was
+    taken, otherwise the seconds until the next one. The row lock makes
+    every drainer share one bucket per account.
+    """
+    rate = rate_per_minute / 60
+    db.execute(text(
+        "INSERT INTO email_account_rate (account, tokens, updated_at) VALUES (:account, :burst, clock_timestamp()) "
+        "ON CONFLICT (account) DO NOTHING"
+    ), {"account": account, "burst": burst})
+    bucket = db.execute(text(
+        "SELECT least(:burst, tokens + extract(epoch FROM clock_timestamp() - updated_at) * :rate) AS tokens, "
+        "clock_timestamp() AS now FROM email_account_rate WHERE account = :account FOR UPDATE"
+    ), {"account": account, "burst": burst, "rate": rate}).one()
+    wait_seconds = 0.0
+    if bucket.tokens >= 1:
+        db.execute(text(
+            "UPDATE email_account_rate SET tokens = :tokens, updated_at = :now WHERE account = :account"
+        ), {"account": account, "tokens": bucket.tokens - 1, "now": bucket.now})
+    else:
+        wait_seconds = (1 - bucket.tokens) / rate
+    db.commit()
+    return wait_seconds
+
+
+def return_rate_token(db: Session, account: str, burst: float = EMAIL_ACCOUNT_BURST) -> None:
+    """Put back a token taken for a send that did not happen"""
+    db.execute(text(
+        "UPDATE email_account_rate SET tokens = least(:burst, tokens + 1) WHERE account = :account"
+    ), {"account": account, "burst": burst})
+    db.commit()
+
+
+def reserve_daily_quota(db: Session, account: str, quota: int = EMAIL_ACCOUNT_DAILY_QUOTA) -> bool:
+    """Count one send against today's quota of an account; False once it is used up"""
+    sent = db.execute(text(
+        "INSERT INTO email_account_usage (account, day, sent) VALUES (:account, :day, 1) "
+        "ON CONFLICT (account, day) DO UPDATE SET sent = email_account_usage.sent + 1 "
+        "WHERE email_account_usage.sent < :quota RETURNING sent"
+    ), {"account": account, "day": datetime.now(IST).date(), "quota": quota}).scalar()
+    db.commit()
+    return sent is not None
+
+
+def release_daily_quota(db: Session, account: str) -> None:
+    """Give back a reservation for a message the server never accepted"""
+    db.execute(text(
+        "UPDATE email_account_usage SET sent = greatest(sent - 1, 0) WHERE account = :account AND day = :day"
+    ), {"account": account, "day": datetime.now(IST).date()})
+    db.commit()
+
+
+class OutboxDrainer:
+    """
+    Sends outbox emails through the pooled SMTP worker.
+
+    Rows are claimed with FOR UPDATE SKIP LOCKED, so several drainers can run.
+    Accounts are tried in SMTP_EMAIL, SMTP_EMAIL2, SMTP_EMAIL3 order; the next
+    one is used when an account's token bucket is empty or its daily quota is
+    spent. Both are kept in Postgres, so they hold across all drainers.
+    """
+
+    def __init__(self, session_factory, accounts: Optional[list] = None):
+        self.session_factory = session_factory
+        self._accounts = accounts
+        self._exhausted = {}  # account -> IST day its quota ran out
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.sent_by_account = {}
+
+    @property
+    def accounts(self) -> list:
+        if self._accounts is None:
+            self._accounts = sender_accounts()
+        return self._accounts
+
+    def start(self) -> Optional[threading.Thread]:
+        if not EMAIL_OUTBOX_DRAIN or self._thread is not None:
+            return None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="email-outbox-drainer", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def wake(self) -> None:
+        """Poll now instead of at the next interval, e.g. after a card finished rendering"""
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                drained = self.drain_once()
+            except Exception as e:
+                print(f"Email outbox drain error: {str(e)}")
+                drained = 0
+            if not drained:
+                self._wake.wait(EMAIL_OUTBOX_POLL_SECONDS)
+                self._wake.clear()
+
+    def _acquire_account(self, db: Session) -> Optional[SmtpAccount]:
+        """First account with a token and quota left, waiting for a token if needed"""
+        while not self._stop.is_set():
+            today = datetime.now(IST).date()
+            available = [account for account in self.accounts if self._exhausted.get(account.email) != today]
+            if not available:
+                return None
+            waits = []
+            for account in available:
+                wait_seconds = take_rate_token(db, account.email)
+                if wait_seconds:
+                    waits.append(wait_seconds)
+                    continue
+                if reserve_daily_quota(db, account.email):
+                    return account
+                # Spent quota must not also use up a token the next account's turn could have had
+                return_rate_token(db, account.email)
+                print(f"Daily email quota reached for {account.email}")
+                self._exhausted[account.email] = today
+            self._stop.wait(min(waits) if waits else 0.05)
+        return None
+
+    def _claim(self, db: Session, limit: int) -> list:
+        """Lease due emails whose card is rendered (or that need none)"""
+        rows = db.execute(text(
+            "UPDATE email_outbox e SET next_attempt_at = now() + make_interval(secs => :lease), "
+            "attempts = e.attempts + 1 "
+            "FROM ("
+            "  SELECT o.email_id FROM email_outbox o "
+            "  LEFT JOIN render_jobs r ON r.job_id = o.render_job_id "
+            "  WHERE o.status = 'pending' AND o.next_attempt_at <= now() "
+            "  AND (o.render_job_id IS NULL OR r.status <> 'queued') "
+            "  ORDER BY o.next_attempt_at LIMIT :limit FOR UPDATE OF o SKIP LOCKED"
+            ") due WHERE e.email_id = due.email_id "
+            "RETURNING e.email_id, e.kind, e.to_email, e.payload, e.attempts, e.render_job_id"
+        ), {"lease": EMAIL_OUTBOX_LEASE_SECONDS, "limit": limit}).all()
+        db.commit()
+        return rows
+
+    def _build_message(self, db: Session, row):
+        from utils.email_handler import InvitationEmailHandler
+
+        if row.kind != "welcome":
+            raise ValueError(f"Unknown email kind: {row.kind}")
+        job = db.get(models.RenderJob, row.render_job_id) if row.render_job_id else None
+        if job is not None and job.status == "failed":
+            raise PermanentEmailError(f"Visitor card render failed: {job.error}")
+        return InvitationEmailHandler.build_welcome_email(
+            to_email=row.to_email,
+            user_name=row.payload.get("user_name", ""),
+            qr_code_path=job.qr_path if job else "",
+            visitor_card_path=job.card_path if job else ""
+        )
+
+    def drain_once(self) -> int:
+        """Claim and send one batch; returns how many rows were claimed"""
+        db = self.session_factory()
+        try:
+            if not self.accounts:
+                return 0
+            rows = self._claim(db, EMAIL_OUTBOX_BATCH_SIZE)
+            in_flight = {}
+            for index, row in enumerate(rows):
+                try:
+                    msg = self._build_message(db, row)
+                except PermanentEmailError as e:
+                    self._mark_failed(db, row, str(e), permanent=True)
+                    continue
+                except Exception as e:
+                    self._mark_failed(db, row, str(e))
+                    continue
+                account = self._acquire_account(db)
+                if account is None:
+                    # Every quota is spent (or shutting down): hand the rest back
+                    self._release(db, rows[index:])
+                    break
+                in_flight[email_worker.submit(msg, account)] = (row, account)
+
+            wait(in_flight)
+            for future, (row, account) in in_flight.items():
+                if future.exception() is None:
+                    self._mark_sent(db, row, account)
+                else:
+                    release_daily_quota(db, account.email)
+                    self._mark_failed(db, row, str(future.exception()), account=account)
+            return len(rows)
+        finally:
+            db.close()
+
+    def _release(self, db: Session, rows: list) -> None:
+        """Unclaim rows without counting an attempt; held until tomorrow if quotas ran out"""
+        delay = 0
+        if not self._stop.is_set():
+            now = datetime.now(IST)
+            tomorrow = IST.localize(datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+            delay = (tomorrow - now).total_seconds()
+        db.execute(text(
+            "UPDATE email_outbox SET attempts = attempts - 1, next_attempt_at = now() + make_interval(secs => :delay) "
+            "WHERE email_id = ANY(:ids)"
+        ), {"ids": [row.email_id for row in rows], "delay": delay})
+        db.commit()
+
+    def _mark_sent(self, db: Session, row, account: SmtpAccount) -> None:
+        db.execute(text(
+            "UPDATE email_outbox SET status = 'sent', sent_at = now(), sender_account = :account, last_error = NULL "
+            "WHERE email_id = :email_id"
+        ), {"account": account.email, "email_id": row.email_id})
+        db.commit()
+        with self._lock:
+            self.sent += 1
+            self.sent_by_account[account.email] = self.sent_by_account.get(account.email, 0) + 1
+        print(f"✅ Outbox email {row.email_id} sent to {row.to_email} from {account.email}")
+
+    def _mark_failed(self, db: Session, row, error: str, account: Optional[SmtpAccount] = None, permanent: bool = False) -> None:
+        give_up = permanent or row.attempts >= EMAIL_MAX_ATTEMPTS
+        db.execute(text(
+            "UPDATE email_outbox SET status = :status, last_error = :error, sender_account = :account, "
+            "next_attempt_at = now() + make_interval(secs => :delay) WHERE email_id = :email_id"
+        ), {
+            "status": "failed" if give_up else "pending",
+            "error": error[:1000],
+            "account": account.email if account else None,
+            "delay": 0 if give_up else backoff_seconds(row.attempts),
+            "email_id": row.email_id
+        })
+        db.commit()
+        with self._lock:
+            if give_up:
+                self.failed += 1
+            else:
+                self.retried += 1
+        print(f"❌ Outbox email {row.email_id} to {row.to_email} {'failed' if give_up else 'will be retried'}: {error}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "sent_by_account": dict(self.sent_by_account)
+            }
+
+
+def outbox_status(db: Session) -> dict:
+    """Queue depth by state and today's per-account send counts"""
+    depth = db.execute(text(
+        "SELECT "
+        "count(*) FILTER (WHERE o.status = 'pending' AND r.status = 'queued') AS waiting_for_card, "
+        "count(*) FILTER (WHERE o.status = 'pending' AND o.next_attempt_at <= now() "
+        "  AND (r.status IS NULL OR r.status <> 'queued')) AS ready, "
+        "count(*) FILTER (WHERE o.status = 'pending' AND o.next_attempt_at > now()) AS scheduled, "
+        "count(*) FILTER (WHERE o.status = 'sent') AS sent, "
+        "count(*) FILTER (WHERE o.status = 'failed') AS failed, "
+        "min(o.created_at) FILTER (WHERE o.status = 'pending') AS oldest_pending "
+        "FROM email_outbox o LEFT JOIN render_jobs r ON r.job_id = o.render_job_id"
+    )).one()
+    usage = dict(db.execute(text(
+        "SELECT account, sent FROM email_account_usage WHERE day = :day"
+    ), {"day": datetime.now(IST).date()}).all())
+    tokens = dict(db.execute(text(
+        "SELECT account, least(:burst, tokens + extract(epoch FROM now() - updated_at) * :rate) FROM email_account_rate"
+    ), {"burst": EMAIL_ACCOUNT_BURST, "rate": EMAIL_ACCOUNT_RATE_PER_MINUTE / 60}).all())
+    return {
+        "queue": {
+            "waiting_for_card": depth.waiting_for_card,
+            "ready": depth.ready,
+            "scheduled": depth.scheduled,
+            "sent": depth.sent,
+            "failed": depth.failed,
+            "oldest_pending": depth.oldest_pending.isoformat() if depth.oldest_pending else None
+        },
+        "accounts": [
+            {
+                "account": account.email,
+                "sent_today": usage.get(account.email, 0),
+                "daily_quota": EMAIL_ACCOUNT_DAILY_QUOTA,
+                "tokens": round(tokens.get(account.email, EMAIL_ACCOUNT_BURST), 2)
+            }
+            for account in sender_accounts()
+        ],
+        "drainer": outbox_drainer.stats(),
+        "smtp": email_worker.stats()
+    }
+
+
+def _session_factory():
+    from database import SessionLocal
+    return SessionLocal()
+
+
+outbox_drainer = OutboxDrainer(_session_factory)
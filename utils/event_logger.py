@@ -0,0 +1,219 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+FIREBASE_LOG_QUEUE_SIZE = int(os.getenv("FIREBASE_LOG_QUEUE_SIZE", "10000"))
+FIREBASE_LOG_BATCH_SIZE = int(os.getenv("FIREBASE_LOG_BATCH_SIZE", "200"))
+FIREBASE_LOG_FLUSH_SECONDS = float(os.getenv("FIREBASE_LOG_FLUSH_SECONDS", "1"))
+# Events that do not fit in the queue or fail to upload are appended here and
+# replayed later; empty to drop them instead
+FIREBASE_LOG_SPILL_PATH = os.getenv("FIREBASE_LOG_SPILL_PATH", "logs/firebase_events.spill.jsonl")
+# Entries that would grow the spill file past this are dropped
+FIREBASE_LOG_SPILL_MAX_BYTES = int(os.getenv("FIREBASE_LOG_SPILL_MAX_BYTES", str(50 * 1024 * 1024)))
+
+_PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+
+class PushIdGenerator:
+    """
+    Chronologically ordered keys in the format Firebase push() uses, so
+    events written through update() sort the same way pushed ones did.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_time = 0
+        self._last_random = [0] * 12
+
+    def __call__(self) -> str:
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now == self._last_time:
+                # Same millisecond: increment the random part to keep order
+                for index in range(11, -1, -1):
+                    if self._last_random[index] != 63:
+                        self._last_random[index] += 1
+                        break
+                    self._last_random[index] = 0
+            else:
+                self._last_time = now
+                self._last_random = [random.randrange(64) for _ in range(12)]
+            stamp = []
+            for _ in range(8):
+                stamp.append(_PUSH_CHARS[now % 64])
+                now //= 64
+            return "".join(reversed(stamp)) + "".join(_PUSH_CHARS[value] for value in self._last_random)
+
+
+class FirebaseEventLogger:
+    """
+    Queues log entries in memory and writes them from a background thread,
+    many entries per multi-path update(). Request handlers never wait on
+    Firebase; when the queue is full entries are spilled to disk or dropped.
+    """
+
+    def __init__(
+        self,
+        ref_factory: Callable[[], Any],
+        queue_size: int = FIREBASE_LOG_QUEUE_SIZE,
+        batch_size: int = FIREBASE_LOG_BATCH_SIZE,
+        flush_seconds: float = FIREBASE_LOG_FLUSH_SECONDS,
+        spill_path: Optional[str] = FIREBASE_LOG_SPILL_PATH,
+        spill_max_bytes: int = FIREBASE_LOG_SPILL_MAX_BYTES
+    ):
+        self.ref_factory = ref_factory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.spill_path = spill_path or None
+        self.spill_max_bytes = spill_max_bytes
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._push_id = PushIdGenerator()
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.failed_batches = 0
+
+    def log(self, collection: str, data: Dict[str, Any]) -> None:
+        """Queue data to be stored under a new key in collection (e.g. events, logs)"""
+        self._start()
+        entry = (f"{collection}/{self._push_id()}", data)
+        try:
+            self._queue.put_nowait(entry)
+            with self._lock:
+                self.enqueued += 1
+        except queue.Full:
+            self._overflow([entry])
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="firebase-event-logger", daemon=True)
+                self._thread.start()
+
+    def _overflow(self, entries: list) -> None:
+        spilled = 0
+        if self.spill_path:
+            try:
+                with self._spill_lock:
+                    os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+                    with open(self.spill_path, "a") as spill:
+                        size = spill.tell()
+                        for path, data in entries:
+                            line = json.dumps({"path": path, "data": data}, default=str) + "\n"
+                            size += len(line.encode())
+                            if size > self.spill_max_bytes:
+                                break
+                            spill.write(line)
+                            spilled += 1
+            except Exception as e:
+                print(f"Error spilling Firebase events: {str(e)}")
+        with self._lock:
+            self.spilled += spilled
+            self.dropped += len(entries) - spilled
+
+    def _write(self, entries: list) -> bool:
+        try:
+            self.ref_factory().update({path: data for path, data in entries})
+            with self._lock:
+                self.written += len(entries)
+            return True
+        except Exception as e:
+            print(f"Error writing {len(entries)} Firebase events: {str(e)}")
+            with self._lock:
+                self.failed_batches += 1
+            return False
+
+    def _flush(self, entries: list) -> bool:
+        if not entries:
+            return True
+        if self._write(entries):
+            return True
+        self._overflow(entries)
+        return False
+
+    def _replay_spill(self) -> None:
+        """Upload spilled entries after a successful write shows Firebase is reachable"""
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        replay_path = f"{self.spill_path}.replay"
+        with self._spill_lock:
+            if os.path.exists(replay_path) or not os.path.exists(self.spill_path):
+                return
+            os.replace(self.spill_path, replay_path)
+        entries = []
+        with open(replay_path) as replay:
+            for line in replay:
+                try:
+                    record = json.loads(line)
+                    entries.append((record["path"], record["data"]))
+                except ValueError:
+                    continue
+        for start in range(0, len(entries), self.batch_size):
+            batch = entries[start:start + self.batch_size]
+            if not self._write(batch):
+                self._overflow(entries[start:])
+                break
+            with self._lock:
+                self.replayed += len(batch)
+        os.remove(replay_path)
+
+    def _take(self, limit: int, timeout: float = 0) -> list:
+        """Up to limit queued entries, waiting at most timeout for them"""
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._take(self.batch_size, self.flush_seconds)
+            if self._flush(batch) and batch and not self._stop.is_set():
+                self._replay_spill()
+        # Shutting down: write what is left while stop() waits for us
+        while batch := self._take(self.batch_size):
+            self._flush(batch)
+
+    def stop(self, timeout: float = 10) -> None:
+        """
+        Write everything queued so far, for up to timeout seconds; what is
+        still queued or cannot be written is spilled
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout)
+        if thread.is_alive():
+            print("Firebase event logger did not finish in time; spilling the rest")
+        while batch := self._take(self.batch_size):
+            self._overflow(batch)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "replayed": self.replayed,
+                "failed_batches": self.failed_batches
+            }
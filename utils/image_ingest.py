@@ -0,0 +1,101 @@
+import os
+from typing import BinaryIO
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image, ImageOps
+from starlette.concurrency import run_in_threadpool
+
+# Uploads larger than this are rejected while they are being copied
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Longest side of stored photos, and of their thumbnails
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1600"))
+IMAGE_THUMBNAIL_DIMENSION = int(os.getenv("IMAGE_THUMBNAIL_DIMENSION", "256"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()  # jpeg or webp
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+# Refuse decompression bombs before decoding
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "50000000"))
+ACCEPTED_FORMATS = {"JPEG", "MPO", "PNG", "WEBP"}
+
+_EXTENSIONS = {"jpeg": "jpg", "webp": "webp"}
+
+
+def _copy_limited(source: BinaryIO, target_path: str, max_bytes: int) -> int:
+    """Copy source to target_path in chunks; raises 413 once max_bytes is exceeded"""
+    size = 0
+    with open(target_path, "wb") as target:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Image exceeds the {max_bytes} byte upload limit")
+            target.write(chunk)
+    return size
+
+
+def _save(image: Image.Image, path: str) -> None:
+    tmp_path = f"{path}.{uuid4().hex}.tmp"
+    if IMAGE_FORMAT == "webp":
+        image.save(tmp_path, "WEBP", quality=IMAGE_QUALITY, method=4)
+    else:
+        image.save(tmp_path, "JPEG", quality=IMAGE_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp_path, path)
+
+
+def ingest_image(source: BinaryIO, dest_dir: str, base_name: str, max_bytes: int = UPLOAD_MAX_BYTES) -> dict:
+    """
+    Store an uploaded photo as dest_dir/<base_name>.<ext> plus a
+    <base_name>_thumb.<ext> thumbnail: EXIF rotation applied, downscaled to
+    IMAGE_MAX_DIMENSION and re-encoded as IMAGE_FORMAT without metadata.
+    Blocking; call it from a worker thread.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    extension = _EXTENSIONS.get(IMAGE_FORMAT, "jpg")
+    image_path = os.path.join(dest_dir, f"{base_name}.{extension}")
+    thumbnail_path = os.path.join(dest_dir, f"{base_name}_thumb.{extension}")
+    upload_path = os.path.join(dest_dir, f".{base_name}.{uuid4().hex}.upload")
+    try:
+        upload_bytes = _copy_limited(source, upload_path, max_bytes)
+        try:
+            with Image.open(upload_path) as decoded:
+                if decoded.format not in ACCEPTED_FORMATS:
+                    raise HTTPException(status_code=400, detail=f"Unsupported image format: {decoded.format}")
+                if decoded.width * decoded.height > IMAGE_MAX_PIXELS:
+                    raise HTTPException(status_code=400, detail="Image dimensions too large")
+                # thumbnail() decodes JPEGs at a reduced scale when it can; the
+                # bound is square, so it does not matter that rotation comes after
+                decoded.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+                # Returns a copy, which stays usable once the file is closed
+                image = ImageOps.exif_transpose(decoded)
+                if image.mode in ("RGBA", "LA", "P"):
+                    image = image.convert("RGBA")
+                    background = Image.new("RGB", image.size, "white")
+                    background.paste(image, mask=image.getchannel("A"))
+                    image = background
+                elif image.mode != "RGB":
+                    image = image.convert("RGB")
+        except (OSError, Image.DecompressionBombError, SyntaxError):
+            raise HTTPException(status_code=400, detail="Uploaded file is not a valid image")
+        _save(image, image_path)
+        thumbnail = image.copy()
+        thumbnail.thumbnail((IMAGE_THUMBNAIL_DIMENSION, IMAGE_THUMBNAIL_DIMENSION), Image.LANCZOS)
+        _save(thumbnail, thumbnail_path)
+    finally:
+        try:
+            os.remove(upload_path)
+        except FileNotFoundError:
+            pass
+    return {
+        "image_path": image_path,
+        "thumbnail_path": thumbnail_path,
+        "width": image.width,
+        "height": image.height,
+        "upload_bytes": upload_bytes,
+        "stored_bytes": os.path.getsize(image_path)
+    }
+
+
+async def ingest_upload(file: UploadFile, dest_dir: str, base_name: str) -> dict:
+    """ingest_image() for an UploadFile, run off the event loop"""
+    await file.seek(0)
+    return await run_in_threadpool(ingest_image, file.file, dest_dir, base_name)
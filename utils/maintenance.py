@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from sqlalchemy import text
+
+MAINTENANCE_SCHEDULER = os.getenv("MAINTENANCE_SCHEDULER", "true").lower() == "true"
+# Each run is delayed by up to this fraction of the job's interval, so
+# workers started together do not all wake at the same moment
+MAINTENANCE_JITTER = float(os.getenv("MAINTENANCE_JITTER", "0.1"))
+
+
+def advisory_lock_key(name: str) -> int:
+    """Stable signed 64-bit key for pg_try_advisory_xact_lock"""
+    return int.from_bytes(hashlib.sha256(f"maintenance:{name}".encode()).digest()[:8], "big", signed=True)
+
+
+class MaintenanceJob:
+    def __init__(self, name: str, interval_seconds: float, func: Callable[[Any], Any]):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.func = func
+        self.next_run = 0.0
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = None
+        self.last_result = None
+        self.last_error = None
+        self.last_run_at = None
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval_seconds,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "last_ms": round(self.last_seconds * 1000, 1) if self.last_seconds is not None else None,
+            "avg_ms": round(self.total_seconds / self.runs * 1000, 1) if self.runs else None,
+            "max_ms": round(self.max_seconds * 1000, 1),
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+            "last_run_at": self.last_run_at
+        }
+
+
+class MaintenanceScheduler:
+    """
+    Runs registered maintenance jobs from a background thread. Every worker
+    runs a scheduler; a transaction-level advisory lock per job plus the
+    maintenance_runs table make sure only one of them runs a job per interval.
+    Job functions take a Session and return something JSON-serialisable.
+    File jobs assume every worker shares the uploads and generated directories.
+    """
+
+    def __init__(self, engine_factory: Callable[[], Any], session_factory: Callable[[], Any], jitter: float = MAINTENANCE_JITTER):
+        self.engine_factory = engine_factory
+        self.session_factory = session_factory
+        self.jitter = jitter
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, name: str, interval_seconds: float, func: Callable[[Any], Any]) -> None:
+        if interval_seconds <= 0:
+            return
+        self.jobs[name] = MaintenanceJob(name, interval_seconds, func)
+
+    def _delay(self, job: MaintenanceJob) -> float:
+        return job.interval_seconds * random.uniform(0, self.jitter)
+
+    def start(self) -> Optional[threading.Thread]:
+        if not MAINTENANCE_SCHEDULER or not self.jobs:
+            return None
+        with self._lock:
+            if self._thread is not None:
+                return self._thread
+            now = time.monotonic()
+            for job in self.jobs.values():
+                job.next_run = now + self._delay(job)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="maintenance-scheduler", daemon=True)
+            self._thread.start()
+            return self._thread
+
+    def stop(self, timeout: float = 30) -> None:
+        """Stop scheduling; a job that is running finishes its current batch first"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            job = min(self.jobs.values(), key=lambda job: job.next_run)
+            wait = job.next_run - time.monotonic()
+            if wait > 0:
+                self._stop.wait(wait)
+                continue
+            self.run_job(job)
+            job.next_run = time.monotonic() + job.interval_seconds + self._delay(job)
+
+    def run_job(self, job: MaintenanceJob, force: bool = False) -> bool:
+        """
+        Run job if this worker wins its lock and no worker ran it within the
+        interval (unless force). Returns whether it ran.
+        """
+        try:
+            with self.engine_factory().begin() as conn:
+                # Held until this transaction ends, so it also works through PgBouncer
+                if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": advisory_lock_key(job.name)}).scalar():
+                    job.skipped += 1
+                    return False
+                last_finished = conn.execute(text(
+                    "SELECT extract(epoch FROM now() - finished_at) FROM maintenance_runs WHERE job = :job"
+                ), {"job": job.name}).scalar()
+                # Slack for the jitter, so a run slightly early is not skipped
+                if not force and last_finished is not None and last_finished < job.interval_seconds * (1 - self.jitter):
+                    job.skipped += 1
+                    return False
+
+                started = time.perf_counter()
+                result, error = None, None
+                db = self.session_factory()
+                try:
+                    result = job.func(db)
+                except Exception as e:
+                    error = str(e)
+                    print(f"Maintenance job {job.name} failed: {error}")
+                finally:
+                    db.close()
+                elapsed = time.perf_counter() - started
+
+                conn.execute(text(
+                    "INSERT INTO maintenance_runs (job, finished_at, duration_ms, result, error) "
+                    "VALUES (:job, now(), :duration_ms, CAST(:result AS JSONB), :error) "
+                    "ON CONFLICT (job) DO UPDATE SET finished_at = EXCLUDED.finished_at, "
+                    "duration_ms = EXCLUDED.duration_ms, result = EXCLUDED.result, error = EXCLUDED.error"
+                ), {
+                    "job": job.name,
+                    "duration_ms": round(elapsed * 1000, 1),
+                    "result": json.dumps(result, default=str),
+                    "error": error
+                })
+        except Exception as e:
+            print(f"Maintenance scheduler error for {job.name}: {str(e)}")
+            return False
+
+        with self._lock:
+            job.runs += 1
+            job.failures += error is not None
+            job.total_seconds += elapsed
+            job.max_seconds = max(job.max_seconds, elapsed)
+            job.last_seconds = elapsed
+            job.last_result = result
+            job.last_error = error
+            job.last_run_at = datetime.utcnow().isoformat()
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "jobs": {name: job.stats() for name, job in self.jobs.items()}
+            }
+
+
+def create_maintenance_scheduler() -> MaintenanceScheduler:
+    from database import SessionLocal, engine
+    from tasks.cleanup import cleanup_expired_api_keys, purge_stale_assets, purge_temp_files
+    from tasks.rollups import rebuild_analytics_rollups
+    from utils.render_queue import requeue_stale_render_jobs
+
+    scheduler = MaintenanceScheduler(lambda: engine, SessionLocal)
+    # An interval of 0 disables a job
+    scheduler.register(
+        "expire_api_keys", float(os.getenv("MAINTENANCE_API_KEYS_INTERVAL_SECONDS", "900")), cleanup_expired_api_keys
+    )
+    scheduler.register(
+        "purge_temp_files", float(os.getenv("MAINTENANCE_TEMP_FILES_INTERVAL_SECONDS", "3600")), purge_temp_files
+    )
+    scheduler.register(
+        "purge_stale_assets", float(os.getenv("MAINTENANCE_ASSETS_INTERVAL_SECONDS", "86400")), purge_stale_assets
+    )
+    scheduler.register(
+        "rebuild_rollups", float(os.getenv("MAINTENANCE_ROLLUPS_INTERVAL_SECONDS", "86400")), rebuild_analytics_rollups
+    )
+    scheduler.register(
+        "requeue_render_jobs", float(os.getenv("MAINTENANCE_RENDER_JOBS_INTERVAL_SECONDS", "300")), requeue_stale_render_jobs
+    )
+    return scheduler
+
+
+maintenance_scheduler = create_maintenance_scheduler()
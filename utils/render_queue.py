@@ -0,0 +1,197 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+from uuid import uuid4
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# Queued jobs older than this are taken to be lost (crash, SIGKILL, redeploy)
+RENDER_JOB_TIMEOUT_SECONDS = float(os.getenv("RENDER_JOB_TIMEOUT_SECONDS", "900"))
+RENDER_JOB_MAX_ATTEMPTS = int(os.getenv("RENDER_JOB_MAX_ATTEMPTS", "3"))
+RENDER_JOB_REQUEUE_BATCH_SIZE = 500
+
+_render_executor: Optional[ProcessPoolExecutor] = None
+_render_executor_lock = threading.Lock()
+# Records finished jobs; done callbacks run on the pool's management thread,
+# which must not wait on the database
+_finish_executor: Optional[ThreadPoolExecutor] = None
+
+
+def card_user_data(user_id: int, name: str, email: str, image_path: str, qr_path: Optional[str] = None) -> dict:
+    return {
+        "name": name,
+        "profile_image_path": str(Path(image_path)),
+        "qr_code_path": qr_path,
+        "user_id": str(user_id),
+        "email": str(email)
+    }
+
+
+def render_user_assets(user_id: int, name: str, email: str, image_path: str) -> dict:
+    """Generate the QR code and visitor card for a user. Runs in a worker process."""
+    from qr_generation import load_or_create_qr
+    from template_generator import create_visitor_card
+
+    qr_path, qr_img, _ = load_or_create_qr(user_id, name, email)
+    card_path = create_visitor_card(card_user_data(user_id, name, email, image_path, qr_path), qr_img)
+    return {"qr_path": qr_path, "card_path": card_path}
+
+
+def cached_card(user_id: int, name: str, email: str, image_path: str) -> Optional[str]:
+    """Current visitor card of a user if already rendered"""
+    from template_generator import cached_visitor_card
+
+    return cached_visitor_card(card_user_data(user_id, name, email, image_path))
+
+
+def render_card(user_id: int, name: str, email: str, image_path: str) -> Future:
+    """Render a card on the pool without a job row; cached cards return at once"""
+    return get_render_executor().submit(render_user_assets, user_id, name, email, image_path)
+
+
+def get_render_executor() -> ProcessPoolExecutor:
+    """The render pool; replaced when a worker died and broke it"""
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is not None and _render_executor._broken:
+            print(f"Render pool is broken ({_render_executor._broken}); starting a new one")
+            _render_executor.shutdown(wait=False, cancel_futures=True)
+            _render_executor = None
+        if _render_executor is None:
+            # spawn keeps the children free of the parent's DB connections and threads
+            _render_executor = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _render_executor
+
+
+def _get_finish_executor() -> ThreadPoolExecutor:
+    global _finish_executor
+    with _render_executor_lock:
+        if _finish_executor is None:
+            _finish_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render-job-finisher")
+        return _finish_executor
+
+
+def shutdown_render_executor() -> None:
+    global _render_executor, _finish_executor
+    with _render_executor_lock:
+        executor, _render_executor = _render_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+    # After the pool, so the results of its last jobs are recorded
+    with _render_executor_lock:
+        finisher, _finish_executor = _finish_executor, None
+    if finisher is not None:
+        finisher.shutdown(wait=True)
+
+
+def new_render_job_id() -> str:
+    return uuid4().hex
+
+
+def submit_render_job(job_id: str, user_id: int, name: str, email: str, image_path: str) -> Future:
+    """
+    Queue rendering; the job row must already be committed. Outbox emails
+    waiting on the job are sent once it finishes.
+    """
+    finisher = _get_finish_executor()
+    future = get_render_executor().submit(render_user_assets, user_id, name, email, image_path)
+    future.add_done_callback(lambda done: finisher.submit(_finish_render_job, job_id, user_id, done))
+    return future
+
+
+def requeue_stale_render_jobs(db, timeout_seconds: float = RENDER_JOB_TIMEOUT_SECONDS) -> dict:
+    """
+    Resubmit queued jobs whose process went away before finishing them, and
+    fail those out of attempts so emails waiting on them are released.
+    Rendering is idempotent, so resubmitting a job that is merely slow is safe.
+    """
+    from sqlalchemy import select, update
+    import models
+    from utils.email_outbox import outbox_drainer
+
+    jobs = models.RenderJob
+    now = datetime.utcnow()
+    stale = [jobs.status == "queued", jobs.submitted_at < now - timedelta(seconds=timeout_seconds)]
+
+    failed = db.execute(
+        update(jobs).where(*stale, jobs.attempts >= RENDER_JOB_MAX_ATTEMPTS).values(
+            status="failed",
+            error=f"Render not finished after {RENDER_JOB_MAX_ATTEMPTS} attempts",
+            finished_at=now
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    due = select(jobs.job_id).where(*stale).order_by(jobs.submitted_at).limit(
+        RENDER_JOB_REQUEUE_BATCH_SIZE
+    ).with_for_update(skip_locked=True)
+    claimed = db.execute(
+        update(jobs).where(jobs.job_id.in_(due)).values(
+            attempts=jobs.attempts + 1,
+            submitted_at=now
+        ).returning(jobs.job_id, jobs.user_id).execution_options(synchronize_session=False)
+    ).all()
+    users = {
+        user.user_id: user for user in db.query(
+            models.User.user_id, models.User.name, models.User.email, models.User.image_path
+        ).filter(models.User.user_id.in_({job.user_id for job in claimed}))
+    } if claimed else {}
+    db.commit()
+
+    for job in claimed:
+        user = users.get(job.user_id)
+        if user is None:
+            continue
+        submit_render_job(job.job_id, user.user_id, user.name, user.email, user.image_path)
+    if failed:
+        outbox_drainer.wake()
+    return {"requeued": len(claimed), "failed": failed}
+
+
+def _finish_render_job(job_id: str, user_id: int, future) -> None:
+    from database import SessionLocal
+    import models
+    from utils.email_outbox import outbox_drainer
+    from utils.response_cache import bump_data_version
+
+    error = future.exception()
+    result = None if error else future.result()
+    if isinstance(error, BrokenProcessPool):
+        # Not the job's fault: leave it queued for requeue_stale_render_jobs
+        print(f"Render job {job_id} lost to a broken render pool; it will be requeued")
+        return
+
+    db = SessionLocal()
+    try:
+        job = db.query(models.RenderJob).filter(models.RenderJob.job_id == job_id).first()
+        if job:
+            job.status = "failed" if error else "done"
+            job.error = str(error) if error else None
+            job.qr_path = result["qr_path"] if result else None
+            job.card_path = result["card_path"] if result else None
+            job.finished_at = datetime.utcnow()
+        if result:
+            db.query(models.User).filter(models.User.user_id == user_id).update(
+                {models.User.qr_code: result["qr_path"]},
+                synchronize_session=False
+            )
+        db.commit()
+        bump_data_version(db)
+    except Exception as e:
+        db.rollback()
+        print(f"Error finishing render job {job_id}: {str(e)}")
+    finally:
+        db.close()
+
+    if error:
+        print(f"Render job {job_id} failed for user {user_id}: {str(error)}")
+    else:
+        print(f"Render job {job_id} finished for user {user_id}: {result['card_path']}")
+
+    # Welcome emails waiting for this card can go now
+    outbox_drainer.wake()
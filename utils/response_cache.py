@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Bumped after every committed write that changes what the dashboards show
+DATA_VERSION_SEQUENCE = "data_version_seq"
+
+
+def current_data_version(db: Session) -> int:
+    # last_value is already 1 before the first nextval; is_called tells them apart
+    return db.execute(text(
+        f"SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {DATA_VERSION_SEQUENCE}"
+    )).scalar()
+
+
+def bump_data_version(db: Session) -> None:
+    """Call after commit so no reader can cache pre-commit data under the new version"""
+    try:
+        db.execute(text(f"SELECT nextval('{DATA_VERSION_SEQUENCE}')"))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error bumping data version: {str(e)}")
+
+
+async def bump_data_version_async(db: AsyncSession) -> None:
+    try:
+        await db.execute(text(f"SELECT nextval('{DATA_VERSION_SEQUENCE}')"))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        print(f"Error bumping data version: {str(e)}")
+
+
+class MemoryCacheBackend:
+    """Per-process LRU store"""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, version: int, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (version, value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class PostgresCacheBackend:
+    """
+    Store shared by every worker, kept in an UNLOGGED table.
+    Uses its own short transactions so request sessions are not committed.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                text("SELECT version, payload, expires_at FROM response_cache WHERE cache_key = :key"),
+                {"key": key}
+            ).first()
+        return (row.version, row.payload, row.expires_at) if row else None
+
+    def set(self, key: str, version: int, value: Any, expires_at: float) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO response_cache (cache_key, version, payload, expires_at) "
+                    "VALUES (:key, :version, CAST(:payload AS jsonb), :expires_at) "
+                    "ON CONFLICT (cache_key) DO UPDATE SET version = excluded.version, "
+                    "payload = excluded.payload, expires_at = excluded.expires_at"
+                ),
+                {"key": key, "version": version, "payload": json.dumps(value), "expires_at": expires_at}
+            )
+
+    def size(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT count(*) FROM response_cache")).scalar()
+
+
+class ResponseCache:
+    """
+    Caches endpoint responses under the data version they were computed at.
+    An entry is served only while the version is unchanged and its TTL holds.
+    """
+
+    def __init__(self, backend, ttl_seconds: float = 300):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(endpoint: str, params: dict) -> str:
+        return f"{endpoint}:{json.dumps(params, sort_keys=True, default=str)}"
+
+    def get_or_compute(self, db: Session, endpoint: str, params: dict, compute: Callable[[], Any]) -> Any:
+        key = self.make_key(endpoint, params)
+        try:
+            version = current_data_version(db)
+            entry = self.backend.get(key)
+        except Exception as e:
+            print(f"Response cache unavailable: {str(e)}")
+            return compute()
+
+        if entry is not None and entry[0] == version and entry[2] > time.time():
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+
+        with self._lock:
+            self.misses += 1
+        value = compute()
+        try:
+            self.backend.set(key, version, value, time.time() + self.ttl_seconds)
+        except Exception as e:
+            print(f"Error storing cached response: {str(e)}")
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        try:
+            size = self.backend.size()
+        except Exception:
+            size = None
+        return {
+            "backend": type(self.backend).__name__,
+            "size": size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0
+        }
+
+
+def create_response_cache() -> ResponseCache:
+    ttl_seconds = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+    if os.getenv("RESPONSE_CACHE_BACKEND", "memory") == "postgres":
+        from database import engine
+        return ResponseCache(PostgresCacheBackend(engine), ttl_seconds)
+    return ResponseCache(MemoryCacheBackend(int(os.getenv("RESPONSE_CACHE_SIZE", "256"))), ttl_seconds)
+
+
+response_cache = create_response_cache()
@@ -1,9 +1,40 @@
 from datetime import datetime, timedelta
+import os
 import secrets
+from typing import Optional
 from fastapi import HTTPException, Header
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
 import pytz
+from utils.api_key_cache import api_key_cache, hash_api_key
+
+# Concurrent logins kept per app user; beyond this the least recently seen device is signed out
+APP_USER_MAX_SESSIONS = int(os.getenv("APP_USER_MAX_SESSIONS", "10"))
+# Minimum interval between last_seen_at writes for one session
+APP_USER_SESSION_TOUCH_SECONDS = float(os.getenv("APP_USER_SESSION_TOUCH_SECONDS", "300"))
+
+def session_user(app_user: models.AppUsers, api_key: str, expires_at: datetime) -> models.AppUsers:
+    """Transient AppUsers whose api_key/api_key_expiry describe the session's key"""
+    return models.AppUsers(
+        user_id=app_user.user_id,
+        email=app_user.email,
+        image_path=app_user.image_path,
+        created_at=app_user.created_at,
+        api_key=api_key,
+        api_key_expiry=expires_at
+    )
+
+def sessions_to_replace(sessions: list, device_id: Optional[str]) -> list:
+    """
+    Sessions a new login ends: the same device's previous login, expired
+    ones, and the least recently seen beyond APP_USER_MAX_SESSIONS - 1
+    """
+    now = datetime.utcnow()
+    ended = [s for s in sessions if s.expires_at < now or (device_id and s.device_id == device_id)]
+    remaining = sorted((s for s in sessions if s not in ended), key=lambda s: s.last_seen_at, reverse=True)
+    return ended + remaining[max(APP_USER_MAX_SESSIONS - 1, 0):]
+
 class SecurityHandler:
     def __init__(self):
         self.API_KEY_EXPIRY_HOURS = 24  # API key expires after 24 hours
@@ -12,51 +43,84 @@ class SecurityHandler:
         """Generate a unique API key"""
         return secrets.token_urlsafe(32)
 
-    def login_user(self, db: Session, app_user: models.AppUsers) -> dict:
-        """Create a new API key on login"""
+    def _new_session(self, app_user: models.AppUsers, device_id: Optional[str]) -> tuple:
         api_key = self.generate_api_key()
         expiry = datetime.now(pytz.timezone('Asia/Kolkata')) + timedelta(hours=self.API_KEY_EXPIRY_HOURS)
-        
-        # Update user's API key and expiry
-        app_user.api_key = api_key
-        app_user.api_key_expiry = expiry
-        db.commit()
-        
+        session = models.AppUserSession(
+            app_user_id=app_user.user_id,
+            key_hash=hash_api_key(api_key),
+            device_id=device_id,
+            expires_at=models.to_naive_utc(expiry)
+        )
+        return api_key, expiry, session
+
+    async def login_user_async(self, db: AsyncSession, app_user: models.AppUsers, device_id: Optional[str] = None) -> dict:
+        """Create a new API key for this device on login; other devices stay signed in"""
+        api_key, expiry, new_session = self._new_session(app_user, device_id)
+        sessions = (await db.execute(
+            select(models.AppUserSession).where(models.AppUserSession.app_user_id == app_user.user_id)
+        )).scalars().all()
+        for session in sessions_to_replace(sessions, device_id):
+            await api_key_cache.invalidate_hash_async(session.key_hash, db)
+            await db.delete(session)
+        db.add(new_session)
+        await db.commit()
+
         return {
             "api_key": api_key,
             "expires_at": expiry.isoformat()
         }
 
-    def logout_user(self, db: Session, app_user: models.AppUsers) -> bool:
-        """Remove API key on logout"""
+    async def logout_user_async(self, db: AsyncSession, app_user: models.AppUsers) -> bool:
+        """Remove the API key the user authenticated with; other devices stay signed in"""
         try:
+            await api_key_cache.invalidate_async(app_user.api_key, db)
+            # app_user is a session copy whose api_key is the presented key
+            if app_user.api_key:
+                await db.execute(delete(models.AppUserSession).where(
+                    models.AppUserSession.key_hash == hash_api_key(app_user.api_key)
+                ))
             app_user.api_key = None
             app_user.api_key_expiry = None
-            db.commit()
+            await db.commit()
             return True
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             raise HTTPException(status_code=500, detail=f"Logout failed: {str(e)}")
 
-    def verify_api_key(self, db: Session, api_key: str) -> models.AppUsers:
+    async def verify_api_key_async(self, db: AsyncSession, api_key: str) -> models.AppUsers:
         """Verify API key and check expiry"""
         if not api_key:
             raise HTTPException(status_code=401, detail="API key is required")
-            
-        app_user = db.query(models.AppUsers).filter(
-            models.AppUsers.api_key == api_key
-        ).first()
-        
-        if not app_user:
+
+        cached_user = api_key_cache.get(api_key)
+        if cached_user:
+            return cached_user
+
+        row = (await db.execute(
+            select(models.AppUserSession, models.AppUsers).join(
+                models.AppUsers, models.AppUsers.user_id == models.AppUserSession.app_user_id
+            ).where(models.AppUserSession.key_hash == hash_api_key(api_key))
+        )).first()
+
+        if not row:
             raise HTTPException(status_code=401, detail="Invalid API key")
-            
-        if not app_user.api_key_expiry or app_user.api_key_expiry < datetime.utcnow():
+
+        session, app_user = row
+        now = datetime.utcnow()
+        if session.expires_at < now:
             # Clear expired key
-            app_user.api_key = None
-            app_user.api_key_expiry = None
-            db.commit()
+            await api_key_cache.invalidate_async(api_key, db)
+            await db.delete(session)
+            await db.commit()
             raise HTTPException(status_code=401, detail="API key expired. Please login again")
-            
-        return app_user
 
-security_handler = SecurityHandler() 
\ No newline at end of file
+        user = session_user(app_user, api_key, session.expires_at)
+        if session.last_seen_at < now - timedelta(seconds=APP_USER_SESSION_TOUCH_SECONDS):
+            session.last_seen_at = now
+            await db.commit()
+
+        api_key_cache.put(api_key, user)
+        return user
+
+security_handler = SecurityHandler()
@@ -0,0 +1,267 @@
+import os
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from email.message import Message
+from typing import Optional
+
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "ssl")  # ssl, starttls or none (local test servers)
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+# Providers cap messages per session; reconnect before hitting the cap
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+# Idle connections are checked with NOOP before reuse
+SMTP_IDLE_CHECK_SECONDS = float(os.getenv("SMTP_IDLE_CHECK_SECONDS", "30"))
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", "10000"))
+
+
+class SmtpAccount:
+    """Sender credentials plus the server they log in to"""
+
+    def __init__(self, email: str, password: Optional[str], server: str, port: int, security: str = SMTP_SECURITY):
+        self.email = email
+        self.password = password
+        self.server = server
+        self.port = port
+        self.security = security
+
+
+def sender_accounts() -> list:
+    """Configured sender accounts in rotation order: SMTP_EMAIL, SMTP_EMAIL2, SMTP_EMAIL3"""
+    server = os.getenv("SMTP_SERVER", "localhost")
+    port = int(os.getenv("SMTP_PORT", "465"))
+    accounts = []
+    for suffix in ("", "2", "3"):
+        email = os.getenv(f"SMTP_EMAIL{suffix}")
+        if email:
+            accounts.append(SmtpAccount(email, os.getenv(f"SMTP_PASSWORD{suffix}"), server, port))
+    return accounts
+
+
+class SmtpConnection:
+    """One authenticated SMTP session, reused for many messages"""
+
+    def __init__(self, account: SmtpAccount, timeout: float = SMTP_TIMEOUT_SECONDS):
+        self.account = account
+        self.timeout = timeout
+        self.server = None
+        self.messages = 0
+        self.last_used = 0.0
+
+    def open(self) -> None:
+        account = self.account
+        if account.security == "ssl":
+            server = smtplib.SMTP_SSL(account.server, account.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(account.server, account.port, timeout=self.timeout)
+            if account.security == "starttls":
+                server.starttls(context=ssl.create_default_context())
+        if account.password:
+            server.login(account.email, account.password)
+        self.server = server
+        self.messages = 0
+        self.last_used = time.monotonic()
+
+    def usable(self) -> bool:
+        if self.server is None or self.messages >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+            return False
+        if time.monotonic() - self.last_used < SMTP_IDLE_CHECK_SECONDS:
+            return True
+        try:
+            return self.server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def send(self, msg: Message) -> None:
+        self.server.send_message(msg)
+        self.messages += 1
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+        self.server = None
+
+
+class EmailWorker:
+    """
+    Sends queued emails from dedicated threads. Each thread keeps one
+    persistent connection per sender account and sends message after message
+    over it, reconnecting when the server drops it.
+    """
+
+    def __init__(self, workers: int = EMAIL_WORKERS, queue_size: int = EMAIL_QUEUE_SIZE, accounts: Optional[list] = None):
+        self.workers = workers
+        self._accounts = accounts
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.sent = 0
+        self.failed = 0
+        self.reconnects = 0
+        self.connections_opened = 0
+        self.send_seconds = 0.0
+
+    @property
+    def accounts(self) -> list:
+        if self._accounts is None:
+            self._accounts = sender_accounts()
+        return self._accounts
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"email-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, msg: Message, account: Optional[SmtpAccount] = None) -> Future:
+        """
+        Queue a message; the future resolves to True once the server accepted it.
+        Without an account the first configured sender is used. The From header
+        is set to the sending account.
+        """
+        self._start()
+        future = Future()
+        self._queue.put((msg, account, future))
+        return future
+
+    def send(self, msg: Message, account: Optional[SmtpAccount] = None, timeout: Optional[float] = None) -> bool:
+        """Queue a message and wait for it; False on failure"""
+        try:
+            return self.submit(msg, account).result(timeout=timeout)
+        except Exception as e:
+            print(f"❌ SMTP Error: {str(e)}")
+            return False
+
+    def _pick_account(self) -> SmtpAccount:
+        accounts = self.accounts
+        if not accounts:
+            raise ValueError("Email credentials not configured")
+        return accounts[0]
+
+    def _run(self) -> None:
+        connections = {}
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                msg, account, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    self._deliver(connections, msg, account or self._pick_account())
+                    future.set_result(True)
+                except Exception as e:
+                    with self._lock:
+                        self.failed += 1
+                    future.set_exception(e)
+        finally:
+            for connection in connections.values():
+                connection.close()
+
+    def _deliver(self, connections: dict, msg: Message, account: SmtpAccount) -> None:
+        del msg["From"]
+        msg["From"] = account.email
+        connection = connections.get(account.email)
+        if connection is None:
+            connection = connections[account.email] = SmtpConnection(account)
+
+        for attempt in range(2):
+            if not connection.usable():
+                connection.close()
+                connection.open()
+                with self._lock:
+                    self.connections_opened += 1
+            started = time.monotonic()
+            try:
+                connection.send(msg)
+                break
+            except smtplib.SMTPRecipientsRefused:
+                raise
+            except smtplib.SMTPResponseException as e:
+                # 421: the server is closing the session; anything else is about this message
+                if e.smtp_code != 421 or attempt:
+                    raise
+            except OSError:
+                if attempt:
+                    connection.close()
+                    raise
+            connection.close()
+            with self._lock:
+                self.reconnects += 1
+
+        finished = time.monotonic()
+        with self._lock:
+            self.sent += 1
+            self.send_seconds += finished - started
+            self._recent.append(finished)
+            # Kept for the per-minute rate in stats()
+            while self._recent and self._recent[0] < finished - 60:
+                self._recent.popleft()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Send what is queued, then close every connection"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            sent_last_minute = sum(1 for finished in self._recent if finished >= now - 60)
+            return {
+                "workers": self.workers,
+                "queue_depth": self._queue.qsize(),
+                "sent": self.sent,
+                "failed": self.failed,
+                "reconnects": self.reconnects,
+                "connections_opened": self.connections_opened,
+                "sent_last_minute": sent_last_minute,
+                "avg_send_ms": round(self.send_seconds / self.sent * 1000, 2) if self.sent else 0
+            }
+
+
+email_worker = EmailWorker()
+
+
+if __name__ == "__main__":
+    # Smoke test against any SMTP server, e.g. a local stand-in:
+    #   python -m smtpd -n -c DebuggingServer localhost:8025
+    #   SMTP_SERVER=localhost SMTP_PORT=8025 SMTP_SECURITY=none SMTP_EMAIL=test@example.com \
+    #       python -m utils.smtp_pool you@example.com 200
+    import sys
+    from email.mime.text import MIMEText
+
+    to_email, count = sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    started = time.monotonic()
+    futures = []
+    for index in range(count):
+        msg = MIMEText(f"Test message {index}")
+        msg["To"] = to_email
+        msg["Subject"] = f"SMTP pool test {index}"
+        futures.append(email_worker.submit(msg))
+    failures = sum(1 for future in futures if future.exception() is not None)
+    elapsed = time.monotonic() - started
+    email_worker.shutdown()
+    print(f"Sent {count - failures}/{count} in {elapsed:.2f}s ({count / elapsed:.1f} msg/s)")
+    print(email_worker.stats())